@@ -1,15 +1,26 @@
 # %%
-import datetime
-import schedule
+import asyncio
 import time
 import thermo.instr.tei49c as tei49c
 import thermo.instr.tei49i as tei49i
+import thermo.common.calibration as calibration
 import thermo.common.configparser as parser
+import thermo.common.datawriter as datawriter
+import thermo.common.logwriter as logwriter
+import thermo.common.metrics as metrics
+import thermo.common.parquetstore as parquetstore
+import thermo.common.serialbus as serialbus
+import thermo.common.staging as staging
+import thermo.common.tcpsession as tcpsession
+from thermo.common.engine import AcquisitionEngine
 
 # %%
 def main():
     try:
         cfg = parser.read_config("thermo.cfg")
+        engine = AcquisitionEngine()
+        if cfg.get('metrics'):
+            metrics.start(cfg['metrics'])
 
         print(f"Initializing calibrator ...")
         name = cfg["calibrator"]["name"]
@@ -17,38 +28,39 @@ def main():
         calibrator.get_config()
         time.sleep(2)
         calibrator.set_config()
-        schedule.every(cfg[name]['sampling_interval']).minutes.at(':05').do(calibrator.get_data)
+        engine.every(cfg[name]['sampling_interval'], calibrator.aget_data, name=name)
 
         print(f"Initializing analyzer(s) ...")
         for analyzer in cfg["analyzers"]:
-            if analyzer == "tei49i_1":
-                tei49i_1 = tei49i.TEI49I(name="tei49i_1", config=cfg)
-                tei49i_1.get_config()
-                tei49i_1.set_config()
-                schedule.every(cfg["tei49i_1"]['sampling_interval']).minutes.at(':10').do(tei49i_1.get_data)
-
-            if analyzer == "tei49i_2":
-                tei49i_2 = tei49i.TEI49I(name="tei49i_2", config=cfg)
-                tei49i_2.get_config()
-                tei49i_2.set_config()
-                schedule.every(cfg["tei49i_2"]['sampling_interval']).minutes.at(':15').do(tei49i_2.get_data)
-
-            if analyzer == "tei49i-ps":
-                tei49i_ps = tei49i.TEI49I(name="tei49i-ps", config=cfg)
-                tei49i_ps.get_config()
-                tei49i_ps.set_config()
-                schedule.every(cfg["tei49i-ps"]['sampling_interval']).minutes.at(':20').do(tei49i_ps.get_data)
+            if cfg[analyzer]['type'] == "TEI49C":
+                instrument = tei49c.TEI49C(name=analyzer, config=cfg)
+            else:
+                instrument = tei49i.TEI49I(name=analyzer, config=cfg)
+            instrument.get_config()
+            instrument.set_config()
+            engine.every(cfg[analyzer]['sampling_interval'], instrument.aget_data, name=analyzer)
 
         print(f"# Begin comparison ...")
-        schedule.every(cfg["calibrator"]["maintain_level"]).minutes.at(':30').do(calibrator.set_o3_conc)
- 
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        engine.every(cfg["calibrator"]["maintain_level"], calibrator.set_o3_conc, offset=30, name="set_o3_conc")
+
+        # configuration used blocking connections, acquisition reconnects through the event loop
+        tcpsession.close_all()
+        asyncio.run(engine.run())
 
     except Exception as err:
         print(err)
 
+    finally:
+        calibration.close_all()
+        # serve the requests still queued, then close ports and sockets
+        serialbus.close_all()
+        tcpsession.close_all()
+        datawriter.close_all()
+        staging.close_all()
+        parquetstore.close_all()
+        metrics.close_all()
+        logwriter.close_all()
+
 if __name__ == "__main__":
     main()
 # %%
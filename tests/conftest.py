@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Drivers connected to local instrument simulators.
+"""
+
+import tempfile
+
+import pytest
+
+import thermo.benchmark as benchmark
+import thermo.common.breaker as breaker
+import thermo.common.ringbuffer as ringbuffer
+import thermo.common.tcpsession as tcpsession
+import thermo.instr.tei49i as tei49i
+from thermo.instr.simulator import InstrumentSimulator, TCPServer
+
+
+@pytest.fixture
+def simulated_tei49i():
+    server = TCPServer(InstrumentSimulator('49i', buffer_size=120, seed=49), port=0)
+    server.start()
+    breaker._breakers.pop('tei49i', None)
+    ringbuffer._buffers.pop('tei49i', None)
+    with tempfile.TemporaryDirectory() as datadir:
+        cfg = benchmark._config(datadir, server.server_address[1], '/dev/null')
+        yield tei49i.TEI49I(name='tei49i', config=cfg)
+    tcpsession.close_all()
+    breaker._breakers.pop('tei49i', None)
+    ringbuffer._buffers.pop('tei49i', None)
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breaker, and its interaction with the chunk size probes of bulk downloads.
+"""
+
+import re
+import socket
+
+import thermo.common.breaker as breaker
+import thermo.common.bulkdownload as bulkdownload
+import thermo.common.metrics as metrics
+
+
+def test_opens_after_threshold_and_closes_after_probe():
+    b = breaker.CircuitBreaker('test-threshold', threshold=2, backoff=0, max_backoff=0)
+    b.failure()
+    assert b.state == breaker.CLOSED
+    b.failure()
+    assert b.state == breaker.OPEN
+    assert b.allow()
+    assert b.state == breaker.HALF_OPEN
+    assert not b.allow()
+    b.success()
+    assert b.state == breaker.CLOSED
+
+
+def test_expected_failures_do_not_count():
+    b = breaker.CircuitBreaker('test-expected', threshold=1, backoff=0, max_backoff=0)
+    for _ in range(5):
+        b.failure(expected=True)
+    assert b.state == breaker.CLOSED
+
+    # an expected failure of the probe leaves the breaker open, but probing again right away
+    b.failure()
+    assert b.allow()
+    b.failure(expected=True)
+    assert b.state == breaker.OPEN
+    assert b.allow()
+
+
+def test_probe_misses_do_not_fail_fast():
+    # large chunks time out, as with 25 records at 9600 baud, but only on the probe
+    def comm(cmd: str):
+        index, size = map(int, cmd.split()[1:])
+        if size >= 25:
+            raise TimeoutError(cmd)
+        return "\n".join(f"{i // 60:02d}:{i % 60:02d} 01-01-24 0C100400 30.1" for i in range(index, index - size, -1))
+
+    b = breaker.CircuitBreaker('test-bulk', threshold=3)
+
+    def guarded(cmd: str, probe=False):
+        if not b.allow():
+            return None
+        try:
+            rcvd = comm(cmd)
+            b.success()
+            return rcvd
+        except TimeoutError:
+            b.failure(expected=probe)
+
+    download = bulkdownload.BulkDownload(comm=guarded, probe=lambda cmd: guarded(cmd, probe=True))
+    stats = download.run(available=200)
+    assert stats['chunk'] == 10
+    assert stats['records'] == 200
+    assert b.state == breaker.CLOSED
+
+
+def test_driver_download_with_timeouts_of_large_chunks(simulated_tei49i):
+    instrument = simulated_tei49i
+    session = instrument._session
+    query = session.query
+
+    def slow_large_chunks(payload: bytes) -> bytes:
+        match = re.search(rb"lrec \d+ (\d+)", payload)
+        if match and int(match.group(1)) >= 25:
+            raise socket.timeout("no response terminator within 2 s")
+        return query(payload)
+
+    session.query = slow_large_chunks
+    stats = instrument.get_all_lrec(save=False)
+    assert stats['chunk'] == 10
+    assert stats['records'] == 120
+    assert instrument._breaker.state == breaker.CLOSED
+    assert instrument.tcpip_comm('o3')
+
+
+def test_driver_saves_nothing_while_open(simulated_tei49i, monkeypatch):
+    instrument = simulated_tei49i
+    written = []
+    monkeypatch.setattr(instrument._writer, 'write', written.append)
+    failures = metrics.PARSE_FAILURES.value(instrument='tei49i')
+    for _ in range(3):
+        instrument._breaker.failure()
+
+    assert instrument.get_data() is None
+    assert written == []
+    assert metrics.PARSE_FAILURES.value(instrument='tei49i') == failures
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked downloads of the logger buffer.
+"""
+
+import datetime
+import os
+import tempfile
+
+import thermo.common.bulkdownload as bulkdownload
+
+
+class Logger:
+    """
+    Buffer of an instrument logging one record per minute, oldest first. 'lrec <index> <n>' returns n records,
+    starting index records back from the newest.
+    """
+
+    def __init__(self, n: int, log_every=None) -> None:
+        self.t = datetime.datetime(2024, 1, 1)
+        self.buffer = []
+        for _ in range(n):
+            self.log()
+        self.log_every = log_every
+        self.chunks = 0
+
+    def log(self) -> None:
+        self.buffer.append(f"{self.t:%H:%M %m-%d-%y} 0C100400 {len(self.buffer)}.0")
+        self.t += datetime.timedelta(minutes=1)
+
+    def comm(self, cmd: str) -> str:
+        if cmd.startswith("no of"):
+            return f"{len(self.buffer)} lrec"
+        index, n = map(int, cmd.split()[1:])
+        records = self.buffer[len(self.buffer) - index:][:n]
+        self.chunks += 1
+        if self.log_every and self.chunks % self.log_every == 0:
+            # a record is logged while the download is running, shifting the buffer
+            self.log()
+        return "\n".join(records)
+
+
+def _download(instrument: Logger, tmp: str, **kwargs) -> tuple:
+    datafile = os.path.join(tmp, "tei49i_all_lrec-20240101000000.dat")
+    download = bulkdownload.BulkDownload(comm=instrument.comm, datafile=datafile, header="time date flags o3",
+                                         chunk_sizes=(10, ), **kwargs)
+    stats = download.run()
+    with open(datafile, encoding='utf8') as fh:
+        return stats, fh.read().splitlines()[1:]
+
+
+def test_records_logged_during_the_download():
+    instrument = Logger(95, log_every=3)
+    with tempfile.TemporaryDirectory() as tmp:
+        stats, lines = _download(instrument, tmp)
+    # records logged meanwhile shift the buffer; no record is skipped or written twice
+    assert len(lines) >= 95
+    assert lines == instrument.buffer[:len(lines)]
+    assert stats['records'] == len(lines)
+
+
+def test_chunks_without_records_logged_meanwhile():
+    instrument = Logger(95)
+    with tempfile.TemporaryDirectory() as tmp:
+        stats, lines = _download(instrument, tmp)
+    assert lines == instrument.buffer
+    assert stats['records'] == 95
+
+
+def test_sync_downloads_only_newer_records():
+    instrument = Logger(60)
+    since = datetime.datetime(2024, 1, 1, 0, 49)
+    with tempfile.TemporaryDirectory() as tmp:
+        datafile = os.path.join(tmp, "tei49i_sync_lrec-20240101010000.dat")
+        download = bulkdownload.BulkDownload(comm=instrument.comm, datafile=datafile, chunk_sizes=(10, ))
+        stats = download.sync(since)
+        with open(datafile, encoding='utf8') as fh:
+            lines = fh.read().splitlines()
+    assert lines == instrument.buffer[50:]
+    assert stats['records'] == 10
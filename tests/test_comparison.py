@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Comparison of analyzers with the calibrator, read from a database built by thermo.sqlite.ingest or the parquet store.
+"""
+
+import datetime
+import os
+import tempfile
+
+import pytest
+
+pl = pytest.importorskip("polars")
+
+import thermo.common.lrec as lrec
+import thermo.common.parquetstore as parquetstore
+import thermo.postproc.comparison as comparison
+import thermo.sqlite.ingest as ingest
+
+CFG = {
+    'calibrator': {'name': 'tei49c-ps', 'tolerance': 30},
+    'analyzers': ['tei49i_1'],
+    'tei49c-ps': {'type': 'TEI49C-PS'},
+    'tei49i_1': {'type': 'TEI49I', 'table': 'tei49i'},
+}
+
+TEI49C = ("pcdate pctime time date o3 flags cellai cellbi bncht lmpt o3lt flowa flowb pres\n"
+          "2023-10-19 12:00:05 12:00 10-19 5012E-2 1c000000 98811 66615 25.5 55.5 99.9 0.538 0.587 491.7\n"
+          "2023-10-19 12:01:05 12:01 10-19 5020E-2 1c000000 98811 66615 25.5 55.5 99.9 0.538 0.587 491.7\n"
+          # flags of a failed lamp, not clean
+          "2023-10-19 12:02:05 12:02 10-19 5030E-2 1c000001 98811 66615 25.5 55.5 99.9 0.538 0.587 491.7\n")
+
+TEI49I = ("pcdate pctime time date o3 flags hio3 cellai cellbi bncht lmpt o3lt flowa flowb pres\n"
+          "2023-10-19 12:00:12 12:00 10-19-23 49.87 0C100400 0.000 98811 66615 25.5 55.5 99.9 0.538 0.587 491.7\n"
+          "2023-10-19 12:01:50 12:01 10-19-23 49.91 0C100400 0.000 98811 66615 25.5 55.5 99.9 0.538 0.587 491.7\n"
+          "2023-10-19 12:02:10 12:02 10-19-23 49.95 0C100400 0.000 98811 66615 25.5 55.5 99.9 0.538 0.587 491.7\n")
+
+
+def test_compare_reads_the_instrument_tables():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "thermo.sqlite")
+        with ingest.Ingestor(db) as ingestor:
+            for name, text in (('tei49c-ps', TEI49C), ('tei49i_1', TEI49I)):
+                file = os.path.join(tmp, f"{name}-202310191210.dat")
+                with open(file, "w", encoding='utf8') as fh:
+                    fh.write(text)
+                assert ingestor.ingest_file(file, ingest.table_for(name, CFG)) == 3
+
+        df = comparison.compare(CFG, start="2023-10-19", end="2023-10-20", db=db)
+
+    assert df.columns == ['dtm', 'o3_tei49c-ps', 'o3_tei49i_1']
+    assert df['o3_tei49c-ps'].to_list() == [50.12, 50.20]
+    # the sample of 12:01:50 is more than 30 s from the calibrator sample
+    assert df['o3_tei49i_1'].to_list() == [49.87, None]
+
+
+def test_table_for():
+    assert ingest.table_for('tei49c-ps', CFG) == 'tei49c'
+    assert ingest.table_for('tei49i_1', CFG) == 'tei49i'
+    assert ingest.table_for('tei49i_2') == 'tei49i_2'
+
+
+def test_compare_reads_clean_records_of_the_parquet_store():
+    t = datetime.datetime(2023, 10, 19, 12)
+    minute = datetime.timedelta(minutes=1)
+    calibrator = [lrec.Record(t + i * minute, o3=50.0 + i, flags=0x1C000000, bncht=25.5, lmpt=55.5) for i in range(3)]
+    # a failed lamp, and an ozone reading below the valid range
+    calibrator[1] = calibrator[1]._replace(flags=0x1C000001)
+    analyzer = [lrec.Record(t + i * minute, o3=[49.0, 50.0, 4.0][i], flags=0x0C100400) for i in range(3)]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = parquetstore.ParquetStore(tmp)
+        store.extend('tei49c-ps', calibrator)
+        store.extend('tei49i_1', analyzer)
+        store.close()
+
+        df = comparison.compare({**CFG, 'parquet': {'path': tmp}}, start="2023-10-19", end="2023-10-20", tolerance=0)
+
+    assert df['o3_tei49c-ps'].to_list() == [50.0, 52.0]
+    assert df['o3_tei49i_1'].to_list() == [49.0, None]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Reporting bins of datafiles.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+import thermo.common.datetimebin as datetimebin
+
+
+def _t(text: str) -> float:
+    return datetime.strptime(text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+@pytest.mark.parametrize('interval, t, end', [
+    (10, "2023-10-19 12:00:00", "2023-10-19 12:10:00"),
+    (10, "2023-10-19 12:09:59", "2023-10-19 12:10:00"),
+    (180, "2023-10-19 12:00:00", "2023-10-19 15:00:00"),
+    (1440, "2023-12-31 23:59:59", "2024-01-01 00:00:00"),
+])
+def test_bin_end(interval, t, end):
+    assert datetimebin.bin_end(interval, _t(t)) == _t(end)
+
+
+def test_bin_end_rejects_other_intervals():
+    with pytest.raises(ValueError):
+        datetimebin.bin_end(23)
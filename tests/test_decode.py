@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Column-wise decoding of records, and the year of TEI49C records.
+"""
+
+import datetime
+
+import pytest
+
+pl = pytest.importorskip("polars")
+
+import thermo.common.decode as decode
+
+
+def test_year_closest_to_the_reference():
+    times = ["23:58", "23:59", "00:00", "00:01"]
+    dates = ["12-31", "12-31", "01-01", "01-01"]
+    dtms = decode.instrument_times(times, dates, datetime.datetime(2023, 1, 1, 0, 10)).to_list()
+    assert dtms == [datetime.datetime(2022, 12, 31, 23, 58), datetime.datetime(2022, 12, 31, 23, 59),
+                    datetime.datetime(2023, 1, 1, 0, 0), datetime.datetime(2023, 1, 1, 0, 1)]
+
+
+def test_year_of_each_record_from_its_pc_timestamp():
+    references = [datetime.datetime(2022, 12, 31, 23, 59), datetime.datetime(2023, 1, 1, 0, 1)]
+    dtms = decode.instrument_times(["00:01", "00:02"], ["01-01", "01-01"], references).to_list()
+    assert [dtm.year for dtm in dtms] == [2023, 2023]
+
+
+def test_leap_day_and_dates_with_year():
+    assert decode.instrument_times(["12:00"], ["02-29"], 2024).to_list() == [datetime.datetime(2024, 2, 29, 12)]
+    assert decode.instrument_times(["12:00"], ["02-29"], 2023).to_list() == [None]
+    assert decode.instrument_times(["05:26"], ["07-19-22"]).to_list() == [datetime.datetime(2022, 7, 19, 5, 26)]
+
+
+def test_decode_49c_batch():
+    header = "time date o3 flags cellai cellbi bncht lmpt o3lt flowa flowb pres".split()
+    batch = [line.split() for line in ("16:59 08-26 -1659E-4 1c100500 70560 85428 28.3 56.8 70.1 0.000 0.000 723.1",
+                                       "17:00 08-26 5281E-2 1c000000 70579 85450 28.3 56.8 70.1 0.000 0.000 723.1")]
+    df = decode.decode(header, batch, datetime.datetime(2021, 8, 26, 17, 10))
+    assert df['dtm'].to_list() == [datetime.datetime(2021, 8, 26, 16, 59), datetime.datetime(2021, 8, 26, 17)]
+    assert df['o3'].to_list() == pytest.approx([-0.1659, 52.81])
+    assert df['flags'].to_list() == [0x1C100500, 0x1C000000]
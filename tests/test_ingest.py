@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Import of datafiles into the sqlite database.
+"""
+
+import logging
+import os
+import tempfile
+
+import pytest
+
+pl = pytest.importorskip("polars")
+
+import thermo.common.datfile as datfile
+import thermo.sqlite.ingest as ingest
+
+
+def _datfile(tmp: str, text: str, name="tei49i-202310191210.dat") -> str:
+    file = os.path.join(tmp, name)
+    with open(file, "w", encoding='utf8') as fh:
+        fh.write(text)
+    return file
+
+
+def test_header_without_columns_of_the_table_is_skipped(caplog):
+    with tempfile.TemporaryDirectory() as tmp:
+        file = _datfile(tmp, "time date x y\n12:00 10-19-23 1 2\n")
+        with caplog.at_level(logging.WARNING, logger=ingest.__name__):
+            assert list(ingest.table_rows(file, ['dtm', 'o3', 'source'])) == []
+    assert "1 records skipped" in caplog.text
+
+
+def test_records_not_matching_the_header_are_counted(caplog):
+    # header with hio3, records of a TEI49C without
+    text = ("time date o3 flags hio3 cellai cellbi bncht lmpt o3lt flowa flowb pres\n"
+            "lrec\n"
+            "12:07 11-04 -2334E-4 1c100500 71614 86466 28.5 56.9 70.2 0.000 0.000 725.9\n"
+            "12:08 11-04 -2334E-4 1c100500 71614 86466 28.5 56.9 70.2 0.000 0.000 725.9 0.0\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        file = _datfile(tmp, text, name="tei49c-202108190910.dat")
+        with caplog.at_level(logging.WARNING, logger=datfile.__name__):
+            batches = list(datfile.token_batches(file))
+    assert sum(len(batch) for _, _, batch in batches) == 1
+    assert f"{file}: 2 lines skipped" in caplog.text
+
+
+def test_overlapping_files_are_upserted():
+    header = "pcdate pctime time date o3 flags hio3 cellai cellbi bncht lmpt o3lt flowa flowb pres\n"
+    line = "2023-10-19 12:0{m}:00 12:0{m} 10-19-23 {o3} 0C100400 0.000 98811 66615 25.5 55.5 99.9 0.538 0.587 491.7\n"
+    with tempfile.TemporaryDirectory() as tmp:
+        first = _datfile(tmp, header + "".join(line.format(m=m, o3=30 + m) for m in range(3)),
+                         name="tei49i-202310191210.dat")
+        # the last two records again, one corrected, and a new one
+        second = _datfile(tmp, header + "".join(line.format(m=m, o3=40 + m if m == 2 else 30 + m) for m in (1, 2, 3)),
+                          name="tei49i-202310191220.dat")
+        with ingest.Ingestor(os.path.join(tmp, "thermo.sqlite")) as ingestor:
+            assert ingestor.ingest_file(first, 'tei49i') == 3
+            assert ingestor.ingest_file(second, 'tei49i') == 3
+            rows = ingestor._con.execute("SELECT dtm, o3, qc FROM tei49i ORDER BY dtm").fetchall()
+            hourly = ingestor._con.execute("SELECT n, o3sum FROM tei49i_hourly").fetchall()
+    assert rows == [("2023-10-19 12:00:00", 30.0, 0), ("2023-10-19 12:01:00", 31.0, 0),
+                    ("2023-10-19 12:02:00", 42.0, 0), ("2023-10-19 12:03:00", 33.0, 0)]
+    assert hourly == [(4, 136.0)]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Log records written by the queue listener to the log file and the console.
+"""
+
+import json
+import os
+import tempfile
+
+import thermo.common.logwriter as logwriter
+
+
+def test_console_shows_info_and_warnings(capsys):
+    with tempfile.TemporaryDirectory() as logs:
+        logwriter.setup(logs, logger='thermo.test', console='INFO')
+        logger = logwriter.get_logger('thermo.test.driver', instrument='tei49i_1')
+        logger.debug("lrec 100 10", extra={'command': "lrec 100 10", 'duration': 0.04})
+        logger.info(".get_data (name=tei49i_1, save=True)")
+        logger.info("[tei49i_1] o3 30.1 ppb", extra={'_color': "\x1b[32m"})
+        logger.error("timed out")
+        logwriter.close_all()
+        with open(os.path.join(logs, "thermo.log"), encoding='utf8') as fh:
+            entries = [json.loads(line) for line in fh]
+
+    console = capsys.readouterr().out.splitlines()
+    assert console[0][20:] == ".get_data (name=tei49i_1, save=True)"
+    assert console[1].startswith("\x1b[32m") and console[1].endswith("[tei49i_1] o3 30.1 ppb\x1b[0m")
+    assert len(console) == 2
+    assert [entry['level'] for entry in entries] == ['DEBUG', 'INFO', 'INFO', 'ERROR']
+    assert entries[0]['command'] == "lrec 100 10" and entries[2]['instrument'] == 'tei49i_1'
+    assert '_color' not in entries[2]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing of lrec records of TEI49C and TEI49i instruments.
+"""
+
+import datetime
+
+import thermo.common.lrec as lrec
+
+
+def test_labelled_49i_record():
+    record = lrec.parse("05:26 07-19-22 flags 0C100400 o3 30.781 hio3 0.000 cellai 50927 cellbi 51732 bncht 29.9 "
+                        "lmpt 53.1 o3lt 0.0 flowa 0.706 flowb 0.683 pres 491.7")
+    assert record.dtm == datetime.datetime(2022, 7, 19, 5, 26)
+    assert record.flags == 0x0C100400
+    assert record.o3 == 30.781
+    assert record.cellai == 50927
+    assert record.pres == 491.7
+    assert record.pcdtm is None
+
+
+def test_49c_record_with_pc_timestamp():
+    fields = lrec.fields_from_header("pcdate pctime time date o3 flags cellai cellbi bncht lmpt o3lt flowa flowb pres")
+    assert fields == lrec.FIELDS_49C
+    record = lrec.parse("2022-06-01 00:40:00 00:43 06-01 5281E-2 1c000000 98811 66615 25.5 55.5 99.9 0.538 0.587 "
+                        "491.7", fields)
+    assert record.pcdtm == datetime.datetime(2022, 6, 1, 0, 40)
+    assert record.dtm == datetime.datetime(2022, 6, 1, 0, 43)
+    assert record.o3 == 52.81
+    assert record.flags == 0x1C000000
+    assert record.hio3 is None
+
+
+def test_year_of_49c_records_around_new_year():
+    # pc date after new year, instrument clock before
+    record = lrec.parse("2023-01-01 00:00:30 23:59 12-31 -2334E-4 1c100500 71614 86466 28.5 56.9 70.2 0.000 0.000 "
+                        "725.9")
+    assert record.dtm == datetime.datetime(2022, 12, 31, 23, 59)
+    assert record.o3 == -0.2334
+    # no pc date: the year closest to the reference
+    assert lrec.record_time("00:10 01-01 5281E-2", datetime.datetime(2022, 12, 31, 23)) == \
+        datetime.datetime(2023, 1, 1, 0, 10)
+    assert lrec.record_time("00:10 01-01 5281E-2", 2021) == datetime.datetime(2021, 1, 1, 0, 10)
+
+
+def test_lines_that_are_not_records_are_skipped():
+    lines = "lrec 10 2\n05:26 07-19-22 0C100400 30.781 0.000 50927\nbad cmd\n05:27 07-19-22 0C100400 x\n"
+    records = lrec.parse_lines(lines)
+    assert [record.o3 for record in records] == [30.781]
+    assert lrec.parse("05:26 07-19-22") is None
+
+
+def test_strip_labels():
+    stripped = lrec.strip_labels("05:26 07-19-22 flags 0C100400 o3 30.781 hio3 0.000")
+    assert stripped == "05:26 07-19-22 0C100400 30.781 0.000"
+    columns = lrec.to_columns(lrec.parse_lines("05:26 07-19-22 0C100400 30.781\n05:27 07-19-22 0C100400 30.5"))
+    assert columns['o3'] == [30.781, 30.5]
+    assert lrec.to_columns([])['dtm'] == []
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Parquet store of parsed records.
+"""
+
+import datetime
+import os
+import tempfile
+
+import pytest
+
+pl = pytest.importorskip("polars")
+
+import thermo.common.lrec as lrec
+import thermo.common.parquetstore as parquetstore
+
+T = datetime.datetime(2023, 10, 19, 12)
+
+
+def _records(n: int, start=0) -> list:
+    return [lrec.Record(T + datetime.timedelta(minutes=i), o3=30.0 + i, flags=0x0C100400, hio3=0.5)
+            for i in range(start, start + n)]
+
+
+def test_hio3_is_stored_and_older_files_read_it_as_null():
+    with tempfile.TemporaryDirectory() as tmp:
+        # a part written before hio3 was stored
+        old = parquetstore.frame(_records(2)).drop('hio3')
+        os.makedirs(os.path.join(tmp, "tei49i_1"))
+        old.write_parquet(os.path.join(tmp, "tei49i_1", "2023-10-19_20231019120200000000.parquet"))
+
+        store = parquetstore.ParquetStore(tmp)
+        store.extend('tei49i_1', _records(2, start=2))
+        df = parquetstore.read(tmp, 'tei49i_1', columns=['dtm', 'o3', 'hio3'])
+        assert df['hio3'].to_list() == [None, None, 0.5, 0.5]
+        store.close()
+
+        assert os.listdir(os.path.join(tmp, "tei49i_1")) == ["2023-10-19.parquet"]
+        df = parquetstore.read(tmp, 'tei49i_1')
+        assert df['o3'].to_list() == [30.0, 31.0, 32.0, 33.0]
+        assert df['hio3'].to_list() == [None, None, 0.5, 0.5]
+
+
+def test_read_repeats_a_query_of_parts_removed_meanwhile(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = parquetstore.ParquetStore(tmp)
+        store.extend('tei49i_1', _records(3))
+        store.close()
+
+        files = parquetstore.files
+        found = []
+
+        def compacted_meanwhile(*args):
+            # the first listing still names a part that compact has removed since
+            selected = files(*args)
+            if not found:
+                selected.append(os.path.join(tmp, "tei49i_1", "2023-10-19_20231019120300000000.parquet"))
+            found.append(selected)
+            return selected
+
+        monkeypatch.setattr(parquetstore, 'files', compacted_meanwhile)
+        df = parquetstore.read(tmp, 'tei49i_1', where=pl.col('o3') > 30)
+    assert len(found) == 2
+    assert df['o3'].to_list() == [31.0, 32.0]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Quality control rules of thermo.cfg and qc.RULES.
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+import thermo.common.configparser as configparser
+import thermo.common.qc as qc
+
+pl = pytest.importorskip("polars")
+
+CFG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "thermo.cfg")
+
+
+def test_config_agrees_with_defaults():
+    assert configparser.read_config(CFG)['qc'] == qc.RULES
+
+
+def _words(accepted: list) -> set:
+    # the accepted words, all words one bit away from them, and all combinations of the bits in which they differ
+    words = set(accepted) | {word ^ (1 << bit) for word in accepted for bit in range(32)}
+    differ = 0
+    for word in accepted:
+        differ |= word ^ accepted[0]
+    bits = [1 << bit for bit in range(32) if differ >> bit & 1]
+    for combination in range(1 << len(bits)):
+        words.add(accepted[0] ^ sum(bit for i, bit in enumerate(bits) if combination >> i & 1))
+    return words
+
+
+@pytest.mark.parametrize('name, accepted', [
+    ('TEI49C', [0x1C000000, 0x1C100500]),
+    ('TEI49I', [0x0C100400, 0x0C104400, 0x0C100500, 0x0C104500]),
+    ('tei49i_2', [0x0C100000, 0x0C100100, 0x0C100400, 0x0C105000]),
+])
+def test_flags_accept_the_words_of_the_former_views(name, accepted):
+    rules = {'flags': qc.RULES[name]['flags']}
+    words = sorted(_words(accepted))
+
+    df = pl.DataFrame({'flags': [f"{word:08X}" for word in words]})
+    result = df.select(qc.expression(rules, text=True))[:, 0].to_list()
+    assert {word for word, failed in zip(words, result) if not failed} == set(accepted)
+
+    with sqlite3.connect(":memory:") as con:
+        result = [con.execute(f"SELECT {qc.sql(rules)} FROM (SELECT ? AS iflags)", (word, )).fetchone()[0]
+                  for word in words]
+    assert {word for word, failed in zip(words, result) if not failed} == set(accepted)
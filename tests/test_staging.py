@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Staging of completed datafiles.
+"""
+
+import os
+import tempfile
+
+import thermo.common.staging as staging
+
+
+def test_scan_stages_closed_bins_but_not_downloads():
+    with tempfile.TemporaryDirectory() as tmp:
+        datadir = os.path.join(tmp, "data", "tei49i")
+        os.makedirs(datadir)
+        staging._write_mark(datadir, "202310190000")
+        for name in ("tei49i-202310191200.dat", "tei49i_all_lrec-20231019120000.dat"):
+            with open(os.path.join(datadir, name), "w", encoding='utf8') as fh:
+                fh.write("time date flags o3\n")
+
+        pipeline = staging.StagingPipeline(os.path.join(tmp, "staging"), scan_interval=3600)
+        pipeline.watch(datadir, compress=False)
+        assert pipeline.scan() == 1
+        pipeline.stop()
+
+        assert os.listdir(os.path.join(tmp, "staging", "tei49i")) == ["tei49i-202310191200.dat"]
+        assert pipeline.staged(os.path.join(datadir, "tei49i-202310191200.dat"))
+        assert not pipeline.staged(os.path.join(datadir, "tei49i_all_lrec-20231019120000.dat"))
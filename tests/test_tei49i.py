@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+TEI49I driver against the simulator.
+"""
+
+import datetime
+
+import thermo.common.bulkdownload as bulkdownload
+
+
+def test_get_o3_queries_the_instrument(simulated_tei49i, monkeypatch):
+    instrument = simulated_tei49i
+    assert instrument.latest() is None
+    data = instrument.get_data(save=True)
+    assert instrument.latest()['o3'] == float(data.split()[3])
+
+    # the response of the instrument, not the buffered sample
+    sent = []
+    comm = instrument.tcpip_comm
+    monkeypatch.setattr(instrument, 'tcpip_comm', lambda cmd, **kwargs: sent.append(cmd) or comm(cmd, **kwargs))
+    assert instrument.get_o3().startswith("o3 ")
+    assert sent == ['o3']
+
+
+def test_sync_lrec_in_the_format_without_labels(simulated_tei49i, monkeypatch):
+    instrument = simulated_tei49i
+    instrument.tcpip_comm('set lrec format 1')
+    since = datetime.datetime.now() - datetime.timedelta(minutes=10)
+    monkeypatch.setattr(bulkdownload, 'newest_record', lambda pattern: since)
+    sent = []
+    comm = instrument.tcpip_comm
+    monkeypatch.setattr(instrument, 'tcpip_comm', lambda cmd, **kwargs: sent.append(cmd) or comm(cmd, **kwargs))
+
+    stats = instrument.sync_lrec(save=False)
+    assert 10 <= stats['records'] <= 12
+    assert 'set lrec format 0' in sent
+    # the setting of the instrument is restored
+    assert sent[-1] == 'set lrec format 1'
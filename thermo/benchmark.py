@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark acquisition throughput of the TEI49C (serial) and TEI49I (tcp/ip) drivers against local simulators.
+
+Reports commands/second, p50/p99 command latency, get_data rate, bulk download records/second and file append
+throughput. Results are written as JSON so that runs of different versions can be compared:
+
+    python -m thermo.benchmark --output bench-new.json --compare bench-old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import thermo.common.datawriter as datawriter
+import thermo.common.serialbus as serialbus
+import thermo.common.tcpsession as tcpsession
+import thermo.instr.tei49c as tei49c
+import thermo.instr.tei49i as tei49i
+from thermo.instr.simulator import InstrumentSimulator, PTYServer, TCPServer
+
+# metrics where a higher value is better; for all others, lower is better
+HIGHER_IS_BETTER = ('per_second',)
+
+
+def _config(datadir: str, tcp_port: int, serial_port: str) -> dict:
+    common = {'get_config': [], 'set_config': [], 'sampling_interval': 1, 'reporting_interval': 180}
+    return {
+        'logs': None,
+        'data': datadir,
+        serial_port: {'baudrate': 9600, 'bytesize': 8, 'parity': 'N', 'stopbits': 1, 'timeout': 0.1,
+                      'deadline': 2},
+        'calibrator': {'name': 'tei49c', 'levels': [0]},
+        'tei49c': dict(common, type='TEI49C', id=49, serial_number='simulated', port=serial_port,
+                       get_data='lrec',
+                       data_header='pcdate pctime time date o3 flags cellai cellbi bncht lmpt o3lt flowa flowb pres'),
+        'tei49i': dict(common, type='TEI49I', id=2, serial_number='simulated',
+                       socket={'host': '127.0.0.1', 'port': tcp_port, 'timeout': 5}, get_data='lr00',
+                       data_header='pcdate pctime time date flags o3 hio3 cellai cellbi bncht lmpt o3lt flowa flowb pres'),
+    }
+
+
+def _latencies(comm, cmd: str, n: int) -> dict:
+    latencies = []
+    t0 = time.perf_counter()
+    for _ in range(n):
+        t = time.perf_counter()
+        comm(cmd)
+        latencies.append(time.perf_counter() - t)
+    seconds = time.perf_counter() - t0
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {'commands_per_second': n / seconds,
+            'latency_p50_ms': quantiles[49] * 1000,
+            'latency_p99_ms': quantiles[98] * 1000}
+
+
+def _rate(func, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        func()
+    return n / (time.perf_counter() - t0)
+
+
+def run(n=500, buffer_size=1792, latency=0.0) -> dict:
+    """
+    Run all benchmarks.
+
+    :param n: number of commands (and get_data calls, file appends) per benchmark
+    :param buffer_size: number of records in the simulated loggers
+    :param latency: response latency of the simulated instruments [s]
+    :return: results per driver
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as datadir:
+        simulators = {'tei49i': InstrumentSimulator('49i', buffer_size=buffer_size, latency=latency, seed=49),
+                      'tei49c': InstrumentSimulator('49c', buffer_size=buffer_size, latency=latency, seed=49)}
+        tcp = TCPServer(simulators['tei49i'], port=0)
+        tcp.start()
+        pty = PTYServer(simulators['tei49c'])
+        pty.start()
+        cfg = _config(datadir, tcp.server_address[1], pty.port)
+
+        try:
+            analyzer = tei49i.TEI49I(name='tei49i', config=cfg)
+            calibrator = tei49c.TEI49C(name='tei49c', config=cfg)
+
+            for name, instrument, comm in [('tei49i', analyzer, analyzer.tcpip_comm),
+                                           ('tei49c', calibrator, calibrator.serial_comm)]:
+                res = _latencies(comm, 'o3', n)
+                res['get_data_per_second'] = _rate(instrument.get_data, n)
+                # a record in the format of the model, so that it is parsed like during acquisition
+                line = simulators[name].format_record(simulators[name]._record(time.time()))
+                res['append_lines_per_second'] = _rate(
+                    lambda: instrument._save_data(time.strftime('%Y-%m-%d %H:%M:%S'), line), n * 10)
+                if name == 'tei49i':
+                    stats = analyzer.get_all_lrec(save=True)
+                else:
+                    stats = calibrator.get_all_rec(save=True)['lrec']
+                res['bulk_records_per_second'] = stats['records_per_second']
+                results[name] = res
+
+        finally:
+            tcpsession.close_all()
+            serialbus.close_all()
+            datawriter.close_all()
+            tcp.shutdown()
+            tcp.server_close()
+            pty.shutdown()
+
+    return results
+
+
+def _version() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(new: dict, old: dict, threshold=0.1) -> list:
+    """
+    Compare two benchmark results.
+
+    :param new: results of this run
+    :param old: results of a previous run
+    :param threshold: relative change considered a regression
+    :return: list of (driver, metric, old, new, relative change, regression)
+    """
+    rows = []
+    for driver, metrics in new['results'].items():
+        for metric, value in metrics.items():
+            before = old['results'].get(driver, {}).get(metric)
+            if not before:
+                continue
+            change = (value - before) / before
+            worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+            rows.append((driver, metric, before, value, change, worse > threshold))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark acquisition throughput against local simulators.")
+    parser.add_argument('-n', type=int, default=500, help="commands per benchmark")
+    parser.add_argument('--buffer-size', type=int, default=1792, help="records in simulated loggers")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated response latency [s]")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="compare with results in this JSON file")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change reported as regression")
+    args = parser.parse_args()
+
+    report = {'version': _version(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'parameters': {'n': args.n, 'buffer_size': args.buffer_size, 'latency': args.latency},
+              'results': run(n=args.n, buffer_size=args.buffer_size, latency=args.latency)}
+
+    print()
+    for driver, metrics in report['results'].items():
+        for metric, value in metrics.items():
+            print(f"{driver:8s} {metric:28s} {value:12.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding='utf8') as fh:
+            json.dump(report, fh, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding='utf8') as fh:
+            old = json.load(fh)
+        if old.get('parameters') != report['parameters']:
+            print(f"# Warning: parameters differ from {args.compare}: {old.get('parameters')}")
+        print(f"\n# Compared with {old.get('version')} ({old.get('time')})")
+        regressions = 0
+        for driver, metric, before, value, change, regression in compare(report, old, args.threshold):
+            regressions += regression
+            print(f"{driver:8s} {metric:28s} {before:12.3f} -> {value:12.3f} {change:+8.1%}"
+                  f"{'  REGRESSION' if regression else ''}")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breaker for instruments that stop responding.
+
+After threshold consecutive failed commands the breaker opens, and commands fail fast instead of waiting for the
+timeout of the session. Once the backoff has elapsed, a single command is let through as a probe: if it succeeds, the
+breaker closes, otherwise it opens again for twice as long, up to max_backoff. Changes of state are logged once.
+
+    closed --(threshold failures)--> open --(backoff elapsed)--> half-open --(success)--> closed
+                                       ^                              |
+                                       +---------(failure)------------+
+
+Breakers are configured per instrument in thermo.cfg:
+
+    tei49i_1:
+        breaker:
+            threshold: 3        # consecutive failures before commands fail fast
+            backoff: 30         # seconds before the first probe
+            max_backoff: 1800   # seconds, longest wait between probes
+"""
+
+import logging
+import threading
+import time
+
+import thermo.common.logwriter as logwriter
+import thermo.common.metrics as metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Consecutive failures and state of the connection to one instrument.
+    """
+
+    _failures = 0
+    _opened = None
+    _retry_at = 0.0
+    _state = CLOSED
+
+    def __init__(self, name: str, threshold=3, backoff=30, max_backoff=1800) -> None:
+        """
+        Initialize breaker, closed.
+
+        :param name: name of instrument
+        :param threshold: consecutive failures that open the breaker
+        :param backoff: seconds the breaker stays open before the first probe
+        :param max_backoff: seconds, longest the breaker stays open between probes
+        """
+        if threshold < 1:
+            raise ValueError("threshold must be positive")
+        self._name = name
+        self._threshold = threshold
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._delay = backoff
+        self._rejected = 0
+        self._lock = threading.Lock()
+        self._logger = logwriter.get_logger(__name__, instrument=name)
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Should a command be sent? While the breaker is half-open, only the probe is let through.
+
+        :return: True if the breaker is closed, or if the command is the probe
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() >= self._retry_at:
+                self._state = HALF_OPEN
+                return True
+            self._rejected += 1
+        metrics.BREAKER_REJECTED.inc(instrument=self._name)
+        return False
+
+    def success(self) -> None:
+        """
+        Record a successful command, closing the breaker.
+        """
+        with self._lock:
+            self._failures = 0
+            if self._state == CLOSED:
+                return
+            down = time.monotonic() - self._opened
+            self._state = CLOSED
+            self._opened = None
+            self._delay = self._backoff
+        metrics.BREAKER_OPEN.set(0, instrument=self._name)
+        self._message(f"{self._name} responds again after {down:.0f} s, circuit closed.", error=False)
+
+    def failure(self, expected=False) -> None:
+        """
+        Record a failed command, opening the breaker after threshold consecutive failures or a failed probe.
+
+        :param expected: Was the command allowed to fail, e.g. when probing how many records the instrument returns
+                         within the timeout? Such failures do not count, and a probe failing so is repeated.
+        """
+        with self._lock:
+            if expected:
+                if self._state == HALF_OPEN:
+                    self._state = OPEN
+                    self._retry_at = time.monotonic()
+                return
+            self._failures += 1
+            if self._state == HALF_OPEN:
+                # probe failed, wait longer
+                self._delay = min(2 * self._delay, self._max_backoff)
+                self._state = OPEN
+                self._retry_at = time.monotonic() + self._delay
+                return
+            if self._state == OPEN or self._failures < self._threshold:
+                return
+            self._state = OPEN
+            self._opened = time.monotonic()
+            self._delay = self._backoff
+            self._retry_at = self._opened + self._delay
+        metrics.BREAKER_OPEN.set(1, instrument=self._name)
+        self._message(f"{self._name} failed {self._threshold} times in a row, circuit open. Commands fail fast, "
+                      f"probing after {self._backoff} s and up to every {self._max_backoff} s.", error=True)
+
+    def _message(self, msg: str, error: bool) -> None:
+        # shown on the console by the log writer, if configured so
+        if self._logger.logger.hasHandlers():
+            self._logger.log(logging.WARNING if error else logging.INFO, msg)
+        else:
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {msg}")
+
+    def health(self) -> dict:
+        """
+        Report state of the breaker.
+
+        :return: dictionary with state, consecutive failures, seconds until the next probe (None unless open) and
+                 number of commands rejected
+        """
+        with self._lock:
+            retry_in = max(0.0, self._retry_at - time.monotonic()) if self._state == OPEN else None
+            return {'state': self._state, 'failures': self._failures, 'retry_in': retry_in,
+                    'rejected': self._rejected}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, settings=None) -> CircuitBreaker:
+    """
+    Return the breaker of an instrument, creating it if necessary.
+
+    :param name: name of instrument
+    :param settings: breaker configuration, i.e., config[name]['breaker'], used when the breaker is created
+        - settings['threshold'], optional (default 3)
+        - settings['backoff'], optional, seconds (default 30)
+        - settings['max_backoff'], optional, seconds (default 1800)
+    :return: shared breaker
+    """
+    settings = settings or {}
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, threshold=settings.get('threshold', 3),
+                                             backoff=settings.get('backoff', 30),
+                                             max_backoff=settings.get('max_backoff', 1800))
+        return _breakers[name]
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive, resumable download of the record buffer (lrec, srec) of Thermo instruments.
+
+The logger is addressed relative to the newest record: 'lrec N M' returns M records, starting N records back. The
+buffer is walked from the oldest record towards the newest in the largest chunks the instrument accepts. Progress is
+checkpointed next to the output file after every chunk, so that an interrupted download can be resumed.
+
+A sync fetches only the records that are newer than the newest record already stored.
+"""
+
+import contextlib
+import datetime
+import glob
+import json
+import logging
+import math
+import os
+import re
+import time
+
+from thermo.common.lrec import record_time
+
+
+def newest_record(pattern: str) -> datetime.datetime:
+    """
+    Find the timestamp of the newest record stored in a set of data files.
+
+    :param pattern: glob pattern of data files, e.g. '/data/tei49i_1/tei49i_1*.dat'
+    :return: timestamp, or None if no record was found
+    """
+    newest = None
+    # the newest record is in one of the most recently modified files
+    files = sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True)[:3]
+    for file in files:
+        year = datetime.datetime.fromtimestamp(os.path.getmtime(file))
+        with open(file, "r", encoding='utf8', errors='replace') as fh:
+            for line in fh:
+                dtm = record_time(line, year)
+                if dtm and (newest is None or dtm > newest):
+                    newest = dtm
+    return newest
+
+
+class BulkDownload:
+    """
+    Download records from an instrument's logger in chunks.
+    """
+
+    # chunk sizes tried, in this order, when probing the instrument
+    CHUNK_SIZES = (100, 50, 25, 10)
+
+    _logger = None
+
+    def __init__(self, comm, datafile=None, header=None, cmd="lrec", period=1, transform=None, fmt=None,
+                 chunk_sizes=CHUNK_SIZES, probe=None) -> None:
+        """
+        Initialize download.
+
+        :param comm: callable sending a command to the instrument and returning the tidied response
+        :param datafile: full path of output file, or None if records should not be saved
+        :param header: header line written to a new output file
+        :param cmd: logger command, 'lrec' or 'srec'
+        :param period: minutes between records in the logger, used to realign a resumed download
+        :param transform: optional callable applied to each response before it is written
+        :param fmt: optional record format (argument of 'set lrec format') used for the download. The instrument's
+                    setting is restored afterwards.
+        :param chunk_sizes: candidate chunk sizes, largest first
+        :param probe: optional callable like comm, used to probe chunk sizes. Chunks too large for the timeout are
+                      expected to fail, so probe should not count them as failures of the instrument. Default: comm
+        """
+        self._comm = comm
+        self._datafile = datafile
+        self._header = header
+        self._cmd = cmd
+        self._period = period
+        self._transform = transform
+        self._fmt = fmt
+        self._chunk_sizes = chunk_sizes
+        self._probe = probe or comm
+        self._logger = logging.getLogger(__name__)
+
+    @property
+    def checkpoint(self) -> str:
+        return f"{self._datafile}.ckpt" if self._datafile else None
+
+    @staticmethod
+    def pending(pattern: str) -> str:
+        """
+        Find the output file of an interrupted download.
+
+        :param pattern: glob pattern of output files, e.g. '/data/tei49i_1/tei49i_1_all_lrec-*.dat'
+        :return: full path of the most recent unfinished output file, or None
+        """
+        checkpoints = sorted(glob.glob(f"{pattern}.ckpt"))
+        return checkpoints[-1][:-len(".ckpt")] if checkpoints else None
+
+    def available(self) -> int:
+        """
+        Query how many records are stored in the logger.
+
+        :return: number of records, or None if the response could not be understood
+        """
+        res = self._comm(f"no of {self._cmd}")
+        match = re.search(r"(\d+)", res or "")
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _records(data: str) -> list:
+        return [line.strip() for line in (data or "").splitlines() if line.strip()]
+
+    def probe_chunk_size(self, available: int) -> int:
+        """
+        Find the largest chunk size for which the instrument returns complete responses.
+
+        :param available: number of records stored in the logger
+        :return: chunk size
+        """
+        for size in self._chunk_sizes:
+            if size >= available:
+                # a single request of 'available' records will do, no need to probe
+                continue
+            if len(self._records(self._probe(f"{self._cmd} {size} {size}"))) == size:
+                return size
+        return max(1, min(min(self._chunk_sizes), available))
+
+    def _load_checkpoint(self) -> dict:
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint, "r", encoding='utf8') as fh:
+                return json.load(fh)
+        return None
+
+    def _save_checkpoint(self, state: dict) -> None:
+        tmp = f"{self.checkpoint}.tmp"
+        with open(tmp, "w", encoding='utf8') as fh:
+            json.dump(state, fh)
+        os.replace(tmp, self.checkpoint)
+
+    def run(self, available=None) -> dict:
+        """
+        Download all records, resuming from a checkpoint if there is one.
+
+        :param available: number of records stored in the logger, queried from the instrument if None
+        :return: statistics of the run: records, seconds, records_per_second, chunk, resumed
+        """
+        t0 = time.perf_counter()
+        with self._record_format():
+            return self._run(t0, available)
+
+    @contextlib.contextmanager
+    def _record_format(self):
+        # switch to the compact record format for the duration of the download
+        restore = None
+        if self._fmt is not None:
+            current = (self._comm(f"{self._cmd} format") or "").replace(f"{self._cmd} format", "").strip()
+            if current and current != self._fmt:
+                self._comm(f"set {self._cmd} format {self._fmt}")
+                restore = current
+
+        try:
+            yield
+        finally:
+            if restore is not None:
+                self._comm(f"set {self._cmd} format {restore}")
+
+    def sync(self, since: datetime.datetime) -> dict:
+        """
+        Download only the records that are newer than 'since'.
+
+        The number of records to fetch is estimated from the age of the newest record in the logger and the logging
+        period, limited by the number of records available.
+
+        :param since: timestamp of the newest record already stored
+        :return: statistics of the run, see run
+        """
+        t0 = time.perf_counter()
+        available = self.available()
+        if not available:
+            return self._stats(t0, 0, 0, False)
+        with self._record_format():
+            newest = record_time((self._records(self._comm(f"{self._cmd} 1 1")) or [""])[-1], since)
+            if newest is None:
+                # cannot tell how far back to go
+                index = available
+            elif newest <= since:
+                return self._stats(t0, 0, 0, False)
+            else:
+                # one extra record to absorb rounding and records logged in the meantime
+                index = min(available, math.ceil((newest - since).total_seconds() / (self._period * 60)) + 1)
+            return self._run(t0, index, since=since)
+
+    def _run(self, t0: float, available: int, since=None) -> dict:
+        state = self._load_checkpoint() if since is None else None
+        resumed = state is not None
+        if resumed:
+            # records logged since the checkpoint moved everything further back in the buffer
+            elapsed = max(0, int((time.time() - state['time']) // (self._period * 60)))
+            index = state['index'] + elapsed + state['chunk']
+            available = self.available()
+            if available:
+                index = min(index, available)
+            chunk = state['chunk']
+            last = state['last']
+            written = state['records']
+            print(f"Resuming download into {self._datafile} at {self._cmd} {index} ({written} records done)")
+        else:
+            if available is None:
+                available = self.available()
+            chunk = self.probe_chunk_size(available)
+            index = available
+            last = None
+            written = 0
+
+        fh = None
+        records = 0
+        try:
+            while index > 0:
+                retrieve = min(chunk, index)
+                cmd = f"{self._cmd} {index} {retrieve}"
+                data = self._comm(cmd)
+                if data is None:
+                    raise IOError(f"no response to '{cmd}'")
+                if self._transform:
+                    data = self._transform(data)
+                lines = self._records(data)
+                if since is not None:
+                    lines = [line for line in lines if (record_time(line, since) or since) > since]
+
+                # consecutive chunks overlap, drop the records already written
+                if last is not None:
+                    keys = [line.split()[:2] for line in lines]
+                    if last in keys:
+                        lines = lines[len(keys) - keys[::-1].index(last):]
+                if lines:
+                    last = lines[-1].split()[:2]
+                records += len(lines)
+                # a record logged during the download shifts the buffer, and the next chunk would start one record
+                # later: overlap chunks by one record, so that none is skipped
+                index -= retrieve - 1 if 1 < retrieve < index else retrieve
+
+                if self._datafile:
+                    if lines:
+                        if fh is None:
+                            new = not os.path.exists(self._datafile)
+                            fh = open(self._datafile, "at", encoding='utf8')
+                            if new and self._header:
+                                fh.write(f"{self._header}\n")
+                        fh.write("\n".join(lines) + "\n")
+                        fh.flush()
+                    if since is None:
+                        self._save_checkpoint({'cmd': self._cmd, 'index': index, 'chunk': chunk, 'last': last,
+                                               'records': written + records, 'time': time.time()})
+
+                rate = records / (time.perf_counter() - t0)
+                print(f"{cmd}: {written + records} records, {rate:.1f} records/s", end="\r")
+            print()
+
+        finally:
+            if fh:
+                fh.close()
+
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+        return self._stats(t0, written + records, chunk, resumed, fetched=records)
+
+    def _stats(self, t0: float, records: int, chunk: int, resumed: bool, fetched=None) -> dict:
+        seconds = time.perf_counter() - t0
+        if fetched is None:
+            fetched = records
+        stats = {'records': records, 'seconds': seconds,
+                 'records_per_second': fetched / seconds if seconds else 0.0, 'chunk': chunk, 'resumed': resumed}
+        self._logger.info(f"Downloaded {stats['records']} {self._cmd} in {seconds:.1f} s "
+                          f"({stats['records_per_second']:.1f} records/s, chunk {chunk})")
+        return stats
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming statistics of the ozone comparison.
+
+The calibrator steps through calibrator.levels, one every maintain_level minutes (see TEI49C.set_o3_conc). Every
+sample of the calibrator and the analyzers is tagged with the set point active when it was taken. Samples taken
+within the settling period after a change of set point are dropped. The others update running statistics with
+Welford's algorithm, per set point and instrument, and a running linear fit of each analyzer on the calibrator:
+
+    analyzer = slope * calibrator + intercept
+
+Nothing is stored per sample, and the results are complete as soon as the last level has been maintained:
+
+    comparison = calibration.get_comparison(cfg)
+    comparison.set_level(80)
+    comparison.add('tei49i_1', t, 79.6)
+    comparison.results()
+"""
+
+import datetime
+import json
+import math
+import os
+import threading
+import time
+
+
+class RunningStats:
+    """
+    Count, mean and variance of a stream of values (Welford).
+    """
+
+    n = 0
+    mean = 0.0
+    _m2 = 0.0
+
+    def add(self, x: float) -> None:
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self) -> float:
+        """
+        :return: sample variance, nan for less than 2 values
+        """
+        return self._m2 / (self.n - 1) if self.n > 1 else math.nan
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class RunningFit:
+    """
+    Least squares fit y = slope * x + intercept of a stream of pairs, from running means and co-moments.
+    """
+
+    n = 0
+    _mx = 0.0
+    _my = 0.0
+    _sxx = 0.0
+    _syy = 0.0
+    _sxy = 0.0
+
+    def add(self, x: float, y: float) -> None:
+        self.n += 1
+        dx = x - self._mx
+        dy = y - self._my
+        self._mx += dx / self.n
+        self._my += dy / self.n
+        self._sxx += dx * (x - self._mx)
+        self._syy += dy * (y - self._my)
+        self._sxy += dx * (y - self._my)
+
+    @property
+    def slope(self) -> float:
+        return self._sxy / self._sxx if self._sxx > 0 else math.nan
+
+    @property
+    def intercept(self) -> float:
+        return self._my - self.slope * self._mx
+
+    @property
+    def r2(self) -> float:
+        return self._sxy * self._sxy / (self._sxx * self._syy) if self._sxx > 0 and self._syy > 0 else math.nan
+
+
+class Comparison:
+    """
+    Running statistics of the calibrator and the analyzers, per set point.
+    """
+
+    _changed = None
+    _finished = False
+    _level = None
+    _reference_sample = None
+
+    def __init__(self, reference: str, settling=2, tolerance=30, results=None) -> None:
+        """
+        Initialize comparison.
+
+        :param reference: name of the calibrator
+        :param settling: minutes after a change of set point during which samples are dropped
+        :param tolerance: seconds, maximum time difference of analyzer and calibrator samples fitted as pairs
+        :param results: directory to write the results to when a run finishes, default: not written
+        """
+        self._reference = reference
+        self._settling = settling * 60
+        self._tolerance = tolerance
+        self._results = results
+        self._stats = {}
+        self._fits = {}
+        self._pending = {}
+        self._started = None
+        self._lock = threading.Lock()
+
+    @property
+    def level(self):
+        """
+        Active set point, None before the first and after the last level.
+        """
+        return self._level
+
+    def set_level(self, level, t=None) -> None:
+        """
+        Record a change of set point. Setting the active set point again does not start a settling period.
+
+        :param level: set point, ppb
+        :param t: seconds since the epoch of the change, default: now
+        """
+        t = time.time() if t is None else t
+        with self._lock:
+            if self._started is None:
+                self._started = t
+            if level != self._level and not self._finished:
+                self._level = level
+                self._changed = t
+                self._reference_sample = None
+                self._pending.clear()
+
+    def tag(self, t: float):
+        """
+        :param t: seconds since the epoch of a sample
+        :return: set point active when the sample was taken, None if there is none or it had not settled
+        """
+        if self._level is None or t < self._changed + self._settling:
+            return None
+        return self._level
+
+    def add(self, name: str, t: float, o3: float):
+        """
+        Add a sample of an instrument.
+
+        :param name: name of instrument
+        :param t: seconds since the epoch of the sample
+        :param o3: ozone, ppb
+        :return: set point the sample was counted for, None if it was dropped
+        """
+        if o3 is None or math.isnan(o3):
+            return None
+        with self._lock:
+            level = self.tag(t)
+            if level is None:
+                return None
+            self._stats.setdefault((level, name), RunningStats()).add(o3)
+
+            # pair analyzer samples with the calibrator sample closest in time
+            if name == self._reference:
+                self._reference_sample = (t, o3)
+                for analyzer, (ta, ya) in list(self._pending.items()):
+                    if abs(ta - t) <= self._tolerance:
+                        self._fits.setdefault(analyzer, RunningFit()).add(o3, ya)
+                        del self._pending[analyzer]
+            else:
+                reference = self._reference_sample
+                if reference and abs(reference[0] - t) <= self._tolerance:
+                    self._fits.setdefault(name, RunningFit()).add(reference[1], o3)
+                    self._pending.pop(name, None)
+                else:
+                    self._pending[name] = (t, o3)
+            return level
+
+    def results(self) -> dict:
+        """
+        :return: dictionary with
+            - 'levels': list of dict(level, name, n, mean, std), in the order the set points were first counted
+            - 'fits': dict of analyzer name: dict(n, slope, intercept, r2)
+        """
+        with self._lock:
+            return {'levels': [{'level': level, 'name': name, 'n': s.n, 'mean': s.mean, 'std': s.std}
+                               for (level, name), s in self._stats.items()],
+                    'fits': {name: {'n': f.n, 'slope': f.slope, 'intercept': f.intercept, 'r2': f.r2}
+                             for name, f in self._fits.items()}}
+
+    def finish(self, t=None) -> dict:
+        """
+        End the run: stop counting samples, print the results and write them to the results directory. Only the first
+        call ends the run, later calls return the results.
+
+        :param t: seconds since the epoch of the end of the run, default: now
+        :return: see results
+        """
+        t = time.time() if t is None else t
+        with self._lock:
+            finished, self._finished = self._finished, True
+            self._level = None
+        results = self.results()
+        if finished:
+            return results
+        for row in results['levels']:
+            print(f"{row['level']:>6} ppb {row['name']:<12} n={row['n']:<4} mean={row['mean']:.2f} std={row['std']:.2f}")
+        for name, fit in results['fits'].items():
+            print(f"{name}: slope={fit['slope']:.4f} intercept={fit['intercept']:.2f} r2={fit['r2']:.5f} "
+                  f"(n={fit['n']})")
+        if self._results:
+            os.makedirs(self._results, exist_ok=True)
+            started = datetime.datetime.fromtimestamp(self._started or t)
+            file = os.path.join(self._results, f"comparison-{started:%Y%m%d%H%M}.json")
+            with open(file, "w", encoding='utf8') as fh:
+                json.dump(_nan_to_none(results), fh, indent=2)
+        return results
+
+
+def _nan_to_none(value):
+    # nan is not valid json
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _nan_to_none(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_nan_to_none(v) for v in value]
+    return value
+
+
+_comparisons = {}
+_comparisons_lock = threading.Lock()
+
+
+def get_comparison(config: dict) -> Comparison:
+    """
+    Return the comparison of a configuration, creating it if necessary.
+
+    :param config: configuration, see thermo.cfg
+        - config['calibrator']['name']
+        - config['calibrator']['settling'], optional, minutes (default 2)
+        - config['calibrator']['tolerance'], optional, seconds (default 30)
+        - config['data'], results are written to <data>/<calibrator name>
+    :return: shared comparison
+    """
+    settings = config['calibrator']
+    name = settings['name']
+    with _comparisons_lock:
+        if name not in _comparisons:
+            results = os.path.join(os.path.expanduser(config['data']), name) if config.get('data') else None
+            _comparisons[name] = Comparison(name, settling=settings.get('settling', 2),
+                                            tolerance=settings.get('tolerance', 30), results=results)
+        return _comparisons[name]
+
+
+def close_all() -> None:
+    """
+    Finish the runs of all comparisons, see Comparison.finish.
+    """
+    with _comparisons_lock:
+        for comparison in _comparisons.values():
+            if comparison.level is not None:
+                comparison.finish()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Time-indexed catalog of the datafiles of instruments.
+
+get_data writes one file <data>/<name>/<name>-<bin>.dat per reporting bin, where <bin> is the end of the bin,
+YYYYmmddHHMM in UTC (see datetimebin.dtbin). The catalog keeps, per instrument, the sorted bin timestamps and paths
+of these files. The directory is listed once; later refreshes only probe for the files of the bins that have ended
+since, so that selecting the files of the last hours is a bisection, whatever the number of files in the directory.
+Records read are kept while their file is in the queried period, and files are read from where the previous read
+stopped, so that repeated queries only read the bytes appended since.
+
+    cat = catalog.FileCatalog(config['data'])
+    for path, header, records in cat.recent('tei49c', hours=6):
+        ...
+"""
+
+import bisect
+import datetime
+import os
+import re
+import threading
+
+import thermo.common.datfile as datfile
+
+
+def _key(dtm: datetime.datetime) -> int:
+    return int(dtm.strftime("%Y%m%d%H%M"))
+
+
+def _time(key: int) -> datetime.datetime:
+    return datetime.datetime.strptime(str(key), "%Y%m%d%H%M")
+
+
+class FileCatalog:
+    """
+    Sorted index of the datafiles of instruments, with incremental reads.
+    """
+
+    _datadir = None
+
+    def __init__(self, datadir: str, interval=None) -> None:
+        """
+        Initialize catalog. The directory of an instrument is listed when it is first queried.
+
+        :param datadir: data directory, i.e., config['data'], containing one directory per instrument
+        :param interval: minutes, reporting interval of get_data files. Default: inferred from the files.
+        """
+        self._datadir = os.path.expanduser(datadir)
+        self._interval = interval
+        self._keys = {}
+        self._paths = {}
+        self._intervals = {}
+        self._tails = {}
+        self._lock = threading.Lock()
+
+    def directory(self, name: str) -> str:
+        """
+        :return: directory of the datafiles of instrument name
+        """
+        return os.path.join(self._datadir, name)
+
+    def scan(self, name: str) -> int:
+        """
+        List the directory of an instrument and rebuild its index.
+
+        :param name: name of instrument
+        :return: number of files indexed
+        """
+        pattern = re.compile(rf"^{re.escape(name)}-(\d{{12}})\.dat$")
+        entries = []
+        if os.path.isdir(self.directory(name)):
+            with os.scandir(self.directory(name)) as it:
+                for entry in it:
+                    match = pattern.match(entry.name)
+                    if match:
+                        entries.append((int(match.group(1)), entry.path))
+        entries.sort()
+        with self._lock:
+            self._keys[name] = [key for key, _ in entries]
+            self._paths[name] = [path for _, path in entries]
+            self._intervals[name] = self._interval or self._infer_interval(self._keys[name])
+        return len(entries)
+
+    @staticmethod
+    def _infer_interval(keys: list) -> int:
+        # smallest step between the last files, in minutes
+        steps = [int((_time(b) - _time(a)).total_seconds() // 60) for a, b in zip(keys[-10:], keys[-9:])]
+        steps = [step for step in steps if step > 0]
+        return min(steps) if steps else None
+
+    def refresh(self, name: str, now=None) -> int:
+        """
+        Add the files of the bins that ended since the last indexed file, without listing the directory.
+
+        :param name: name of instrument
+        :param now: UTC datetime up to which to probe, default: now
+        :return: number of files added
+        """
+        if name not in self._keys:
+            return self.scan(name)
+        interval = self._intervals.get(name)
+        keys = self._keys[name]
+        if not keys or not interval:
+            # nothing to extrapolate from
+            before = len(keys)
+            return self.scan(name) - before
+
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        step = datetime.timedelta(minutes=interval)
+        if (now - _time(keys[-1])) / step > 1000:
+            # long gap, e.g., after a pause of the acquisition: listing is cheaper than probing every bin
+            before = len(keys)
+            return self.scan(name) - before
+        added = 0
+        # the file of the current bin is named by its end
+        t = _time(keys[-1]) + step
+        while t <= now + step:
+            path = os.path.join(self.directory(name), f"{name}-{t:%Y%m%d%H%M}.dat")
+            if os.path.exists(path):
+                with self._lock:
+                    keys.append(_key(t))
+                    self._paths[name].append(path)
+                added += 1
+            t += step
+        return added
+
+    def files(self, name: str, start=None, end=None) -> list:
+        """
+        Select the files of an instrument by the end of their bin.
+
+        :param name: name of instrument
+        :param start: UTC datetime, files of bins ending after start. Default: first file.
+        :param end: UTC datetime, files of bins ending at or before end. Default: last file.
+        :return: sorted list of paths
+        """
+        self.refresh(name)
+        with self._lock:
+            keys = self._keys[name]
+            lo = bisect.bisect_right(keys, _key(start)) if start else 0
+            hi = bisect.bisect_right(keys, _key(end)) if end else len(keys)
+            return self._paths[name][lo:hi]
+
+    def tail(self, path: str) -> tuple:
+        """
+        Read the records appended to a file since it was last read.
+
+        :param path: path of datafile
+        :return: (header names, list of new token lists). Lines not yet terminated are read with the next read.
+        """
+        header, offset, cached = self._tails.get(path, (None, 0, []))
+        records = []
+        try:
+            with open(path, "rb") as fh:
+                fh.seek(offset)
+                data = fh.read()
+        except FileNotFoundError:
+            self._tails.pop(path, None)
+            return header, records
+        end = data.rfind(b"\n") + 1
+        for tokens in map(str.split, data[:end].decode('utf8', errors='replace').splitlines()):
+            if not tokens:
+                continue
+            if tokens[0] in datfile.HEADERS and 'date' in tokens:
+                header = tokens
+            elif header and len(tokens) == len(header):
+                records.append(tokens)
+        cached.extend(records)
+        self._tails[path] = (header, offset + end, cached)
+        return header, records
+
+    def recent(self, name: str, hours=6, now=None):
+        """
+        Records of the files of an instrument covering the last hours. Each file is read from where it was last read.
+
+        :param name: name of instrument
+        :param hours: number of hours to go back in time
+        :param now: UTC datetime, default: now
+        :return: generator of (path, header names, list of token lists)
+        """
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        selected = self.files(name, start=now - datetime.timedelta(hours=hours))
+        # forget files that have left the period
+        keep = set(selected)
+        prefix = self.directory(name) + os.sep
+        for path in [path for path in self._tails if path.startswith(prefix) and path not in keep]:
+            del self._tails[path]
+        for path in selected:
+            self.tail(path)
+            header, _, records = self._tails.get(path, (None, 0, []))
+            yield path, header, records
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Append records to the datafile of the current reporting bin.
+
+The file of the current bin is kept open. The end of the bin is computed once, when the file is opened, so that each
+write only compares the clock with it; no file name is formatted and no file is checked for or reopened per record.
+Writes are buffered and flushed every flush_every records, optionally followed by fsync. When a bin has ended, the
+completed file is handed to on_rotate, e.g., to stage it for transfer.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+import thermo.common.datetimebin as datetimebin
+
+
+class DataWriter:
+    """
+    Writer for the datafiles <datadir>/<name>-<bin>.dat of one instrument.
+    """
+
+    _boundary = 0.0
+    _datafile = None
+    _fh = None
+    _pending = 0
+
+    def __init__(self, datadir: str, name: str, header: str, reporting_interval=10, flush_every=1,
+                 fsync=False, on_rotate=None) -> None:
+        """
+        Initialize writer. The first file is opened with the first write.
+
+        :param datadir: directory of datafiles
+        :param name: name of instrument, used as file name prefix
+        :param header: first line of new files
+        :param reporting_interval: minutes, see datetimebin.dtbin
+        :param flush_every: number of records buffered before they are written to disk. 1 writes every record.
+        :param fsync: Should every flush be committed to disk with os.fsync? default=False
+        :param on_rotate: callable, called with the path of a completed file. Must not block.
+        """
+        if reporting_interval not in datetimebin.INTERVALS:
+            raise ValueError(f"reporting_interval must be in {datetimebin.INTERVALS}")
+        self._datadir = datadir
+        self._name = name
+        self._header = header
+        self._reporting_interval = reporting_interval
+        self._flush_every = max(1, int(flush_every))
+        self._fsync = fsync
+        self._on_rotate = on_rotate
+        self._lock = threading.Lock()
+
+    @property
+    def datafile(self) -> str:
+        """
+        Path of the file currently written to, None before the first write.
+        """
+        return self._datafile
+
+    def _rotate(self, t: float) -> None:
+        completed = self._datafile if self._fh is not None else None
+        self._close()
+        if completed and self._on_rotate:
+            self._on_rotate(completed)
+        self._boundary = datetimebin.bin_end(self._reporting_interval, t)
+        suffix = datetime.datetime.fromtimestamp(self._boundary, datetime.timezone.utc).strftime("%Y%m%d%H%M")
+        self._datafile = os.path.join(self._datadir, f"{self._name}-{suffix}.dat")
+        self._fh = open(self._datafile, "at", encoding='utf8')
+        if self._fh.tell() == 0:
+            # new file, write header
+            self._fh.write(f"{self._header}\n")
+            self._pending += 1
+
+    def write(self, line: str, t=None) -> str:
+        """
+        Append a line to the file of the current bin, starting a new file when the bin has ended.
+
+        :param line: line without newline
+        :param t: seconds since the epoch used to assign the line to a bin, defaults to now
+        :return: path of file written to
+        """
+        if t is None:
+            t = time.time()
+        with self._lock:
+            if self._fh is None or t >= self._boundary:
+                self._rotate(t)
+            self._fh.write(f"{line}\n")
+            self._pending += 1
+            if self._pending >= self._flush_every:
+                self._flush()
+            return self._datafile
+
+    def _flush(self) -> None:
+        self._fh.flush()
+        if self._fsync:
+            os.fsync(self._fh.fileno())
+        self._pending = 0
+
+    def flush(self) -> None:
+        """
+        Write buffered lines to disk.
+        """
+        with self._lock:
+            if self._fh is not None:
+                self._flush()
+
+    def _close(self) -> None:
+        if self._fh is not None:
+            self._flush()
+            self._fh.close()
+            self._fh = None
+
+    def close(self) -> None:
+        """
+        Flush and close the current file. A later write reopens it.
+        """
+        with self._lock:
+            self._close()
+
+
+_writers = []
+_writers_lock = threading.Lock()
+
+
+def get_writer(datadir: str, name: str, header: str, reporting_interval=10, flush_every=1,
+               fsync=False, on_rotate=None) -> DataWriter:
+    """
+    Create a writer that is closed by close_all.
+
+    :param: see DataWriter
+    :return: writer
+    """
+    writer = DataWriter(datadir=datadir, name=name, header=header, reporting_interval=reporting_interval,
+                        flush_every=flush_every, fsync=fsync, on_rotate=on_rotate)
+    with _writers_lock:
+        _writers.append(writer)
+    return writer
+
+
+def close_all() -> None:
+    """
+    Flush and close the files of all writers.
+    """
+    with _writers_lock:
+        for writer in _writers:
+            writer.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -3,6 +3,24 @@
 from datetime import datetime, timezone
 from time import time
 
+INTERVALS = [10, 15, 20, 30, 60, 120, 180, 240, 360, 720, 1440]
+
+
+def bin_end(interval=10, t=None) -> float:
+    """
+    Compute the end of the bin containing t, i.e., the moment the next datafile is due.
+
+    :param interval: minutes, see dtbin
+    :param t: seconds since the epoch, defaults to now
+    :return: seconds since the epoch
+    """
+    if interval not in INTERVALS:
+        raise ValueError("Interval must be in [10, 15, 20, 30, 60, 120, 180, 240, 360, 720, 1440]")
+    if t is None:
+        t = time()
+    interval *= 60
+    return (t // interval) * interval + interval
+
 
 def dtbin(interval=10) -> str:
     """
@@ -14,13 +32,7 @@ def dtbin(interval=10) -> str:
     :return:
     """
     try:
-        if interval in [10, 15, 20, 30, 60, 120, 180, 240, 360, 720, 1440]:
-            t = time()
-            interval *= 60
-            nt = (t // interval) * interval + interval
-            return datetime.fromtimestamp(nt, timezone.utc).strftime("%Y%m%d%H%M")
-        else:
-            raise ValueError("Interval must be in [10, 15, 20, 30, 60, 120, 180, 240, 360, 720, 1440]")
+        return datetime.fromtimestamp(bin_end(interval), timezone.utc).strftime("%Y%m%d%H%M")
     except Exception as err:
         print(err)
 
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Stream the records of datafiles, and of zip archives of datafiles, in batches.
+
+Datafiles written by get_data start with a header 'pcdate pctime time date ...', files downloaded from the logger
+with 'time date ...'. Archives are read member by member, without extracting them to disk, and all members get the
+same header detection as plain files. Memory is bounded by the batch size, not by the size of a file or archive.
+
+    for name, records in datfile.record_batches("tei49c-202211252100.zip"):
+        ...
+"""
+
+import datetime
+import io
+import logging
+import os
+import re
+import zipfile
+
+import thermo.common.lrec as lrec
+
+# first names of a header line
+HEADERS = ('pcdate', 'time')
+
+# timestamp in file names, e.g. tei49c-202211252100.dat or tei49c_all_lrec-20221125204600.dat
+_NAME_TIME = re.compile(r"-(\d{12}|\d{14})\.(?:dat|zip)$")
+
+
+def members(file: str):
+    """
+    Open a datafile, or each datafile in a zip archive, for reading.
+
+    :param file: path of .dat or .zip file
+    :return: generator of (name, text file object); the object is closed when the generator advances
+    """
+    if file.endswith(".zip"):
+        with zipfile.ZipFile(file=file, mode="r") as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                with zf.open(info, mode="r") as obj:
+                    yield info.filename, io.TextIOWrapper(io.BufferedReader(obj, buffer_size=1 << 20),
+                                                          encoding='utf8', errors='replace')
+    else:
+        with open(file, "r", encoding='utf8', errors='replace', buffering=1 << 20) as fh:
+            yield os.path.basename(file), fh
+
+
+def file_time(name: str) -> datetime.datetime:
+    """
+    Timestamp in the name of a datafile, e.g. the end of the reporting bin for get_data files.
+
+    :param name: file name or path
+    :return: timestamp, or None if the name carries none
+    """
+    match = _NAME_TIME.search(name)
+    if match is None:
+        return None
+    return datetime.datetime.strptime(match.group(1)[:12], "%Y%m%d%H%M")
+
+
+def token_batches(file: str, batch_size=50000):
+    """
+    Split the lines of a datafile, or of each datafile in a zip archive, into tokens.
+
+    A header may appear at the start of a file or anywhere later; following lines are read with it. Lines that do not
+    have as many tokens as the header (instrument errors, truncated lines, or a header not matching the records) are
+    skipped, and their number logged as a warning per file.
+
+    :param file: path of .dat or .zip file
+    :param batch_size: maximum number of records per batch
+    :return: generator of (member name, header names, list of token lists)
+    """
+    for name, fh in members(file):
+        header = None
+        n = -1
+        batch = []
+        skipped = 0
+        for tokens in map(str.split, fh):
+            if len(tokens) == n:
+                batch.append(tokens)
+                if len(batch) >= batch_size:
+                    yield name, header, batch
+                    batch = []
+            elif tokens and tokens[0] in HEADERS and 'date' in tokens:
+                if batch:
+                    yield name, header, batch
+                    batch = []
+                header = tokens
+                n = len(header)
+            elif tokens:
+                skipped += 1
+        if batch:
+            yield name, header, batch
+        if skipped:
+            logging.getLogger(__name__).warning(f"{os.path.join(file, name) if file.endswith('.zip') else file}: "
+                                                f"{skipped} lines skipped, not matching the header "
+                                                f"'{' '.join(header or [])}'")
+
+
+def record_batches(file: str, batch_size=50000, year=None):
+    """
+    Parse the records of a datafile, or of each datafile in a zip archive.
+
+    :param file: path of .dat or .zip file
+    :param batch_size: maximum number of records per batch
+    :param year: see lrec.record_time. Default: records without year and pc timestamp get the year closest to the
+                 timestamp in the file name.
+    :return: generator of (member name, list of lrec.Record)
+    """
+    for name, header, batch in token_batches(file, batch_size):
+        fields = lrec.fields_from_header(" ".join(header))
+        reference = year if year is not None else (file_time(name) or file_time(file))
+        records = lrec.parse_lines((" ".join(tokens) for tokens in batch), fields, reference)
+        if records:
+            yield name, records
+
+
+def frame_batches(file: str, batch_size=50000, year=None):
+    """
+    Decode the records of a datafile, or of each datafile in a zip archive, into typed columns, see decode.decode.
+
+    :param file: path of .dat or .zip file
+    :param batch_size: maximum number of records per batch
+    :param year: see record_batches
+    :return: generator of (member name, polars.DataFrame)
+    """
+    import thermo.common.decode as decode
+
+    for name, header, batch in token_batches(file, batch_size):
+        reference = year if year is not None else (file_time(name) or file_time(file))
+        yield name, decode.decode(header, batch, reference)
+
+
+if __name__ == "__main__":
+    pass
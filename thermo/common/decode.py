@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Decode batches of TEI49C/TEI49i records column by column, with polars.
+
+lrec.parse converts one record at a time. For imports of whole archives, the tokens of a batch of records are
+transposed into columns and converted in one pass each:
+    - ozone as decimal (30.781) or mantissa and exponent (5281E-2, -2334E-4)
+    - flags as 8 hex digits (1c100500)
+    - the instrument date MM-DD (TEI49C) or MM-DD-YY (TEI49i), and time HH:MM
+
+TEI49C dates carry no year. The year is taken from the pc date of the same record if the file has one, and otherwise
+from a reference, e.g. the timestamp in the file name: each record gets the year that puts it closest to the
+reference, so that records from December and January in the same file end up in consecutive years.
+
+Requires polars.
+"""
+
+import datetime
+
+import polars as pl
+
+import thermo.common.lrec as lrec
+
+FLOATS = ('o3', 'hio3', 'bncht', 'lmpt', 'o3lt', 'flowa', 'flowb', 'pres')
+INTEGERS = ('cellai', 'cellbi')
+
+_HALF_YEAR = datetime.timedelta(days=183)
+
+
+def instrument_times(times, dates, reference=None) -> pl.Series:
+    """
+    Convert instrument times and dates to datetimes.
+
+    :param times: sequence of 'HH:MM'
+    :param dates: sequence of 'MM-DD' or 'MM-DD-YY'
+    :param reference: for dates without year: datetime, or sequence of datetimes (e.g., the pc timestamps of the
+                      records), or year. Default: now.
+    :return: polars.Series of datetimes, null where a value cannot be decoded
+    """
+    df = pl.DataFrame({'time': pl.Series(times, dtype=pl.Utf8), 'date': pl.Series(dates, dtype=pl.Utf8)})
+    if df.is_empty():
+        return pl.Series('dtm', [], dtype=pl.Datetime('us'))
+
+    if df['date'].str.len_chars().max() > 5:
+        return df.select(pl.concat_str('date', 'time', separator=' ')
+                         .str.to_datetime("%m-%d-%y %H:%M", strict=False).alias('dtm'))['dtm']
+
+    if reference is None:
+        reference = datetime.datetime.now()
+    if isinstance(reference, int):
+        reference = datetime.datetime(reference, 7, 1)
+    if isinstance(reference, datetime.datetime):
+        df = df.with_columns(pl.lit(reference, dtype=pl.Datetime('us')).alias('reference'))
+    else:
+        df = df.with_columns(pl.Series('reference', reference).cast(pl.Datetime('us')))
+
+    # month, day and time of records and reference are compared in 2000, a leap year, so that 02-29 parses
+    parsed = pl.concat_str(pl.lit("2000-"), 'date', pl.lit(" "), 'time').str.to_datetime("%Y-%m-%d %H:%M",
+                                                                                         strict=False)
+    ref = pl.col('reference')
+    offset = parsed - pl.datetime(2000, ref.dt.month(), ref.dt.day(), ref.dt.hour(), ref.dt.minute(), ref.dt.second())
+    year = (pl.when(offset > _HALF_YEAR).then(ref.dt.year() - 1)
+            .when(offset < -_HALF_YEAR).then(ref.dt.year() + 1)
+            .otherwise(ref.dt.year()))
+    # 02-29 of a year that is no leap year decodes to null
+    return df.select(pl.concat_str(year.cast(pl.Utf8), pl.lit("-"), 'date', pl.lit(" "), 'time')
+                     .str.to_datetime("%Y-%m-%d %H:%M", strict=False).alias('dtm'))['dtm']
+
+
+def values(header: list, batch: list, names=None) -> pl.DataFrame:
+    """
+    Convert the values of a batch of records to typed columns, without timestamps.
+
+    :param header: names of the values, see datfile.token_batches
+    :param batch: list of token lists
+    :param names: names of the values to convert, default: all fields of lrec.Record in header
+    :return: polars.DataFrame, o3 etc. as Float64, flags as Int64, cellai/cellbi as Int64
+    """
+    names = [name for name in (lrec.Record._fields if names is None else names) if name in header]
+    index = [header.index(name) for name in names]
+    columns = [[tokens[i] for tokens in batch] for i in index]
+    df = pl.DataFrame({name: pl.Series(name, column, dtype=pl.Utf8) for name, column in zip(names, columns)})
+    return df.select([_convert(name) for name in names])
+
+
+def _convert(name: str) -> pl.Expr:
+    if name == 'flags':
+        return pl.col(name).str.to_integer(base=16, strict=False)
+    if name in INTEGERS:
+        return pl.col(name).cast(pl.Float64, strict=False).cast(pl.Int64, strict=False)
+    return pl.col(name).cast(pl.Float64, strict=False)
+
+
+def decode(header: list, batch: list, reference=None) -> pl.DataFrame:
+    """
+    Convert a batch of records to typed columns.
+
+    :param header: names of the values, see datfile.token_batches
+    :param batch: list of token lists
+    :param reference: see instrument_times, used if the records have no pc timestamp
+    :return: polars.DataFrame with columns dtm (pc timestamp, or instrument timestamp), instrument_dtm, and
+             the values of the records, see values
+    """
+    def column(name):
+        i = header.index(name)
+        return pl.Series(name, [tokens[i] for tokens in batch], dtype=pl.Utf8)
+
+    if 'pcdate' in header:
+        pcdtm = (pl.DataFrame([column('pcdate'), column('pctime')])
+                 .select(pl.concat_str('pcdate', 'pctime', separator=' ')
+                         .str.to_datetime("%Y-%m-%d %H:%M:%S", strict=False))[:, 0])
+        reference = pcdtm
+    else:
+        pcdtm = None
+    instrument_dtm = instrument_times(column('time'), column('date'), reference)
+
+    return (values(header, batch)
+            .with_columns(pl.Series('instrument_dtm', instrument_dtm),
+                          pl.Series('dtm', pcdtm if pcdtm is not None else instrument_dtm))
+            .select('dtm', 'instrument_dtm', pl.exclude('dtm', 'instrument_dtm')))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio acquisition engine. Every job runs in its own task on its own cadence, so a slow or unreachable instrument
+does not delay the others.
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+
+import thermo.common.metrics as metrics
+
+
+class AcquisitionEngine:
+    """
+    Run jobs periodically, aligned to the wall clock.
+
+    Coroutine functions are awaited in the event loop and receive the scheduled time of the tick as keyword argument
+    'dtm' (formatted as '%Y-%m-%d %H:%M:%S'), so that sample timestamps do not depend on when a job actually got to
+    run. Plain functions are run in a worker thread and are called without arguments.
+    """
+
+    _logger = None
+
+    def __init__(self) -> None:
+        self._jobs = []
+        self._logger = logging.getLogger(__name__)
+
+    def every(self, minutes: float, job, offset=0, name=None) -> None:
+        """
+        Register a job.
+
+        :param minutes: interval between runs
+        :param job: coroutine function accepting 'dtm', or plain callable without arguments
+        :param offset: seconds after the interval boundary at which the job runs
+        :param name: label used in log messages, defaults to the job's qualified name
+        """
+        if name is None:
+            name = getattr(job, '__qualname__', repr(job))
+        self._jobs.append((name, minutes * 60, offset, job))
+
+    @staticmethod
+    def next_tick(interval: float, offset=0, now=None) -> float:
+        """
+        Compute the next time (epoch seconds) that is a multiple of interval plus offset.
+
+        :param interval: seconds
+        :param offset: seconds
+        :param now: reference time, defaults to time.time()
+        :return: epoch seconds
+        """
+        if now is None:
+            now = time.time()
+        tick = (now - offset) // interval * interval + offset
+        if tick <= now:
+            tick += interval
+        return tick
+
+    async def _run_job(self, name: str, interval: float, offset: float, job) -> None:
+        is_coroutine = inspect.iscoroutinefunction(job)
+        tick = self.next_tick(interval, offset)
+        while True:
+            await asyncio.sleep(max(0, tick - time.time()))
+            started = time.time()
+            metrics.JOB_LAG.observe(max(0.0, started - tick), job=name)
+            try:
+                if is_coroutine:
+                    await job(dtm=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(tick)))
+                else:
+                    await asyncio.to_thread(job)
+            except Exception as err:
+                self._logger.error(f"{name}: {err}")
+                print(err)
+            metrics.JOB_DURATION.observe(time.time() - started, job=name)
+
+            # skip ticks that were missed while the job was running
+            nxt = self.next_tick(interval, offset)
+            missed = round((nxt - tick) / interval) - 1
+            if missed > 0:
+                metrics.JOB_SKIPPED.inc(missed, job=name)
+                self._logger.warning(f"{name}: overran its interval, skipped {missed} run(s).")
+            tick = nxt
+
+    async def run(self) -> None:
+        """
+        Run all registered jobs concurrently until cancelled.
+        """
+        await asyncio.gather(*[self._run_job(*job) for job in self._jobs])
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Logging of the acquisition to JSON-lines files, written in a background thread.
+
+Records of all thermo loggers are put on a queue by a QueueHandler, which costs the logging thread little more than
+an append, and written by a QueueListener to <logs>/thermo.log. The file is rotated at midnight by the handler itself,
+to thermo.log.YYYY-mm-dd, so it is opened once per process rather than by every instrument. Each line is one record:
+
+    {"time": "2026-10-18T14:05:00.123+02:00", "level": "DEBUG", "logger": "thermo.instr.tei49i",
+     "message": "lrec 100 10", "instrument": "tei49i_1", "command": "lrec 100 10", "duration": 0.0412}
+
+Drivers get a logger that adds their name to every record:
+
+    logwriter.setup(config['logs'], console=config.get('console'))
+    logger = logwriter.get_logger(__name__, instrument='tei49i_1')
+    logger.debug(cmd, extra={'command': cmd, 'duration': 0.0412})
+
+With console set to a level, e.g. 'INFO', messages of that level up to warnings are also shown on the console, by the
+same writer thread, e.g. the samples of get_data. Errors are printed by the drivers themselves.
+"""
+
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+# attributes of LogRecord that are not passed as extra
+_STANDARD = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+# fields passed as extra that are written, in this order
+FIELDS = ('instrument', 'command', 'duration')
+
+# ends the color of a console message
+_RESET = "\x1b[0m"
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line, with the fields passed as extra.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = round(value, 6) if isinstance(value, float) else value
+        for name, value in vars(record).items():
+            if name not in _STANDARD and name not in entry and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """
+    Format records as '<time> <message>', in the color passed as extra _color, e.g. colorama.Fore.GREEN.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(message)s", datefmt='%Y-%m-%d %H:%M:%S')
+
+    def format(self, record: logging.LogRecord) -> str:
+        color = getattr(record, '_color', None)
+        text = super().format(record)
+        return f"{color}{text}{_RESET}" if color else text
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records with their message merged, leaving all formatting to the writer thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # tracebacks cannot be pickled or formatted later, the frames may be gone
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class InstrumentLogger(logging.LoggerAdapter):
+    """
+    Logger adding the fields of the adapter (e.g. instrument) to the extra fields of each call.
+    """
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = {**self.extra, **(kwargs.get('extra') or {})}
+        return msg, kwargs
+
+
+def get_logger(name: str, **fields) -> InstrumentLogger:
+    """
+    :param name: name of logger, e.g. __name__
+    :param fields: fields added to every record, e.g. instrument='tei49c'
+    :return: logger
+    """
+    return InstrumentLogger(logging.getLogger(name), fields)
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def setup(logs: str, level=logging.DEBUG, logger='thermo', backups=0, console=None) -> None:
+    """
+    Log the records of a logger and its children to <logs>/thermo.log, once per directory.
+
+    :param logs: log directory, i.e., config['logs']
+    :param level: level of the logger
+    :param logger: name of the logger, default: the parent of all loggers of the package
+    :param backups: number of rotated files kept, 0 to keep all
+    :param console: lowest level of the records also shown on the console, e.g. 'INFO', i.e., config['console'].
+                    Default: none are shown.
+    """
+    path = os.path.expanduser(logs)
+    with _listeners_lock:
+        if path in _listeners:
+            return
+        os.makedirs(path, exist_ok=True)
+        handler = logging.handlers.TimedRotatingFileHandler(os.path.join(path, "thermo.log"), when='midnight',
+                                                            backupCount=backups, encoding='utf8', delay=True)
+        handler.setFormatter(JSONFormatter())
+        handlers = [handler]
+        if console:
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setLevel(console)
+            # errors are printed by the drivers
+            stream.addFilter(lambda record: record.levelno < logging.ERROR)
+            stream.setFormatter(ConsoleFormatter())
+            handlers.append(stream)
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        queue_handler = _QueueHandler(records)
+        target = logging.getLogger(logger)
+        target.addHandler(queue_handler)
+        target.setLevel(level)
+        _listeners[path] = (target, queue_handler, listener)
+
+
+def close_all() -> None:
+    """
+    Write the records still queued and close the log files.
+    """
+    with _listeners_lock:
+        for target, queue_handler, listener in _listeners.values():
+            target.removeHandler(queue_handler)
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+        _listeners.clear()
+
+
+if __name__ == "__main__":
+    pass
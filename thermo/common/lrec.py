@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Parse lrec records of Thermo TEI49C and TEI49i instruments into typed records.
+
+Understood are records with labels (lrec format 1 of the 49i), e.g.
+    05:26 07-19-22 flags 0C100400 o3 30.781 hio3 0.000 cellai 50927 cellbi 51732 bncht 29.9 lmpt 53.1 o3lt 0.0 ...
+and without labels (lrec format 0 of the 49i, format 00 02 of the 49C), e.g.
+    12:07 11-04 -2334E-4 1c100500 71614 86466 28.5 56.9 70.2 0.000 0.000 725.9
+optionally preceded by the pc date and time added by get_data, e.g. '2022-06-01 00:40:00 00:43 06-01 5281E-2 ...'.
+"""
+
+import datetime
+import re
+from typing import NamedTuple, Optional
+
+# order of values in records without labels
+FIELDS_49C = ('o3', 'flags', 'cellai', 'cellbi', 'bncht', 'lmpt', 'o3lt', 'flowa', 'flowb', 'pres')
+FIELDS_49I = ('flags', 'o3', 'hio3', 'cellai', 'cellbi', 'bncht', 'lmpt', 'o3lt', 'flowa', 'flowb', 'pres')
+
+LABELS = ('flags', 'o3', 'hio3', 'cellai', 'cellbi', 'bncht', 'lmpt', 'o3lt', 'flowa', 'flowb', 'pres')
+
+_LINE = re.compile(r"^\s*(?:(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2}) )?"
+                   r"(\d{2}):(\d{2}) (\d{2})-(\d{2})(?:-(\d{2}))?(?:\s+(.*?))?\s*$")
+_LABEL = re.compile(r"\b(?:%s) " % "|".join(sorted(LABELS, key=len, reverse=True)))
+
+_HALF_YEAR = datetime.timedelta(days=183)
+
+
+class Record(NamedTuple):
+    """
+    One lrec record. Values the record does not carry are None.
+    """
+    dtm: datetime.datetime
+    o3: Optional[float] = None
+    flags: Optional[int] = None
+    hio3: Optional[float] = None
+    cellai: Optional[int] = None
+    cellbi: Optional[int] = None
+    bncht: Optional[float] = None
+    lmpt: Optional[float] = None
+    o3lt: Optional[float] = None
+    flowa: Optional[float] = None
+    flowb: Optional[float] = None
+    pres: Optional[float] = None
+    pcdtm: Optional[datetime.datetime] = None
+
+
+_CONVERT = {'o3': float, 'hio3': float, 'flags': lambda x: int(x, 16), 'cellai': lambda x: int(float(x)),
+            'cellbi': lambda x: int(float(x)), 'bncht': float, 'lmpt': float, 'o3lt': float, 'flowa': float,
+            'flowb': float, 'pres': float}
+
+
+def fields_from_header(header: str) -> tuple:
+    """
+    Derive the order of values from a data file header or config[name]['data_header'].
+
+    :param header: e.g. 'pcdate pctime time date o3 flags cellai cellbi bncht lmpt o3lt flowa flowb pres'
+    :return: names of the values following time and date
+    """
+    names = header.split()
+    if 'date' in names:
+        names = names[names.index('date') + 1:]
+    return tuple(name for name in names if name not in ('pcdate', 'pctime', 'time', 'date'))
+
+
+def _instrument_time(groups: tuple, year) -> datetime.datetime:
+    pcyear, pcmonth, pcday, _, _, _, hour, minute, month, day, yy, _ = groups
+    if yy:
+        return datetime.datetime(2000 + int(yy), int(month), int(day), int(hour), int(minute))
+    if pcyear:
+        # year of pc date; the instrument clock may be on the other side of new year
+        reference = datetime.datetime(int(pcyear), int(pcmonth), int(pcday))
+    elif isinstance(year, datetime.datetime):
+        reference = year
+    else:
+        if year is None:
+            year = datetime.datetime.now().year
+        return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute))
+    dtm = datetime.datetime(reference.year, int(month), int(day), int(hour), int(minute))
+    if dtm - reference > _HALF_YEAR:
+        dtm = dtm.replace(year=dtm.year - 1)
+    elif reference - dtm > _HALF_YEAR:
+        dtm = dtm.replace(year=dtm.year + 1)
+    return dtm
+
+
+def record_time(line: str, year=None) -> datetime.datetime:
+    """
+    Extract the instrument timestamp of a record, without parsing its values.
+
+    :param line: record as returned by the instrument or stored by get_data
+    :param year: used if the record carries neither a year nor a pc date. If a datetime is given, the year closest
+                 to it is chosen.
+    :return: timestamp, or None if line is not a record
+    """
+    match = _LINE.match(line)
+    if match is None:
+        return None
+    return _instrument_time(match.groups(), year)
+
+
+def parse(line: str, fields=None, year=None) -> Record:
+    """
+    Parse one record.
+
+    :param line: record as returned by the instrument or stored by get_data
+    :param fields: order of values in records without labels, defaults to FIELDS_49I if the date carries a year
+                   and FIELDS_49C otherwise
+    :param year: see record_time
+    :return: record, or None if line is not a record
+    """
+    match = _LINE.match(line)
+    if match is None:
+        return None
+    groups = match.groups()
+    if not groups[11]:
+        return None
+    try:
+        values = groups[11].split()
+        if values[0] in _CONVERT and not values[0][0].isdigit():
+            # labelled, e.g. 'flags 0C100400 o3 30.781 ...'
+            record = {key: _CONVERT[key](value) for key, value in zip(values[::2], values[1::2]) if key in _CONVERT}
+        else:
+            if fields is None:
+                fields = FIELDS_49I if groups[10] else FIELDS_49C
+            record = {key: _CONVERT[key](value) for key, value in zip(fields, values) if key in _CONVERT}
+        if groups[0]:
+            record['pcdtm'] = datetime.datetime(int(groups[0]), int(groups[1]), int(groups[2]),
+                                                int(groups[3]), int(groups[4]), int(groups[5]))
+        return Record(_instrument_time(groups, year), **record)
+    except (ValueError, IndexError):
+        return None
+
+
+def parse_lines(lines, fields=None, year=None) -> list:
+    """
+    Parse many records, skipping lines that are not records (headers, echoes, errors).
+
+    :param lines: iterable of lines, or a multi-line string
+    :param fields: see parse
+    :param year: see record_time
+    :return: list of records
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    records = []
+    for line in lines:
+        record = parse(line, fields, year)
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def to_columns(records: list) -> dict:
+    """
+    Transpose records into columns, e.g. for building a data frame.
+
+    :param records: list of records
+    :return: dictionary of lists, one per field of Record
+    """
+    return {name: list(values) for name, values in zip(Record._fields, zip(*records))} if records else \
+        {name: [] for name in Record._fields}
+
+
+def strip_labels(data: str) -> str:
+    """
+    Remove the labels from records, e.g. '05:26 07-19-22 flags 0C100400 o3 30.781' -> '05:26 07-19-22 0C100400 30.781'.
+
+    :param data: one or more records
+    :return: records without labels
+    """
+    return _LABEL.sub("", data)
+
+
+if __name__ == "__main__":
+    pass
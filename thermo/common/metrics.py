@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Counters, gauges and histograms of the acquisition, exposed in the Prometheus text format.
+
+The metrics below are updated by the sessions, the serial bus, the instrument classes and the acquisition engine.
+They can be written periodically to a text file (e.g., for the textfile collector of the node exporter), or served
+over HTTP at http://<host>:<port>/metrics, as configured in the metrics section of thermo.cfg:
+
+    metrics:
+        textfile: ~/Documents/mkndaq/data/metrics/thermo.prom
+        interval: 60        # seconds between updates of the text file
+        port: 9108          # optional, serve the metrics over HTTP
+        host: 127.0.0.1
+"""
+
+import bisect
+import http.server
+import logging
+import os
+import threading
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names: tuple, values: tuple, extra="") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> list:
+        """
+        :return: list of (name with labels, value)
+        """
+        with self._lock:
+            return [(f"{self.name}{_labels(self.labels, key)}", value) for key, value in sorted(self._values.items())]
+
+    def exposition(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name} {_number(value)}" for name, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    Value that only increases, e.g., number of timeouts.
+    """
+    kind = 'counter'
+
+    def inc(self, value=1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, e.g., number of queued requests.
+    """
+    kind = 'gauge'
+
+    def set(self, value, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets, e.g., of latencies in seconds.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # counts per bucket (not cumulative) and +Inf, sum, count
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[-1] if state else 0
+
+    def samples(self) -> list:
+        with self._lock:
+            items = [(key, list(state)) for key, state in sorted(self._values.items())]
+        samples = []
+        for key, state in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'), ), state):
+                cumulative += n
+                le = 'le="%s"' % _number(bound)
+                samples.append((f"{self.name}_bucket{_labels(self.labels, key, le)}", cumulative))
+            samples.append((f"{self.name}_sum{_labels(self.labels, key)}", state[-2]))
+            samples.append((f"{self.name}_count{_labels(self.labels, key)}", state[-1]))
+        return samples
+
+
+class Registry:
+    """
+    Collection of metrics, rendered together.
+    """
+
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Add a metric, or return the metric already registered with the same name.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def exposition(self) -> str:
+        """
+        :return: all metrics in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.exposition() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+COMMAND_LATENCY = REGISTRY.register(Histogram(
+    'thermo_command_latency_seconds', "Time from sending a command to receiving the complete response.",
+    labels=('instrument', 'command')))
+COMMAND_ERRORS = REGISTRY.register(Counter(
+    'thermo_command_errors_total', "Commands that failed, e.g., after a timeout.", labels=('instrument', 'command')))
+TIMEOUTS = REGISTRY.register(Counter(
+    'thermo_session_timeouts_total', "Responses not complete within the timeout.", labels=('session', )))
+RETRIES = REGISTRY.register(Counter(
+    'thermo_session_retries_total', "Commands sent again after reconnecting or reopening.", labels=('session', )))
+BYTES_SENT = REGISTRY.register(Counter(
+    'thermo_session_sent_bytes_total', "Bytes sent to instruments.", labels=('session', )))
+BYTES_RECEIVED = REGISTRY.register(Counter(
+    'thermo_session_received_bytes_total', "Bytes received from instruments.", labels=('session', )))
+PARSE_FAILURES = REGISTRY.register(Counter(
+    'thermo_parse_failures_total', "Data responses that could not be parsed into a record.", labels=('instrument', )))
+BUS_WAIT = REGISTRY.register(Histogram(
+    'thermo_bus_wait_seconds', "Time requests waited in the queue of a serial port.", labels=('port', )))
+BUS_QUEUED = REGISTRY.register(Gauge(
+    'thermo_bus_queued_requests', "Requests waiting in the queue of a serial port.", labels=('port', )))
+BREAKER_OPEN = REGISTRY.register(Gauge(
+    'thermo_breaker_open', "1 while commands to an instrument fail fast, see breaker.py.", labels=('instrument', )))
+BREAKER_REJECTED = REGISTRY.register(Counter(
+    'thermo_breaker_rejected_total', "Commands not sent because the breaker was open.", labels=('instrument', )))
+JOB_LAG = REGISTRY.register(Histogram(
+    'thermo_job_lag_seconds', "Time a job started after its scheduled time.", labels=('job', )))
+JOB_DURATION = REGISTRY.register(Histogram(
+    'thermo_job_duration_seconds', "Time a job ran.", labels=('job', )))
+JOB_SKIPPED = REGISTRY.register(Counter(
+    'thermo_job_skipped_total', "Runs skipped because a job overran its interval.", labels=('job', )))
+
+
+def command(cmd: str) -> str:
+    """
+    Label of a command, without arguments that vary from call to call, e.g. 'lrec 100 10' -> 'lrec'.
+    """
+    words = []
+    for word in cmd.split():
+        if word[0].isdigit() or word[0] in "+-.":
+            break
+        words.append(word)
+    return " ".join(words) or cmd.strip()
+
+
+def write_textfile(path: str, registry=REGISTRY) -> None:
+    """
+    Write all metrics to a file, replacing it atomically so that readers never see a partial file.
+
+    :param path: path of file, e.g. ending with .prom
+    :param registry: metrics to write
+    """
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.part"
+    with open(tmp, "w", encoding='utf8') as fh:
+        fh.write(registry.exposition())
+    os.replace(tmp, path)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        # scrapes are not worth a line on stderr
+        pass
+
+
+class Exporter:
+    """
+    Expose the metrics of a registry as a text file, updated periodically, and/or over HTTP.
+    """
+
+    _server = None
+    _writer = None
+
+    def __init__(self, textfile=None, interval=60, port=None, host="127.0.0.1", registry=REGISTRY) -> None:
+        """
+        Start exporting.
+
+        :param textfile: path of the text file, default: none written
+        :param interval: seconds between updates of the text file
+        :param port: TCP port to serve the metrics at, default: not served
+        :param host: address to serve the metrics at
+        :param registry: metrics to export
+        """
+        self._textfile = textfile
+        self._interval = interval
+        self._registry = registry
+        self._stop = threading.Event()
+        self._logger = logging.getLogger(__name__)
+        if port is not None:
+            handler = type('Handler', (_Handler, ), {'registry': registry})
+            self._server = http.server.ThreadingHTTPServer((host, port), handler)
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        if textfile:
+            self._writer = threading.Thread(target=self._run, name="metrics-textfile", daemon=True)
+            self._writer.start()
+
+    @property
+    def address(self) -> tuple:
+        """
+        (host, port) the metrics are served at, None if they are not served
+        """
+        return self._server.server_address if self._server else None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            self.write()
+
+    def write(self) -> None:
+        """
+        Update the text file now.
+        """
+        if self._textfile:
+            try:
+                write_textfile(self._textfile, self._registry)
+            except OSError as err:
+                self._logger.error(f"metrics: {err}")
+
+    def close(self) -> None:
+        """
+        Stop serving, and write the text file a last time.
+        """
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.write()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+_exporters = []
+_exporters_lock = threading.Lock()
+
+
+def start(settings: dict) -> Exporter:
+    """
+    Start exporting the metrics.
+
+    :param settings: metrics configuration, i.e., config['metrics']
+        - settings['textfile'], optional, path of text file
+        - settings['interval'], optional, seconds between updates of the text file (default 60)
+        - settings['port'], optional, TCP port to serve the metrics at
+        - settings['host'], optional, address to serve the metrics at (default 127.0.0.1)
+    :return: exporter
+    """
+    exporter = Exporter(textfile=settings.get('textfile'), interval=settings.get('interval', 60),
+                        port=settings.get('port'), host=settings.get('host', "127.0.0.1"))
+    with _exporters_lock:
+        _exporters.append(exporter)
+    return exporter
+
+
+def close_all() -> None:
+    """
+    Stop all exporters.
+    """
+    with _exporters_lock:
+        for exporter in _exporters:
+            exporter.close()
+        _exporters.clear()
+
+
+if __name__ == "__main__":
+    pass
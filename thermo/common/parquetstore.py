@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar store of parsed records, as Parquet files partitioned by instrument and day.
+
+Layout: <path>/<instrument>/<YYYY-MM-DD>.parquet, one file per instrument and (local) day. Columns are typed like the
+instrument tables in thermo/sqlite/schema.sql, with pcdate/pctime folded into the timestamp dtm and time/date folded
+into instrument_dtm; files written before a column was added (hio3) read it as null. Queries read only the files of
+the days and the columns they need:
+
+    df = parquetstore.read("~/data/parquet", "tei49i_1", start="2023-01-01", end="2024-01-01", columns=["dtm", "o3"])
+
+Records are written by a background thread, never by the acquisition. Each flush adds a part file
+<YYYY-MM-DD>_<written>.parquet; the parts of a day are merged into the file of the day, de-duplicated and sorted, once
+the day is over (or the store is closed). Queries read parts and day files alike; a query that finds a part merged
+and removed meanwhile is repeated.
+
+Requires polars.
+"""
+
+import datetime
+import glob
+import logging
+import os
+import queue
+import threading
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+import thermo.common.lrec as lrec
+
+# column name, polars type name; flags are stored as hex text, like in the sqlite tables
+COLUMNS = [('dtm', 'Datetime'), ('instrument_dtm', 'Datetime'), ('o3', 'Float64'), ('flags', 'Utf8'),
+           ('hio3', 'Float64'), ('cellai', 'Int64'), ('cellbi', 'Int64'), ('bncht', 'Float64'), ('lmpt', 'Float64'),
+           ('o3lt', 'Float64'), ('flowa', 'Float64'), ('flowb', 'Float64'), ('pres', 'Float64')]
+
+
+def schema() -> dict:
+    """
+    :return: polars schema of the store
+    """
+    return {name: getattr(pl, dtype) for name, dtype in COLUMNS}
+
+
+def _row(record: lrec.Record) -> tuple:
+    return (record.pcdtm or record.dtm, record.dtm, record.o3,
+            None if record.flags is None else f"{record.flags:08X}", record.hio3,
+            record.cellai, record.cellbi, record.bncht, record.lmpt, record.o3lt, record.flowa, record.flowb,
+            record.pres)
+
+
+def frame(records: list):
+    """
+    Convert records to a typed data frame.
+
+    :param records: list of lrec.Record
+    :return: polars.DataFrame with the columns of the store
+    """
+    return pl.DataFrame([_row(record) for record in records], schema=schema(), orient='row')
+
+
+def _is_part(file: str) -> bool:
+    return os.path.basename(file)[10:11] == "_"
+
+
+class ParquetStore:
+    """
+    Buffer records per instrument, write them as part files and compact the parts into the file of their day, in a
+    worker thread.
+    """
+
+    _worker = None
+
+    def __init__(self, path: str, flush_every=60) -> None:
+        """
+        Initialize store.
+
+        :param path: root directory of the store
+        :param flush_every: number of records buffered per instrument before they are written
+        """
+        if pl is None:
+            raise ImportError("parquetstore requires polars")
+        self._path = os.path.expanduser(path)
+        self._flush_every = max(1, int(flush_every))
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._days = {}
+        self._worker = threading.Thread(target=self._run, name="parquetstore", daemon=True)
+        self._worker.start()
+
+    def partition(self, instrument: str, day: datetime.date) -> str:
+        """
+        :return: path of the file holding the records of instrument on day
+        """
+        return os.path.join(self._path, instrument, f"{day:%Y-%m-%d}.parquet")
+
+    def append(self, instrument: str, record: lrec.Record) -> None:
+        """
+        Add a record. Records are queued for writing when flush_every have been collected or the day changes, and the
+        parts of the past day are then compacted.
+
+        :param instrument: name of instrument
+        :param record: parsed record
+        """
+        day = (record.pcdtm or record.dtm).date()
+        with self._lock:
+            buffer = self._buffers.setdefault(instrument, [])
+            # compact the parts of the past day, or of days that ended while the acquisition was not running
+            if self._days.get(instrument) != day:
+                self._flush(instrument)
+                self._queue.put(('compact', instrument, day))
+                self._days[instrument] = day
+            buffer.append(record)
+            if len(buffer) >= self._flush_every:
+                self._flush(instrument)
+
+    def extend(self, instrument: str, records: list) -> int:
+        """
+        Add many records, e.g., from a downloaded logger buffer or an archived datafile, and write and compact them.
+
+        :param instrument: name of instrument
+        :param records: list of lrec.Record
+        :return: number of records written
+        """
+        with self._lock:
+            self._flush(instrument)
+            self._queue.put(('write', instrument, list(records)))
+            self._queue.put(('compact', instrument, None))
+        self._queue.join()
+        return len(records)
+
+    def _flush(self, instrument: str) -> None:
+        records = self._buffers.get(instrument)
+        if records:
+            self._queue.put(('write', instrument, records))
+            self._buffers[instrument] = []
+
+    def _run(self) -> None:
+        while True:
+            task, instrument, arg = self._queue.get()
+            try:
+                if task == 'write':
+                    self._write(instrument, frame(arg))
+                elif task == 'compact':
+                    self.compact(instrument, before=arg)
+            except Exception as err:
+                logging.getLogger(__name__).error(f"parquet store, {task} {instrument}: {err}")
+            finally:
+                self._queue.task_done()
+            if task is None:
+                break
+
+    def _write(self, instrument: str, df) -> None:
+        if df.is_empty():
+            return
+        for (day, ), part in df.group_by(pl.col('dtm').dt.date(), maintain_order=True):
+            file = self.partition(instrument, day)
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            # parts sort after the file of the day, in the order they were written
+            written = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+            part_file = f"{file[:-len('.parquet')]}_{written}.parquet"
+            part.write_parquet(f"{part_file}.part", statistics=True)
+            os.replace(f"{part_file}.part", part_file)
+
+    def compact(self, instrument: str, before=None) -> None:
+        """
+        Merge the parts of each day into the file of the day, de-duplicated on dtm and sorted. Runs in the worker.
+
+        :param instrument: name of instrument
+        :param before: only compact days before this date, default: all
+        """
+        root = os.path.join(self._path, instrument)
+        days = {}
+        for part_file in sorted(glob.glob(os.path.join(root, "*_*.parquet"))):
+            day = os.path.basename(part_file)[:10]
+            if before is None or day < f"{before:%Y-%m-%d}":
+                days.setdefault(day, []).append(part_file)
+        for day, parts in days.items():
+            file = os.path.join(root, f"{day}.parquet")
+            sources = ([file] if os.path.exists(file) else []) + parts
+            # records downloaded more than once are stored once
+            df = (_scan_files(sources).collect()
+                  .unique(subset='dtm', keep='last', maintain_order=True).sort('dtm'))
+            df.write_parquet(f"{file}.part", statistics=True)
+            os.replace(f"{file}.part", file)
+            for part_file in parts:
+                os.remove(part_file)
+
+    def flush(self) -> None:
+        """
+        Queue all buffered records for writing, and wait until they are written.
+        """
+        with self._lock:
+            for instrument in self._buffers:
+                self._flush(instrument)
+        self._queue.join()
+
+    def close(self) -> None:
+        """
+        Write all buffered records, compact all parts and stop the worker.
+        """
+        with self._lock:
+            for instrument in self._buffers:
+                self._flush(instrument)
+                self._queue.put(('compact', instrument, None))
+            self._queue.put((None, None, None))
+        self._worker.join()
+
+
+def files(path: str, instrument: str, start=None, end=None) -> list:
+    """
+    Select the files of an instrument covering a period.
+
+    :param path: root directory of the store
+    :param instrument: name of instrument
+    :param start: first day to include, datetime, date or 'YYYY-MM-DD', default: first in store
+    :param end: end of period (exclusive), datetime, date or 'YYYY-MM-DD', default: last in store
+    :return: sorted list of paths
+    """
+    root = os.path.join(os.path.expanduser(path), instrument)
+    if not os.path.isdir(root):
+        return []
+    first = f"{_datetime(start):%Y-%m-%d}" if start else ""
+    # the last day with records before end
+    last = f"{_datetime(end) - datetime.timedelta(microseconds=1):%Y-%m-%d}" if end else "9999"
+    return [os.path.join(root, name) for name in sorted(os.listdir(root))
+            if name.endswith(".parquet") and first <= name[:10] <= last]
+
+
+def _scan_files(selected: list):
+    # columns missing in files written before they were added are read as null
+    return pl.scan_parquet(selected, schema=schema(), missing_columns='insert')
+
+
+def scan(path: str, instrument: str, start=None, end=None, columns=None, where=None):
+    """
+    Lazily query the store. Only the files of the selected days are opened, and only the selected columns are read.
+
+    :param path: root directory of the store
+    :param instrument: name of instrument
+    :param start: see files
+    :param end: see files
+    :param columns: list of column names, default: all
+    :param where: polars expression selecting records, e.g. pl.col('o3') > 5, evaluated before columns are selected
+    :return: polars.LazyFrame
+    """
+    selected = files(path, instrument, start, end)
+    if not selected:
+        lf = pl.DataFrame(schema=schema()).lazy()
+        return (lf if where is None else lf.filter(where)).select(columns or pl.all())
+    lf = _scan_files(selected)
+    if any(_is_part(file) for file in selected):
+        # parts not yet compacted may repeat records
+        lf = lf.unique(subset='dtm', keep='last', maintain_order=True).sort('dtm')
+    if start:
+        lf = lf.filter(pl.col('dtm') >= _datetime(start))
+    if end:
+        lf = lf.filter(pl.col('dtm') < _datetime(end))
+    if where is not None:
+        lf = lf.filter(where)
+    return lf.select(columns or pl.all())
+
+
+def read(path: str, instrument: str, start=None, end=None, columns=None, where=None, attempts=3):
+    """
+    Query the store, see scan. Parts selected by the query may be merged into the file of their day and removed
+    before they are read; the query is then repeated on the files found anew.
+
+    :param attempts: number of times the query is run before FileNotFoundError is raised
+    :return: polars.DataFrame
+    """
+    for attempt in range(attempts):
+        try:
+            return scan(path, instrument, start, end, columns, where).collect()
+        except FileNotFoundError:
+            if attempt == attempts - 1:
+                raise
+
+
+def _datetime(value) -> datetime.datetime:
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return datetime.datetime.fromisoformat(str(value))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(settings: dict) -> ParquetStore:
+    """
+    Return the store at a path, creating it if necessary.
+
+    :param settings: store configuration, i.e., config['parquet']
+        - settings['path']
+        - settings['flush_every'], optional, records buffered per instrument before writing (default 60)
+    :return: shared store
+    """
+    path = os.path.expanduser(settings['path'])
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ParquetStore(path, flush_every=settings.get('flush_every', 60))
+        return _stores[path]
+
+
+def close_all() -> None:
+    """
+    Write the records buffered in all stores, and stop them.
+    """
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Quality control of TEI49C/TEI49i records with bit masks.
+
+The flags of a record are its status word, 8 hex digits. A record passes the flag check if the bits selected by mask
+have the expected value, or one of a list of accepted values; bits outside the mask (e.g., of modes that do not affect
+the measurement) may take any value. Values are checked against valid ranges. The result of QC is an integer with one bit per failed check, 0 for a clean
+record:
+
+    bit 0   flags
+    bit 1   o3          bit 2   bncht       bit 3   lmpt        bit 4   o3lt
+    bit 5   flowa       bit 6   flowb       bit 7   pres        bit 8   cellai      bit 9   cellbi
+
+Rules are defined per instrument type, and may be overridden per instrument, in the qc section of thermo.cfg:
+
+    qc:
+        TEI49I:
+            flags:
+                mask: 0xFFFFBEFF    # bits compared
+                value: 0x0C100400   # expected value of the compared bits
+            ranges:                 # valid values lie strictly between min and max, null for no limit
+                o3: [5, null]
+        tei49i_2:
+            flags:                  # accepted values, of all 32 bits unless a mask is given
+                values: [0x0C100000, 0x0C100100, 0x0C100400, 0x0C105000]
+
+The same rules are applied to batches of records as polars expressions (expression), and inside sqlite as SQL
+expression over the integer flags column (sql).
+"""
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+CHECKS = ('flags', 'o3', 'bncht', 'lmpt', 'o3lt', 'flowa', 'flowb', 'pres', 'cellai', 'cellbi')
+BITS = {name: 1 << i for i, name in enumerate(CHECKS)}
+
+# the conditions of the V_O3_*_clean views before the qc column was introduced. A mask frees only bits in which the
+# accepted flag words differ in every combination, like 0x4000 and 0x0100 of TEI49I (0C100400, 0C104400, 0C100500 and
+# 0C104500); other accepted words are listed. lmpt is reported with 1 decimal, > 55.4 is >= 55.5.
+RULES = {
+    'TEI49C': {'flags': {'values': [0x1C000000, 0x1C100500]},
+               'ranges': {'o3': [5, None], 'bncht': [23, None], 'lmpt': [55.4, None]}},
+    'TEI49I': {'flags': {'mask': 0xFFFFBEFF, 'value': 0x0C100400},
+               'ranges': {'o3': [5, None]}},
+    'tei49i_2': {'flags': {'values': [0x0C100000, 0x0C100100, 0x0C100400, 0x0C105000]},
+                 'ranges': {'o3': [10, None]}},
+}
+
+# all bits of the flags
+ALL = 0xFFFFFFFF
+
+
+def rules_for(name: str, kind=None, config=None) -> dict:
+    """
+    Select the rules of an instrument.
+
+    :param name: name of instrument (or table)
+    :param kind: type of instrument, e.g. 'TEI49C'. Default: derived from name.
+    :param config: rules by instrument name or type, i.e., cfg['qc']. Default: RULES
+    :return: rules of the instrument, those of its type unless there are rules for the instrument itself
+    """
+    rules = RULES if config is None else config
+    if kind is None:
+        kind = 'TEI49C' if name.lower().startswith('tei49c') else 'TEI49I'
+    return rules.get(name) or rules.get(kind) or {}
+
+
+def flags_to_int(flags: str):
+    """
+    :param flags: flags as hex string, e.g. '0C100400'
+    :return: integer, None if flags is not hex
+    """
+    try:
+        return int(flags, 16)
+    except (TypeError, ValueError):
+        return None
+
+
+def _flags(rules: dict) -> tuple:
+    # mask, and the accepted values of the masked bits
+    flags = rules['flags']
+    mask = flags.get('mask', ALL)
+    values = flags['values'] if 'values' in flags else [flags['value']]
+    return mask, sorted({value & mask for value in values})
+
+
+def _ranges(rules: dict):
+    for name, (low, high) in (rules.get('ranges') or {}).items():
+        if name not in BITS:
+            raise ValueError(f"no qc check for '{name}', must be one of {CHECKS}")
+        yield name, low, high
+
+
+def columns(rules: dict) -> list:
+    """
+    :param rules: see rules_for
+    :return: names of the values the rules check
+    """
+    return (['flags'] if rules.get('flags') else []) + [name for name, _, _ in _ranges(rules)]
+
+
+def expression(rules: dict, flags='flags', text=False):
+    """
+    Polars expression computing the result of QC of each record, e.g. for frames of decode.decode, or of the parquet
+    store (with text=True).
+
+    :param rules: see rules_for
+    :param flags: name of the flags column
+    :param text: Are the flags hex text rather than integers?
+    :return: polars.Expr of Int64, 0 for clean records
+    """
+    column = pl.col(flags).str.to_integer(base=16, strict=False) if text else pl.col(flags)
+    result = pl.lit(0, dtype=pl.Int64)
+    if rules.get('flags'):
+        mask, values = _flags(rules)
+        ok = (column.cast(pl.Int64) & mask).is_in(values).fill_null(False)
+        result = result | pl.when(ok).then(0).otherwise(BITS['flags'])
+    for name, low, high in _ranges(rules):
+        ok = pl.lit(True)
+        if low is not None:
+            ok = ok & (pl.col(name) > low)
+        if high is not None:
+            ok = ok & (pl.col(name) < high)
+        result = result | pl.when(ok.fill_null(False)).then(0).otherwise(BITS[name])
+    return result.cast(pl.Int64)
+
+
+def sql(rules: dict, prefix="") -> str:
+    """
+    SQL expression computing the result of QC of a row, from the integer flags column iflags.
+
+    :param rules: see rules_for
+    :param prefix: prefix of column names, e.g. 'NEW.' in triggers
+    :return: SQL expression, 0 for clean rows
+    """
+    terms = []
+    if rules.get('flags'):
+        mask, values = _flags(rules)
+        terms.append(f"(coalesce(({prefix}iflags & {mask}) NOT IN ({', '.join(map(str, values))}), 1) "
+                     f"* {BITS['flags']})")
+    for name, low, high in _ranges(rules):
+        conditions = [f"{prefix}{name} > {low}"] if low is not None else []
+        conditions += [f"{prefix}{name} < {high}"] if high is not None else []
+        if conditions:
+            terms.append(f"(coalesce(NOT ({' AND '.join(conditions)}), 1) * {BITS[name]})")
+    return " | ".join(terms) or "0"
+
+
+def describe(result: int) -> list:
+    """
+    :param result: result of QC of a record
+    :return: names of the failed checks
+    """
+    return [name for name in CHECKS if result & BITS[name]]
+
+
+if __name__ == "__main__":
+    pass
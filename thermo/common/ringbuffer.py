@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-capacity buffer of the recent samples of an instrument, held in memory as typed numpy columns.
+
+get_data appends every parsed record, so that live displays and checks read the recent history from memory rather
+than querying the instrument or reading datafiles. Each value is written twice, at i and i + capacity, so that the
+last n samples are always one contiguous slice and can be returned as views, without copying:
+
+    buffer = ringbuffer.get_buffer('tei49c', capacity=1440)
+    o3 = buffer.last(60)['o3']                      # view of the last 60 values
+    mean, std = buffer.rolling('o3', window=10)
+
+Views are read-only and change as samples are appended. Copy them to keep them.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import thermo.common.lrec as lrec
+
+# name, numpy type. dtm is seconds since the epoch, of the pc timestamp if the record has one.
+COLUMNS = (('dtm', 'float64'), ('o3', 'float64'), ('flags', 'int64'), ('cellai', 'int64'), ('cellbi', 'int64'),
+           ('bncht', 'float64'), ('lmpt', 'float64'), ('o3lt', 'float64'), ('flowa', 'float64'),
+           ('flowb', 'float64'), ('pres', 'float64'))
+
+# stored for integer values a record does not carry. Missing floats are stored as nan.
+MISSING = -1
+
+
+class RingBuffer:
+    """
+    Last capacity samples of one instrument.
+    """
+
+    _count = 0
+
+    def __init__(self, capacity: int) -> None:
+        """
+        Initialize buffer.
+
+        :param capacity: number of samples kept
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self._capacity = int(capacity)
+        self._data = {name: np.full(2 * self._capacity, np.nan if dtype == 'float64' else MISSING, dtype=dtype)
+                      for name, dtype in COLUMNS}
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        return min(self._count, self._capacity)
+
+    def append(self, record: lrec.Record) -> None:
+        """
+        Add a sample, replacing the oldest if the buffer is full.
+
+        :param record: parsed record
+        """
+        values = record._asdict()
+        values['dtm'] = (record.pcdtm or record.dtm).timestamp()
+        with self._lock:
+            i = self._count % self._capacity
+            for name, dtype in COLUMNS:
+                value = values[name]
+                if value is None:
+                    value = np.nan if dtype == 'float64' else MISSING
+                column = self._data[name]
+                column[i] = column[i + self._capacity] = value
+            self._count += 1
+
+    def _window(self, n=None) -> slice:
+        end = self._count % self._capacity + self._capacity if self._count >= self._capacity else self._count
+        n = len(self) if n is None else max(0, min(int(n), len(self)))
+        return slice(end - n, end)
+
+    def last(self, n=None) -> dict:
+        """
+        Views of the last n samples, oldest first.
+
+        :param n: number of samples, default: all in buffer
+        :return: dictionary of column name: read-only numpy array
+        """
+        with self._lock:
+            window = self._window(n)
+            columns = {name: column[window] for name, column in self._data.items()}
+        for column in columns.values():
+            column.flags.writeable = False
+        return columns
+
+    def since(self, t: float) -> dict:
+        """
+        Views of the samples taken at or after t.
+
+        :param t: seconds since the epoch
+        :return: see last
+        """
+        columns = self.last()
+        start = int(np.searchsorted(columns['dtm'], t, side='left'))
+        return {name: column[start:] for name, column in columns.items()}
+
+    def latest(self, max_age=None) -> dict:
+        """
+        Values of the last sample.
+
+        :param max_age: seconds, ignore a last sample older than this
+        :return: dictionary of column name: value, None if the buffer is empty or the last sample too old
+        """
+        if not len(self):
+            return None
+        sample = {name: column[-1].item() for name, column in self.last(1).items()}
+        if max_age is not None and time.time() - sample['dtm'] > max_age:
+            return None
+        return sample
+
+    def mean(self, name: str, n=None) -> float:
+        """
+        Mean of a column over the last n samples, ignoring missing values.
+
+        :return: mean, nan if there are no values
+        """
+        values = self._values(name, n)
+        return float(np.mean(values)) if values.size else np.nan
+
+    def std(self, name: str, n=None) -> float:
+        """
+        Standard deviation of a column over the last n samples, ignoring missing values.
+
+        :return: sample standard deviation, nan if there are less than 2 values
+        """
+        values = self._values(name, n)
+        return float(np.std(values, ddof=1)) if values.size > 1 else np.nan
+
+    def _values(self, name: str, n=None) -> np.ndarray:
+        values = self.last(n)[name]
+        if values.dtype.kind == 'f':
+            return values[~np.isnan(values)]
+        return values[values != MISSING].astype('float64')
+
+    def rolling(self, name: str, window: int, n=None) -> tuple:
+        """
+        Rolling mean and standard deviation of a column, ignoring missing values.
+
+        :param name: name of column
+        :param window: number of samples per window
+        :param n: number of samples to compute over, default: all in buffer
+        :return: (means, standard deviations), numpy arrays with one value per window ending at each of the last
+                 n - window + 1 samples; nan where a window has too few values
+        """
+        column = self.last(n)[name]
+        values = column.astype('float64')
+        if column.dtype.kind == 'i':
+            values[column == MISSING] = np.nan
+        valid = ~np.isnan(values)
+        if values.size < window:
+            return np.empty(0), np.empty(0)
+        # running sums of the values, their squares and their number, with a leading 0
+        filled = np.where(valid, values, 0.0)
+        sums = np.concatenate(([0.0], np.cumsum(filled)))
+        squares = np.concatenate(([0.0], np.cumsum(filled * filled)))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        s = sums[window:] - sums[:-window]
+        q = squares[window:] - squares[:-window]
+        k = (counts[window:] - counts[:-window]).astype('float64')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s / k
+            var = np.maximum(q - k * mean * mean, 0.0) / (k - 1)
+        return mean, np.where(k > 1, np.sqrt(var), np.nan)
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_buffer(name: str, capacity=1440) -> RingBuffer:
+    """
+    Return the buffer of an instrument, creating it if necessary.
+
+    :param name: name of instrument
+    :param capacity: number of samples kept, used when the buffer is created
+    :return: shared buffer
+    """
+    with _buffers_lock:
+        if name not in _buffers:
+            _buffers[name] = RingBuffer(capacity)
+        return _buffers[name]
+
+
+if __name__ == "__main__":
+    pass
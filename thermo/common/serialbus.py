@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Port-owner worker for several instruments sharing one RS-232 line.
+
+Each serial port is opened once, by one SerialBus. Instruments submit requests to the bus, which serializes them
+through a priority queue, so that responses cannot interleave and time-critical polls go ahead of configuration or
+bulk traffic.
+"""
+
+import concurrent.futures
+import itertools
+import logging
+import queue
+import threading
+import time
+
+import thermo.common.metrics as metrics
+import thermo.common.serialsession as serialsession
+
+# request priorities, lower values are served first
+PRIORITY_POLL = 0
+PRIORITY_CONFIG = 1
+PRIORITY_BULK = 2
+
+
+class SerialBus:
+    """
+    Own one serial port and serve requests from a queue in a worker thread.
+    """
+
+    _logger = None
+    _worker = None
+
+    def __init__(self, session: serialsession.SerialSession) -> None:
+        """
+        Initialize bus and start worker.
+
+        :param session: serial session for the port owned by this bus
+        """
+        self._session = session
+        self._port = session.health()['port']
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._logger = logging.getLogger(__name__)
+        self._served = [0, 0, 0]
+        self.start()
+
+    def start(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="serialbus", daemon=True)
+            self._worker.start()
+
+    def stop(self) -> None:
+        """
+        Stop the worker after the requests already queued have been served, and close the port.
+        """
+        self._queue.put((PRIORITY_BULK + 1, next(self._seq), None, None, None))
+        self._worker.join()
+        self._session.close()
+
+    def submit(self, payload: bytes, priority=PRIORITY_CONFIG) -> concurrent.futures.Future:
+        """
+        Queue a request.
+
+        :param payload: raw bytes sent to instrument, including the instrument id
+        :param priority: one of PRIORITY_POLL, PRIORITY_CONFIG, PRIORITY_BULK
+        :return: future resolving to the raw response
+        """
+        future = concurrent.futures.Future()
+        self._queue.put((priority, next(self._seq), payload, future, time.perf_counter()))
+        metrics.BUS_QUEUED.set(self._queue.qsize(), port=self._port)
+        return future
+
+    def query(self, payload: bytes, priority=PRIORITY_CONFIG) -> bytes:
+        """
+        Queue a request and wait for the response.
+
+        :param payload: raw bytes sent to instrument, including the instrument id
+        :param priority: one of PRIORITY_POLL, PRIORITY_CONFIG, PRIORITY_BULK
+        :return: raw response
+        """
+        return self.submit(payload, priority).result()
+
+    def _run(self) -> None:
+        while True:
+            priority, _, payload, future, queued = self._queue.get()
+            if future is None:
+                break
+            metrics.BUS_WAIT.observe(time.perf_counter() - queued, port=self._port)
+            metrics.BUS_QUEUED.set(self._queue.qsize(), port=self._port)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._session.query(payload))
+            except Exception as err:
+                future.set_exception(err)
+            self._served[min(priority, PRIORITY_BULK)] += 1
+
+    def health(self) -> dict:
+        """
+        Report state of the port and the queue.
+
+        :return: see SerialSession.health, plus queue depth and number of requests served per priority
+        """
+        health = self._session.health()
+        health['queued'] = self._queue.qsize()
+        health['served'] = dict(zip(['poll', 'config', 'bulk'], self._served))
+        return health
+
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def get_bus(port: str, settings: dict) -> SerialBus:
+    """
+    Return the bus owning port, creating it if necessary.
+
+    :param port: name of serial port
+    :param settings: serial port configuration, i.e., config[port]
+        - settings['baudrate']
+        - settings['bytesize']
+        - settings['parity']
+        - settings['stopbits']
+        - settings['timeout']
+        - settings['deadline'], optional, seconds to wait for a complete response (default 2)
+    :return: shared bus
+    """
+    with _buses_lock:
+        if port not in _buses:
+            session = serialsession.SerialSession(port=port,
+                                                  baudrate=settings['baudrate'],
+                                                  bytesize=settings['bytesize'],
+                                                  parity=settings['parity'],
+                                                  stopbits=settings['stopbits'],
+                                                  timeout=settings['timeout'],
+                                                  deadline=settings.get('deadline', 2))
+            _buses[port] = SerialBus(session)
+        return _buses[port]
+
+
+def close_all() -> None:
+    """
+    Stop all buses and close their ports.
+    """
+    with _buses_lock:
+        for bus in _buses.values():
+            bus.stop()
+        _buses.clear()
+
+
+if __name__ == "__main__":
+    pass
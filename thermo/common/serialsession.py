@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Always-open serial sessions for instruments connected to a RS-232 port.
+
+The port is opened once and kept open. Responses are read up to the '\\r' terminator with a deadline instead of
+sleeping for a fixed time and polling the input buffer.
+"""
+
+import logging
+import threading
+import time
+
+import serial
+
+import thermo.common.metrics as metrics
+
+
+class SerialSession:
+    """
+    Long-lived connection to one serial port.
+    """
+
+    _logger = None
+    _serial = None
+
+    def __init__(self, port: str, baudrate=9600, bytesize=8, parity='N', stopbits=1, timeout=0.1, deadline=2,
+                 terminator=b'\x0D') -> None:
+        """
+        Initialize session. The port is opened lazily on the first query.
+
+        :param port: name of serial port, e.g. COM2 or /dev/ttyUSB0
+        :param baudrate: see serial.Serial
+        :param bytesize: see serial.Serial
+        :param parity: see serial.Serial
+        :param stopbits: see serial.Serial
+        :param timeout: seconds, timeout of a single read
+        :param deadline: seconds to wait for a complete response
+        :param terminator: byte sequence terminating a response
+        """
+        self._port = port
+        self._settings = dict(baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits,
+                              timeout=timeout)
+        self._deadline = deadline
+        self._terminator = terminator
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(__name__)
+
+        # health counters
+        self._commands = 0
+        self._failures = 0
+        self._reopens = 0
+        self._last_latency = None
+        self._last_ok = None
+        self._last_error = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._serial is not None and self._serial.is_open
+
+    def open(self) -> None:
+        """
+        Open the serial port, replacing any existing handle.
+        """
+        self.close()
+        self._serial = serial.Serial(port=self._port, **self._settings)
+
+    def close(self) -> None:
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except (serial.SerialException, OSError):
+                pass
+        self._serial = None
+
+    def query(self, payload: bytes) -> bytes:
+        """
+        Send payload and return the response up to and including the terminator.
+
+        If the port raises an error, it is reopened and the payload is sent once more.
+
+        :param payload: raw bytes sent to instrument
+        :return: raw response
+        """
+        with self._lock:
+            t0 = time.perf_counter()
+            for attempt in (0, 1):
+                try:
+                    if not self.is_open:
+                        if attempt or self._commands:
+                            self._reopens += 1
+                        self.open()
+                    # discard late bytes of an earlier, incomplete exchange
+                    self._serial.reset_input_buffer()
+                    self._serial.write(payload)
+                    metrics.BYTES_SENT.inc(len(payload), session=self._port)
+                    rcvd = self._read_until_terminator()
+                    metrics.BYTES_RECEIVED.inc(len(rcvd), session=self._port)
+                    self._commands += 1
+                    self._last_latency = time.perf_counter() - t0
+                    self._last_ok = time.time()
+                    return rcvd
+
+                except TimeoutError as err:
+                    metrics.TIMEOUTS.inc(session=self._port)
+                    self._failures += 1
+                    self._last_error = f"{type(err).__name__}: {err}"
+                    raise
+
+                except (serial.SerialException, OSError) as err:
+                    self.close()
+                    self._last_error = f"{type(err).__name__}: {err}"
+                    if attempt:
+                        self._failures += 1
+                        raise
+                    metrics.RETRIES.inc(session=self._port)
+                    self._logger.warning(f"Serial port {self._port} failed ({err}), reopening.")
+
+    def _read_until_terminator(self) -> bytes:
+        deadline = time.monotonic() + self._deadline
+        rcvd = b''
+        while self._terminator not in rcvd:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"no response terminator on {self._port} within {self._deadline} s "
+                                   f"(received {rcvd!r})")
+            # block for the first byte (up to the read timeout), then take whatever else is waiting
+            data = self._serial.read(max(1, self._serial.in_waiting))
+            rcvd += data
+        return rcvd[:rcvd.index(self._terminator) + len(self._terminator)]
+
+    def health(self) -> dict:
+        """
+        Report state and counters of the session.
+
+        :return: dictionary with port state, command/failure/reopen counts, latency of last command [s],
+                 time of last successful command and last error
+        """
+        return {
+            'port': self._port,
+            'open': self.is_open,
+            'commands': self._commands,
+            'failures': self._failures,
+            'reopens': self._reopens,
+            'last_latency': self._last_latency,
+            'last_ok': self._last_ok,
+            'last_error': self._last_error,
+        }
+
+
+if __name__ == "__main__":
+    pass
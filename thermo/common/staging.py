@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Stage completed datafiles for transfer, in a background thread.
+
+Files are queued by the acquisition (e.g., when a DataWriter starts the file of a new reporting bin) and, as a
+fallback, found by scanning watched directories for files of closed reporting bins that have not been staged yet.
+A worker compresses them (zip, or zstd if the zstandard package is installed) or copies them to
+<staging>/<name of data directory>/. Queueing never blocks: if the queue is full, the file is left for a later scan.
+
+What has been staged is recorded per watched directory, not inferred from the staging directory, from which the
+transfer removes files. The mark, the end of the latest bin up to which all files have been staged, is kept in
+<data directory>/.staged. Scans only consider later bins; a directory without mark is marked when it is first
+watched, so that the archive of older files is not staged again.
+
+Files of logger downloads, e.g. <name>_all_lrec-<YYYYmmddHHMMSS>.dat, are not found by scans: they are named after
+the start of the download and written while it runs, so they are staged by the drivers once the download completes.
+"""
+
+import datetime
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# files named after the end of their reporting bin, see datetimebin.dtbin. Downloads carry 14 digits and do not match.
+_BINNED = re.compile(r"-(\d{12})\.dat$")
+
+# name of the file holding the mark of a watched directory
+MARK = ".staged"
+
+COMPRESSIONS = ('zip', 'zstd')
+
+
+class StagingPipeline:
+    """
+    Bounded queue of files to stage, served by one worker thread.
+    """
+
+    _logger = None
+    _worker = None
+
+    def __init__(self, staging: str, compression='zip', maxsize=100, scan_interval=60) -> None:
+        """
+        Initialize pipeline and start worker.
+
+        :param staging: staging directory
+        :param compression: 'zip' or 'zstd'. Falls back to zip if zstandard is not installed.
+        :param maxsize: number of files that can be queued
+        :param scan_interval: seconds between scans of watched directories
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {COMPRESSIONS}")
+        self._logger = logging.getLogger(__name__)
+        if compression == 'zstd' and zstandard is None:
+            self._logger.warning("zstandard is not installed, staging zip files instead")
+            compression = 'zip'
+        self._staging = staging
+        self._compression = compression
+        self._scan_interval = scan_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._queued = set()
+        self._watched = {}
+        self._marks = {}
+        self._done = {}
+        self._lock = threading.Lock()
+        self._staged = 0
+        self._rejected = 0
+        self._running = True
+        self.start()
+
+    def start(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="staging", daemon=True)
+            self._worker.start()
+
+    def stop(self) -> None:
+        """
+        Stop the worker after the files already queued have been staged.
+        """
+        self._running = False
+        self._queue.put((None, None))
+        self._worker.join()
+
+    def target(self, path: str, compress=True) -> str:
+        """
+        Path of the staged copy of a file.
+
+        :param path: datafile
+        :param compress: compressed or plain copy
+        :return: path in staging directory
+        """
+        root = os.path.join(self._staging, os.path.basename(os.path.dirname(path)))
+        name = os.path.basename(path)
+        if compress:
+            name = f"{name}.zst" if self._compression == 'zstd' else f"{name[:-4]}.zip"
+        return os.path.join(root, name)
+
+    def staged(self, path: str) -> bool:
+        """
+        Check if a file of a watched directory has been staged, according to the mark of the directory.
+        """
+        datadir, name = os.path.split(path)
+        match = _BINNED.search(name)
+        with self._lock:
+            mark = self._marks.get(datadir)
+            if match is None or mark is None:
+                return False
+            return match.group(1) <= mark or match.group(1) in self._done[datadir]
+
+    def submit(self, path: str, compress=True) -> bool:
+        """
+        Queue a file for staging, without blocking.
+
+        :param path: datafile
+        :param compress: compress or copy the file
+        :return: True if queued (or already queued), False if the queue is full
+        """
+        with self._lock:
+            if path in self._queued:
+                return True
+            try:
+                self._queue.put_nowait((path, compress))
+            except queue.Full:
+                self._rejected += 1
+                self._logger.warning(f"staging queue full, {os.path.basename(path)} left for a later scan")
+                return False
+            self._queued.add(path)
+            return True
+
+    def watch(self, datadir: str, compress=True) -> None:
+        """
+        Stage files of reporting bins closed after the mark of a directory, that have not been queued. Without mark,
+        the directory is marked now, i.e., only bins closed from now on are staged.
+
+        :param datadir: directory of datafiles named <name>-<end of bin>.dat
+        :param compress: compress or copy the files
+        """
+        mark = _read_mark(datadir)
+        if mark is None:
+            mark = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M")
+            _write_mark(datadir, mark)
+        with self._lock:
+            self._watched[datadir] = compress
+            self._marks.setdefault(datadir, mark)
+            self._done.setdefault(datadir, set())
+
+    def scan(self) -> int:
+        """
+        Queue the files of reporting bins closed after the mark of watched directories, that have not been staged,
+        and advance the marks.
+
+        :return: number of files queued
+        """
+        now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M")
+        with self._lock:
+            watched = list(self._watched.items())
+        queued = 0
+        for datadir, compress in watched:
+            try:
+                names = sorted(os.listdir(datadir))
+            except OSError:
+                continue
+            with self._lock:
+                mark, done = self._marks[datadir], self._done[datadir]
+            pending = []
+            for name in names:
+                match = _BINNED.search(name)
+                if match is None or not mark < match.group(1) <= now:
+                    continue
+                if match.group(1) in done:
+                    continue
+                pending.append((match.group(1), os.path.join(datadir, name)))
+            self._advance(datadir, min(pending)[0] if pending else None, now)
+            for _, path in pending:
+                with self._lock:
+                    if path in self._queued:
+                        continue
+                if not self.submit(path, compress):
+                    return queued
+                queued += 1
+        return queued
+
+    def _advance(self, datadir: str, pending, now: str) -> None:
+        # the mark moves to the latest staged bin before the first that is still pending
+        with self._lock:
+            done = self._done[datadir]
+            staged = [b for b in done if b <= now and (pending is None or b < pending)]
+            if not staged:
+                return
+            mark = max(staged)
+            self._marks[datadir] = mark
+            done.difference_update(staged)
+        _write_mark(datadir, mark)
+
+    def _run(self) -> None:
+        last_scan = 0.0
+        while True:
+            try:
+                path, compress = self._queue.get(timeout=1)
+            except queue.Empty:
+                if self._running and time.monotonic() - last_scan > self._scan_interval:
+                    last_scan = time.monotonic()
+                    self.scan()
+                continue
+            if path is None:
+                break
+            try:
+                self._stage(path, compress)
+                self._staged += 1
+                match = _BINNED.search(path)
+                with self._lock:
+                    if match and os.path.dirname(path) in self._done:
+                        self._done[os.path.dirname(path)].add(match.group(1))
+            except Exception as err:
+                self._logger.error(f"staging {path}: {err}")
+            finally:
+                with self._lock:
+                    self._queued.discard(path)
+
+    def _stage(self, path: str, compress: bool) -> None:
+        target = self.target(path, compress)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # write to a temporary file first, so that transfers never pick up an incomplete file
+        tmp = f"{target}.part"
+        if not compress:
+            shutil.copyfile(path, tmp)
+        elif self._compression == 'zstd':
+            with open(path, "rb") as src, open(tmp, "wb") as dst:
+                zstandard.ZstdCompressor().copy_stream(src, dst)
+        else:
+            with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as fh:
+                fh.write(path, os.path.basename(path))
+        os.replace(tmp, target)
+
+    def health(self) -> dict:
+        """
+        Report state of the pipeline.
+
+        :return: number of files queued, staged and rejected because the queue was full
+        """
+        return {'queued': self._queue.qsize(), 'staged': self._staged, 'rejected': self._rejected}
+
+
+def _read_mark(datadir: str):
+    try:
+        with open(os.path.join(datadir, MARK), encoding='utf8') as fh:
+            mark = fh.read().strip()
+        return mark if re.fullmatch(r"\d{12}", mark) else None
+    except OSError:
+        return None
+
+
+def _write_mark(datadir: str, mark: str) -> None:
+    path = os.path.join(datadir, MARK)
+    try:
+        with open(f"{path}.part", "w", encoding='utf8') as fh:
+            fh.write(mark)
+        os.replace(f"{path}.part", path)
+    except OSError as err:
+        logging.getLogger(__name__).warning(f"staging mark of {datadir} not saved: {err}")
+
+
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def get_pipeline(settings: dict) -> StagingPipeline:
+    """
+    Return the pipeline of a staging directory, creating it if necessary.
+
+    :param settings: staging configuration, i.e., config['staging']
+        - settings['path']
+        - settings['compression'], optional, 'zip' or 'zstd' (default 'zip')
+        - settings['queue_size'], optional, number of files that can be queued (default 100)
+    :return: shared pipeline
+    """
+    path = os.path.expanduser(settings['path'])
+    with _pipelines_lock:
+        if path not in _pipelines:
+            _pipelines[path] = StagingPipeline(staging=path,
+                                               compression=settings.get('compression', 'zip'),
+                                               maxsize=settings.get('queue_size', 100))
+        return _pipelines[path]
+
+
+def close_all() -> None:
+    """
+    Stage the files already queued and stop all pipelines.
+    """
+    with _pipelines_lock:
+        for pipeline in _pipelines.values():
+            pipeline.stop()
+        _pipelines.clear()
+
+
+if __name__ == "__main__":
+    pass
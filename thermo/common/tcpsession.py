@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent TCP/IP sessions for instruments that are queried over a socket.
+
+One session is kept per (host, port). It stays connected between commands, reconnects transparently after errors
+and reads responses up to the '\\r' terminator instead of sleeping for a fixed time.
+"""
+
+import asyncio
+import logging
+import socket
+import threading
+import time
+
+import thermo.common.metrics as metrics
+
+
+class TCPSession:
+    """
+    Long-lived socket connection to one instrument.
+    """
+
+    _buffer = b''
+    _logger = None
+    _sock = None
+
+    def __init__(self, host: str, port: int, timeout=5, terminator=b'\x0D') -> None:
+        """
+        Initialize session. The connection is opened lazily on the first query.
+
+        :param host: IP address or host name of instrument
+        :param port: TCP port of instrument
+        :param timeout: seconds to wait for connect and for a complete response
+        :param terminator: byte sequence terminating a response
+        """
+        self._sockaddr = (host, port)
+        self._label = f"{host}:{port}"
+        self._timeout = timeout
+        self._terminator = terminator
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(__name__)
+
+        # health counters
+        self._commands = 0
+        self._failures = 0
+        self._reconnects = 0
+        self._connected_since = None
+        self._last_latency = None
+        self._last_ok = None
+        self._last_error = None
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def connect(self) -> None:
+        """
+        Open the socket connection, replacing any existing one.
+        """
+        self.close()
+        sock = socket.create_connection(self._sockaddr, timeout=self._timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._sock = sock
+        self._buffer = b''
+        self._connected_since = time.time()
+
+    def close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._connected_since = None
+
+    def query(self, payload: bytes) -> bytes:
+        """
+        Send payload and return the response up to and including the terminator.
+
+        If the connection is broken, it is re-established and the payload is sent once more.
+
+        :param payload: raw bytes sent to instrument
+        :return: raw response
+        """
+        with self._lock:
+            t0 = time.perf_counter()
+            for attempt in (0, 1):
+                try:
+                    if self._sock is None:
+                        if attempt or self._commands:
+                            self._reconnects += 1
+                        self.connect()
+                    # discard anything left over from an earlier, incomplete exchange
+                    self._buffer = b''
+                    self._sock.sendall(payload)
+                    metrics.BYTES_SENT.inc(len(payload), session=self._label)
+                    rcvd = self._read_until_terminator()
+                    metrics.BYTES_RECEIVED.inc(len(rcvd), session=self._label)
+                    self._commands += 1
+                    self._last_latency = time.perf_counter() - t0
+                    self._last_ok = time.time()
+                    return rcvd
+
+                except (socket.timeout, ConnectionError, OSError) as err:
+                    # the state of the connection is unknown, so never reuse it
+                    self.close()
+                    self._last_error = f"{type(err).__name__}: {err}"
+                    if isinstance(err, socket.timeout):
+                        metrics.TIMEOUTS.inc(session=self._label)
+                    if attempt or isinstance(err, socket.timeout):
+                        self._failures += 1
+                        raise
+                    metrics.RETRIES.inc(session=self._label)
+                    self._logger.warning(f"Connection to {self._sockaddr} lost ({err}), reconnecting.")
+
+    def _read_until_terminator(self) -> bytes:
+        deadline = time.monotonic() + self._timeout
+        while self._terminator not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout(f"no response terminator from {self._sockaddr} within {self._timeout} s")
+            self._sock.settimeout(remaining)
+            data = self._sock.recv(1024)
+            if not data:
+                raise ConnectionResetError(f"connection closed by {self._sockaddr}")
+            self._buffer += data
+        end = self._buffer.index(self._terminator) + len(self._terminator)
+        rcvd, self._buffer = self._buffer[:end], self._buffer[end:]
+        return rcvd
+
+    def health(self) -> dict:
+        """
+        Report state and counters of the session.
+
+        :return: dictionary with connection state, command/failure/reconnect counts, latency of last command [s],
+                 time of last successful command and last error
+        """
+        return {
+            'host': self._sockaddr[0],
+            'port': self._sockaddr[1],
+            'connected': self.connected,
+            'connected_since': self._connected_since,
+            'commands': self._commands,
+            'failures': self._failures,
+            'reconnects': self._reconnects,
+            'last_latency': self._last_latency,
+            'last_ok': self._last_ok,
+            'last_error': self._last_error,
+        }
+
+
+class AsyncTCPSession(TCPSession):
+    """
+    Long-lived asyncio stream connection to one instrument, for use from within an event loop.
+    """
+
+    _reader = None
+    _writer = None
+
+    def __init__(self, host: str, port: int, timeout=5, terminator=b'\x0D') -> None:
+        super().__init__(host, port, timeout, terminator)
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def connect(self) -> None:
+        """
+        Open the stream connection, replacing any existing one.
+        """
+        self.close()
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(*self._sockaddr),
+                                                            timeout=self._timeout)
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._connected_since = time.time()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except RuntimeError:
+                # event loop already closed
+                pass
+        self._reader = None
+        self._writer = None
+        self._connected_since = None
+
+    async def query(self, payload: bytes) -> bytes:
+        """
+        Send payload and return the response up to and including the terminator.
+
+        If the connection is broken, it is re-established and the payload is sent once more.
+
+        :param payload: raw bytes sent to instrument
+        :return: raw response
+        """
+        async with self._lock:
+            t0 = time.perf_counter()
+            for attempt in (0, 1):
+                try:
+                    if self._writer is None:
+                        if attempt or self._commands:
+                            self._reconnects += 1
+                        await self.connect()
+                    self._writer.write(payload)
+                    await self._writer.drain()
+                    metrics.BYTES_SENT.inc(len(payload), session=self._label)
+                    rcvd = await asyncio.wait_for(self._reader.readuntil(self._terminator), timeout=self._timeout)
+                    metrics.BYTES_RECEIVED.inc(len(rcvd), session=self._label)
+                    self._commands += 1
+                    self._last_latency = time.perf_counter() - t0
+                    self._last_ok = time.time()
+                    return rcvd
+
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError) as err:
+                    self.close()
+                    self._last_error = f"{type(err).__name__}: {err}"
+                    if isinstance(err, asyncio.TimeoutError):
+                        metrics.TIMEOUTS.inc(session=self._label)
+                    if attempt or isinstance(err, asyncio.TimeoutError):
+                        self._failures += 1
+                        raise
+                    metrics.RETRIES.inc(session=self._label)
+                    self._logger.warning(f"Connection to {self._sockaddr} lost ({err}), reconnecting.")
+
+
+_sessions = {}
+_async_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host: str, port: int, timeout=5) -> TCPSession:
+    """
+    Return the session for (host, port), creating it if necessary.
+
+    :param host: IP address or host name of instrument
+    :param port: TCP port of instrument
+    :param timeout: seconds, only used when the session is created
+    :return: shared session
+    """
+    with _sessions_lock:
+        key = (host, port)
+        if key not in _sessions:
+            _sessions[key] = TCPSession(host, port, timeout)
+        return _sessions[key]
+
+
+def get_async_session(host: str, port: int, timeout=5) -> AsyncTCPSession:
+    """
+    Return the asyncio session for (host, port), creating it if necessary.
+
+    :param host: IP address or host name of instrument
+    :param port: TCP port of instrument
+    :param timeout: seconds, only used when the session is created
+    :return: shared session
+    """
+    with _sessions_lock:
+        key = (host, port)
+        if key not in _async_sessions:
+            _async_sessions[key] = AsyncTCPSession(host, port, timeout)
+        return _async_sessions[key]
+
+
+def close_all() -> None:
+    """
+    Close all pooled sessions.
+    """
+    with _sessions_lock:
+        for session in list(_sessions.values()) + list(_async_sessions.values()):
+            session.close()
+        _sessions.clear()
+        _async_sessions.clear()
+
+
+if __name__ == "__main__":
+    pass
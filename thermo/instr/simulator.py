@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Simulate Thermo TEI49C and TEI49i instruments on a local TCP port and on a pseudo-terminal (pty).
+
+The simulator speaks the command protocol used by the drivers: an optional id byte (id + 128), the command and a
+terminating CR. Responses echo the command, followed by the answer, a checksum after '*' and a terminating CR.
+
+Usage:
+    python -m thermo.instr.simulator --type 49i --tcp 9880
+    python -m thermo.instr.simulator --type 49c --pty --latency 0.05 --error-rate 0.01
+
+@author: joerg.klausen@meteoswiss.ch
+"""
+
+import argparse
+import collections
+import math
+import os
+import random
+import re
+import socketserver
+import threading
+import time
+import tty
+
+
+class InstrumentSimulator:
+    """
+    State and command interpreter of one simulated instrument.
+    """
+
+    # configuration keys understood by 'set <key> <value>' and '<key>', longest first
+    SETTINGS = {
+        '49c': {'lrec format': '00 02', 'lrec per': '1', 'gas unit': 'ppb', 'temp comp': 'on', 'pres comp': 'on',
+                'avg time': '3', 'o3 coef': '1.000', 'o3 bkg': '0.0', 'format': '00', 'range': '1', 'mode': 'remote',
+                'save params': 'ok', 'o3 conc': '0'},
+        '49i': {'lrec format': '0', 'lrec per': '1', 'gas unit': 'ppb', 'temp comp': 'on', 'pres comp': 'on',
+                'avg time': '3', 'o3 coef': '1.000', 'o3 bkg': '0.0', 'format': '00', 'range': '1', 'mode': 'remote',
+                'save params': 'ok', 'o3 conc': '0'},
+    }
+
+    _LREC = re.compile(r"^(lrec|srec) (\d+) (\d+)$")
+
+    def __init__(self, kind='49i', buffer_size=1792, period=1, latency=0.0, jitter=0.0, error_rate=0.0,
+                 max_chunk=100, seed=None) -> None:
+        """
+        Initialize simulator with a full record buffer.
+
+        :param kind: '49c' or '49i'
+        :param buffer_size: number of records the logger holds
+        :param period: minutes between logged records
+        :param latency: seconds before a response is sent
+        :param jitter: seconds, latency varies uniformly by +/- jitter
+        :param error_rate: probability that a command is not answered at all
+        :param max_chunk: maximum number of records returned by a single 'lrec N M'
+        :param seed: seed of the random number generator, for reproducible runs
+        """
+        if kind not in self.SETTINGS:
+            raise ValueError(f"kind must be one of {list(self.SETTINGS)}")
+        self.kind = kind
+        self.period = period
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_chunk = max_chunk
+        self.settings = dict(self.SETTINGS[kind])
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._buffer = collections.deque(maxlen=buffer_size)
+
+        # fill the logger with records up to now
+        now = time.time() // (period * 60) * (period * 60)
+        for i in range(buffer_size, 0, -1):
+            self._buffer.append(self._record(now - (i - 1) * period * 60))
+        self._last = now
+
+    def _o3(self, t: float) -> float:
+        level = float(self.settings['o3 conc'].split()[0])
+        if level > 0:
+            return level + self._random.gauss(0, 0.3)
+        # diurnal cycle of ambient ozone
+        return 40 + 15 * math.sin(2 * math.pi * (t % 86400) / 86400) + self._random.gauss(0, 0.5)
+
+    def _record(self, t: float) -> dict:
+        return {'t': t, 'o3': self._o3(t), 'flags': 0x1c000000 if self.kind == '49c' else 0x0C100400,
+                'cellai': self._random.randint(90000, 99000), 'cellbi': self._random.randint(60000, 69000),
+                'bncht': 28.1, 'lmpt': 55.6, 'o3lt': 99.9, 'flowa': 0.538, 'flowb': 0.579,
+                'pres': round(492 + self._random.gauss(0, 0.3), 1)}
+
+    def _advance(self) -> None:
+        # log the records that became due since the last call
+        step = self.period * 60
+        while self._last + step <= time.time():
+            self._last += step
+            self._buffer.append(self._record(self._last))
+
+    def format_record(self, rec: dict) -> str:
+        tm = time.localtime(rec['t'])
+        if self.kind == '49c':
+            # ozone as mantissa and exponent, e.g. 5281E-2
+            return (f"{time.strftime('%H:%M %m-%d', tm)} {round(rec['o3'] * 100):d}E-2 {rec['flags']:08x} "
+                    f"{rec['cellai']} {rec['cellbi']} {rec['bncht']:.1f} {rec['lmpt']:.1f} {rec['o3lt']:.1f} "
+                    f"{rec['flowa']:.3f} {rec['flowb']:.3f} {rec['pres']:.1f}")
+        values = [('flags', f"{rec['flags']:08X}"), ('o3', f"{rec['o3']:.3f}"), ('hio3', "0.000"),
+                  ('cellai', rec['cellai']), ('cellbi', rec['cellbi']), ('bncht', f"{rec['bncht']:.1f}"),
+                  ('lmpt', f"{rec['lmpt']:.1f}"), ('o3lt', f"{rec['o3lt']:.1f}"), ('flowa', f"{rec['flowa']:.3f}"),
+                  ('flowb', f"{rec['flowb']:.3f}"), ('pres', f"{rec['pres']:.1f}")]
+        if self.settings['lrec format'].strip() == '1':
+            body = " ".join(f"{key} {value}" for key, value in values)
+        else:
+            body = " ".join(str(value) for _, value in values)
+        return f"{time.strftime('%H:%M %m-%d-%y', tm)} {body}"
+
+    def answer(self, cmd: str) -> str:
+        """
+        Interpret a command.
+
+        :param cmd: command without id byte and terminator
+        :return: answer without echo, checksum and terminator
+        """
+        cmd = cmd.strip().lower()
+        with self._lock:
+            self._advance()
+
+            match = self._LREC.match(cmd)
+            if match:
+                index, count = int(match.group(2)), min(int(match.group(3)), self.max_chunk)
+                if index < 1 or index > len(self._buffer):
+                    return "bad cmd"
+                start = len(self._buffer) - index
+                records = list(self._buffer)[start:start + count]
+                return "\n".join(self.format_record(rec) for rec in records)
+
+            if cmd in ('lrec', 'lr00', 'srec', 'sr00'):
+                return self.format_record(self._record(time.time()))
+            if cmd in ('no of lrec', 'no of srec'):
+                return f"{cmd} {len(self._buffer)} rec"
+            if cmd == 'o3':
+                return f"o3 {self._o3(time.time()):.1f} ppb"
+            if cmd == 'o3 setting':
+                return f"o3 setting {self.settings['o3 conc']}"
+            if cmd == 'date':
+                return f"date {time.strftime('%m-%d-%y')}"
+            if cmd == 'time':
+                return f"time {time.strftime('%H:%M:%S')}"
+
+            if cmd.startswith('set '):
+                for key in sorted(self.settings, key=len, reverse=True):
+                    if cmd == f"set {key}" or cmd.startswith(f"set {key} "):
+                        value = cmd[len(f"set {key}"):].strip()
+                        if value:
+                            self.settings[key] = value
+                        return f"{cmd} ok"
+                if cmd.startswith('set date ') or cmd.startswith('set time '):
+                    return f"{cmd} ok"
+                return "bad cmd"
+
+            if cmd in self.settings:
+                return f"{cmd} {self.settings[cmd]}"
+
+            return "bad cmd"
+
+    def respond(self, request: bytes) -> bytes:
+        """
+        Produce the raw response to a raw request, applying latency, jitter and errors.
+
+        :param request: raw request, optionally starting with the id byte, without terminator
+        :return: raw response, or None if the simulated instrument does not answer
+        """
+        if request and request[0] >= 128:
+            request = request[1:]
+        cmd = request.decode(errors='replace')
+
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self._random.random() < self.error_rate:
+            return None
+
+        body = f"{cmd}\n{self.answer(cmd)}"
+        checksum = sum(body.encode()) & 0xFFFF
+        return f"{body}*{checksum:04X}\r".encode()
+
+
+class _TCPHandler(socketserver.BaseRequestHandler):
+
+    def handle(self) -> None:
+        buffer = b''
+        while True:
+            data = self.request.recv(1024)
+            if not data:
+                break
+            buffer += data
+            while b'\x0D' in buffer:
+                request, buffer = buffer.split(b'\x0D', 1)
+                response = self.server.simulator.respond(request)
+                if response is not None:
+                    self.request.sendall(response)
+
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    """
+    Serve a simulated instrument on a TCP port, one thread per connection.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, simulator: InstrumentSimulator, host='127.0.0.1', port=9880) -> None:
+        self.simulator = simulator
+        super().__init__((host, port), _TCPHandler)
+
+    def start(self) -> threading.Thread:
+        """
+        Serve in a background thread.
+
+        :return: server thread
+        """
+        thread = threading.Thread(target=self.serve_forever, name="simulator-tcp", daemon=True)
+        thread.start()
+        return thread
+
+
+class PTYServer:
+    """
+    Serve a simulated instrument on a pseudo-terminal, which drivers open like a serial port.
+    """
+
+    def __init__(self, simulator: InstrumentSimulator) -> None:
+        self.simulator = simulator
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = False
+
+    def serve_forever(self) -> None:
+        self._running = True
+        buffer = b''
+        while self._running:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                break
+            buffer += data
+            while b'\x0D' in buffer:
+                request, buffer = buffer.split(b'\x0D', 1)
+                response = self.simulator.respond(request)
+                if response is not None:
+                    os.write(self._master, response)
+
+    def start(self) -> threading.Thread:
+        """
+        Serve in a background thread.
+
+        :return: server thread
+        """
+        thread = threading.Thread(target=self.serve_forever, name="simulator-pty", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self) -> None:
+        self._running = False
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate a Thermo TEI49C or TEI49i instrument.")
+    parser.add_argument('--type', choices=['49c', '49i'], default='49i', help="instrument type")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--tcp', type=int, metavar='PORT', help="serve on this TCP port")
+    parser.add_argument('--pty', action='store_true', help="serve on a pseudo-terminal")
+    parser.add_argument('--latency', type=float, default=0.0, help="response latency [s]")
+    parser.add_argument('--jitter', type=float, default=0.0, help="latency jitter [s]")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="probability of not answering")
+    parser.add_argument('--buffer-size', type=int, default=1792, help="number of records in logger")
+    parser.add_argument('--period', type=float, default=1, help="minutes between logged records")
+    parser.add_argument('--max-chunk', type=int, default=100, help="max. records returned per lrec command")
+    args = parser.parse_args()
+
+    if args.tcp is None and not args.pty:
+        parser.error("specify --tcp PORT and/or --pty")
+
+    simulator = InstrumentSimulator(kind=args.type, buffer_size=args.buffer_size, period=args.period,
+                                    latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                    max_chunk=args.max_chunk)
+    if args.tcp is not None:
+        server = TCPServer(simulator, host=args.host, port=args.tcp)
+        server.start()
+        print(f"# Simulating TEI{args.type.upper()} on tcp://{args.host}:{args.tcp}")
+    if args.pty:
+        pty = PTYServer(simulator)
+        pty.start()
+        print(f"# Simulating TEI{args.type.upper()} on {pty.port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,23 @@ Class TEI49C facilitating communication with a Thermo TEI49c instrument.
 """
 
 # from datetime import datetime
+import asyncio
 import os
-import thermo.common.datetimebin as datetimebin
-import logging
-import colorama
-import serial
 import time
 
+import colorama
+
+import thermo.common.breaker as breaker
+import thermo.common.bulkdownload as bulkdownload
+import thermo.common.calibration as calibration
+import thermo.common.datawriter as datawriter
+import thermo.common.logwriter as logwriter
+import thermo.common.lrec as lrec
+import thermo.common.metrics as metrics
+import thermo.common.parquetstore as parquetstore
+import thermo.common.ringbuffer as ringbuffer
+import thermo.common.serialbus as serialbus
+import thermo.common.staging as staging
 
 
 class TEI49C:
@@ -24,6 +34,7 @@ class TEI49C:
     _datafile = None
     # _file_to_stage = None
     _data_header = None
+    _fields = None
     _get_config = None
     _get_data = None
     _id = None
@@ -31,10 +42,15 @@ class TEI49C:
     _log = False
     _logger = None
     __name = None
+    _breaker = None
+    _buffer = None
+    _comparison = None
+    _bus = None
     _reporting_interval = None
-    _serial = None
     _set_config = None
-    # _staging = None
+    _store = None
+    _writer = None
+    _staging = None
     _zip = False
 
     def __init__(self, name: str, config: dict) -> None:
@@ -50,9 +66,20 @@ class TEI49C:
             - config[port]['parity']
             - config[port]['stopbits']
             - config[port]['timeout']
+            - config[port]['deadline'], optional, seconds to wait for a complete response (default 2)
             - config[name]['data_header']
             - config[name]['type']
             - config[name]['serial_number']
+            - config[name]['reporting_interval']
+            - config[name]['flush_every'], optional, number of records buffered before writing to disk (default 1)
+            - config[name]['fsync'], optional, commit every write to disk (default False)
+            - config['staging'], optional, see staging.get_pipeline
+            - config[name]['staging_zip'], optional, compress staged files (default False)
+            - config['parquet'], optional, see parquetstore.get_store
+            - config[name]['buffer_hours'], optional, hours of samples kept in memory (default 24)
+            - config['calibrator'], config['analyzers'], see calibration.get_comparison
+            - config['logs']
+            - config['console'], optional, level of log messages also shown on the console, see logwriter.setup
         :param simulate: default=True, simulate instrument behavior. Assumes a serial loopback connector.
         """
         print(f"# Initialize {name}")
@@ -64,16 +91,12 @@ class TEI49C:
             self._type = config[name]['type']
             self._serial_number = config[name]['serial_number']
 
-            # serial communication settings
+            # serial communication settings. The port is kept open and shared by all instruments connected to it.
             port = config[name]['port']
-            self._serial = serial.Serial(port=port,
-                                        baudrate=config[port]['baudrate'],
-                                        bytesize=config[port]['bytesize'],
-                                        parity=config[port]['parity'],
-                                        stopbits=config[port]['stopbits'],
-                                        timeout=config[port]['timeout'])
-            if self._serial.is_open:
-                self._serial.close()
+            self._bus = serialbus.get_bus(port, config[port])
+
+            # commands fail fast while the instrument does not respond
+            self._breaker = breaker.get_breaker(name, config[name].get('breaker'))
 
             # instrument configuration
             self._get_config = config[name]['get_config']
@@ -90,8 +113,34 @@ class TEI49C:
             # setup data directory and staging area
             self._datadir = os.path.join(os.path.expanduser(config['data']), name)
             os.makedirs(self._datadir, exist_ok=True)
-            # self._staging = os.path.expanduser(config['staging']['path'])
-            # self._zip = config[name]['staging_zip']
+
+            # staging area for files to be transfered. Completed files are staged in the background.
+            on_rotate = None
+            if config.get('staging'):
+                self._staging = staging.get_pipeline(config['staging'])
+                self._zip = config[name].get('staging_zip', False)
+                self._staging.watch(self._datadir, compress=self._zip)
+                on_rotate = lambda path: self._staging.submit(path, compress=self._zip)
+
+            self._writer = datawriter.get_writer(datadir=self._datadir, name=name, header=self._data_header,
+                                                 reporting_interval=self._reporting_interval,
+                                                 flush_every=config[name].get('flush_every', 1),
+                                                 fsync=config[name].get('fsync', False),
+                                                 on_rotate=on_rotate)
+
+            # recent samples in memory, for displays and checks
+            self._fields = lrec.fields_from_header(self._data_header)
+            self._buffer = ringbuffer.get_buffer(name, capacity=int(config[name].get('buffer_hours', 24) * 60
+                                                                     / self._sampling_interval))
+
+            # running statistics of the comparison, if the instrument takes part in it
+            if config.get('calibrator') and (name == config['calibrator']['name']
+                                             or name in (config.get('analyzers') or [])):
+                self._comparison = calibration.get_comparison(config)
+
+            # optional columnar store of parsed records
+            if config.get('parquet'):
+                self._store = parquetstore.get_store(config['parquet'])
 
             # calibrator ozone set points (levels)
             self._levels = iter(config["calibrator"]["levels"])
@@ -99,15 +148,8 @@ class TEI49C:
             # setup logging
             if config['logs']:
                 self._log = True
-                logs = os.path.expanduser(config['logs'])
-                os.makedirs(logs, exist_ok=True)
-                logfile = f"{time.strftime('%Y%m%d')}.log"
-                self._logger = logging.getLogger(__name__)
-                logging.basicConfig(level=logging.DEBUG,
-                                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                                    datefmt='%y-%m-%d %H:%M:%S',
-                                    filename=str(os.path.join(logs, logfile)),
-                                    filemode='a')
+                logwriter.setup(config['logs'], console=config.get('console'))
+                self._logger = logwriter.get_logger(__name__, instrument=name)
 
             # # query instrument to see if communication is possible, set date and time
             # if not self._simulate:
@@ -135,43 +177,95 @@ class TEI49C:
             print(err)
 
 
-    def serial_comm(self, cmd: str, tidy=True) -> str:
+    def serial_comm(self, cmd: str, tidy=True, priority=serialbus.PRIORITY_CONFIG, probe=False) -> str:
         """
-        Send a command and retrieve the response. Opens and closes the connection.
+        Send a command and retrieve the response up to the terminating CR. The request is queued on the bus owning
+        the port, which keeps the port open and reopens it after errors.
 
         :param cmd: command sent to instrument
         :param tidy: remove echo and checksum after '*'
+        :param priority: serialbus.PRIORITY_POLL, PRIORITY_CONFIG or PRIORITY_BULK
+        :param probe: Is a missing response expected, e.g. when probing chunk sizes? It then does not count as a
+                      failure of the instrument, see breaker.CircuitBreaker.failure
         :return: response of instrument, decoded
         """
         _id = bytes([self._id])
         rcvd = b''
+        if not self._breaker.allow():
+            return None
         try:
-            if not self._serial.is_open:
-                self._serial.open()
-            self._serial.write(_id + (f"{cmd}\x0D").encode())
-            time.sleep(0.5)
-            while self._serial.in_waiting > 0:
-                rcvd = rcvd + self._serial.read(1024)
-                time.sleep(0.1)
-            self._serial.close()
-
-            rcvd = rcvd.decode()
-            if tidy:
-                # - remove checksum after and including the '*'
-                rcvd = rcvd.split("*")[0]
-                # - remove echo before and including '\n'
-                if cmd.join("\n") in rcvd:
-                    rcvd = rcvd.replace(cmd, "")
-                # remove leading or trailing '\r\n'
-                rcvd = rcvd.strip()
-            return rcvd
+            start = time.perf_counter()
+            rcvd = self._bus.query(_id + (f"{cmd}\x0D").encode(), priority)
+            self._breaker.success()
+            duration = time.perf_counter() - start
+            metrics.COMMAND_LATENCY.observe(duration, instrument=self.__name, command=metrics.command(cmd))
+            if self._log:
+                self._logger.debug(cmd, extra={'command': cmd, 'duration': duration})
+
+            return self._tidy(cmd, rcvd, tidy)
 
         except Exception as err:
+            self._breaker.failure(expected=probe)
+            metrics.COMMAND_ERRORS.inc(instrument=self.__name, command=metrics.command(cmd))
             if self._log:
-                self._logger.error(err)
+                self._logger.error(err, extra={'command': cmd})
+            print(err)
+
+
+    async def aserial_comm(self, cmd: str, tidy=True, priority=serialbus.PRIORITY_CONFIG) -> str:
+        """
+        Like serial_comm, but without blocking the event loop.
+
+        :param cmd: command sent to instrument
+        :param tidy: remove echo and checksum after '*'
+        :param priority: serialbus.PRIORITY_POLL, PRIORITY_CONFIG or PRIORITY_BULK
+        :return: response of instrument, decoded
+        """
+        if not self._breaker.allow():
+            return None
+        try:
+            start = time.perf_counter()
+            future = self._bus.submit(bytes([self._id]) + (f"{cmd}\x0D").encode(), priority)
+            rcvd = await asyncio.wrap_future(future)
+            self._breaker.success()
+            duration = time.perf_counter() - start
+            metrics.COMMAND_LATENCY.observe(duration, instrument=self.__name, command=metrics.command(cmd))
+            if self._log:
+                self._logger.debug(cmd, extra={'command': cmd, 'duration': duration})
+
+            return self._tidy(cmd, rcvd, tidy)
+
+        except Exception as err:
+            self._breaker.failure()
+            metrics.COMMAND_ERRORS.inc(instrument=self.__name, command=metrics.command(cmd))
+            if self._log:
+                self._logger.error(err, extra={'command': cmd})
             print(err)
 
 
+    @staticmethod
+    def _tidy(cmd: str, rcvd: bytes, tidy=True) -> str:
+        rcvd = rcvd.decode()
+        if tidy:
+            # - remove checksum after and including the '*'
+            rcvd = rcvd.split("*")[0]
+            # - remove echo before and including '\n'
+            if cmd.join("\n") in rcvd:
+                rcvd = rcvd.replace(cmd, "")
+            # remove leading or trailing '\r\n'
+            rcvd = rcvd.strip()
+        return rcvd
+
+
+    def connection_health(self) -> dict:
+        """
+        Report state and counters of the serial connection to the instrument.
+
+        :return: see serialbus.SerialBus.health
+        """
+        return self._bus.health()
+
+
     def get_config(self) -> list:
         """
         Read current configuration of instrument and optionally write to log.
@@ -206,13 +300,11 @@ class TEI49C:
             dte = self.serial_comm(f"set date {time.strftime('%m-%d-%y')}")
             dte = self.serial_comm("date")
             msg = f"Date of instrument {self.__name} set and reported as: {dte}"
-            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {msg}")
             self._logger.info(msg)
 
             tme = self.serial_comm(f"set time {time.strftime('%H:%M')}")
             tme = self.serial_comm("time")
             msg = f"Time of instrument {self.__name} set and reported as: {tme}"
-            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {msg}")
             self._logger.info(msg)
 
         except Exception as err:
@@ -245,38 +337,59 @@ class TEI49C:
             print(err)
 
     
-    def get_data(self, cmd=None, save=True) -> str:
+    def get_data(self, cmd=None, save=True, dtm=None) -> str:
         """
         Send a command and retrieve response. Command defaults to None, in which case it is taken from the config file.
 
         :param str cmd: command sent to instrument
         :param bln save: Should data be saved to file? default=True
+        :param str dtm: timestamp of sample ('%Y-%m-%d %H:%M:%S'), defaults to now
         :return str response as decoded string
         """
         try:
-            dtm = time.strftime('%Y-%m-%d %H:%M:%S')
-            print(f"{dtm} .get_data (name={self.__name}, save={save})")
+            if dtm is None:
+                dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            if self._log:
+                self._logger.info(f".get_data (name={self.__name}, save={save}, dtm={dtm})")
 
             if cmd is None:
                 cmd = self._get_data
-            data = self.serial_comm(cmd)
+            data = self.serial_comm(cmd, priority=serialbus.PRIORITY_POLL)
 
-            if save:
-                # generate the datafile name
-                self._datafile = os.path.join(self._datadir,
-                                             "".join([self.__name, "-",
-                                                      datetimebin.dtbin(self._reporting_interval), ".dat"]))
-
-                if not os.path.exists(self._datafile):
-                    # if file doesn't exist, create and write header
-                    with open(self._datafile, "at", encoding='utf8') as fh:
-                        fh.write(f"{self._data_header}\n")
-                        fh.close()
-
-                with open(self._datafile, "at", encoding='utf8') as fh:
-                    # add data to file
-                    fh.write(f"{dtm} {data}\n")
-                    fh.close()
+            # nothing received, e.g. while the circuit breaker is open
+            if save and data is not None:
+                self._save_data(dtm, data)
+
+            return data
+
+        except Exception as err:
+            if self._log:
+                self._logger.error(err)
+            print(err)
+
+
+    async def aget_data(self, cmd=None, save=True, dtm=None) -> str:
+        """
+        Like get_data, but without blocking the event loop.
+
+        :param str cmd: command sent to instrument
+        :param bln save: Should data be saved to file? default=True
+        :param str dtm: timestamp of sample ('%Y-%m-%d %H:%M:%S'), defaults to now
+        :return str response as decoded string
+        """
+        try:
+            if dtm is None:
+                dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            if self._log:
+                self._logger.info(f".get_data (name={self.__name}, save={save}, dtm={dtm})")
+
+            if cmd is None:
+                cmd = self._get_data
+            data = await self.aserial_comm(cmd, priority=serialbus.PRIORITY_POLL)
+
+            # nothing received, e.g. while the circuit breaker is open
+            if save and data is not None:
+                self._save_data(dtm, data)
 
             return data
 
@@ -285,10 +398,39 @@ class TEI49C:
                 self._logger.error(err)
             print(err)
 
+
+    def _save_data(self, dtm: str, data: str) -> None:
+        if data is None:
+            return
+        self._datafile = self._writer.write(f"{dtm} {data}")
+        record = lrec.parse(f"{dtm} {data}", self._fields)
+        if record is not None:
+            self._buffer.append(record)
+            if self._comparison:
+                self._comparison.add(self.__name, (record.pcdtm or record.dtm).timestamp(), record.o3)
+            if self._store:
+                self._store.append(self.__name, record)
+        else:
+            metrics.PARSE_FAILURES.inc(instrument=self.__name)
+
             
+    def latest(self) -> dict:
+        """
+        Last sample of get_data, unless it is older than two sampling intervals.
+
+        :return dict of column name: value, see ringbuffer.RingBuffer.latest, or None
+        """
+        return self._buffer.latest(max_age=120 * self._sampling_interval)
+
+
     def get_o3(self) -> str:
+        """
+        Query ozone from the instrument. For the last sample of get_data, see latest.
+
+        :return str response of the instrument, e.g. 'o3 30.1 ppb'
+        """
         try:
-            o3 = self.serial_comm('O3')
+            o3 = self.serial_comm('O3', priority=serialbus.PRIORITY_POLL)
             return o3
 
         except Exception as err:
@@ -299,8 +441,19 @@ class TEI49C:
             
     def print_o3(self) -> None:
         try:
-            o3 = self.serial_comm('O3').split()
-            print(colorama.Fore.GREEN + f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{self.__name}] {o3[0]} {str(float(o3[1]))} {o3[2]}")
+            sample = self.latest()
+            if sample:
+                dtm = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sample['dtm']))
+                n = max(1, 60 // self._sampling_interval)
+                if self._log:
+                    self._logger.info(f"[{self.__name}] o3 {sample['o3']} ppb at {dtm} (1h mean "
+                                      f"{self._buffer.mean('o3', n):.2f}, std {self._buffer.std('o3', n):.2f})",
+                                      extra={'_color': colorama.Fore.GREEN})
+                return
+            o3 = self.serial_comm('O3', priority=serialbus.PRIORITY_POLL).split()
+            if self._log:
+                self._logger.info(f"[{self.__name}] {o3[0]} {str(float(o3[1]))} {o3[2]}",
+                                  extra={'_color': colorama.Fore.GREEN})
 
         except Exception as err:
             if self._log:
@@ -308,12 +461,15 @@ class TEI49C:
             print(err)
 
 
-    def get_all_rec(self, save=True) -> str:
+    def get_all_rec(self, save=True) -> dict:
         """
         Retrieve all long and short records from instrument and optionally write to file.
 
+        The buffers are read in the largest chunks the instrument accepts. If a previous download was interrupted, it is
+        resumed into the same file.
+
         :param bln save: Should data be saved to file? default=True
-        :return str response as decoded string
+        :return dict statistics of the downloads per record type, see bulkdownload.BulkDownload.run
         """
         try:
             dtm = time.strftime('%Y-%m-%d %H:%M:%S')
@@ -324,43 +480,89 @@ class TEI49C:
 
             print("%s .get_all_rec (name=%s, save=%s)" % (dtm, self.__name, save))
 
+            # records from the logger carry no pc timestamp
+            header = self._data_header.replace("pcdate pctime ", "")
+
             # retrieve data from instrument in chunks
+            stats = {}
             for i in [0, 1]:
-                index = CAPACITY[i]
-                retrieve = 10
+                datafile = None
                 if save:
-                    # generate the datafile name
-                    datafile = os.path.join(self._datadir,
-                                            "".join([self.__name, f"_all_{CMD[i]}-",
-                                                    time.strftime("%Y%m%d%H%M00"), ".dat"]))
-
-                while index > 0:
-                    if index < 10:
-                        retrieve = index
-                    cmd = f"{CMD[i]} {str(index)} {str(retrieve)}"
-                    print(cmd)
-                    data = self.serial_comm(cmd)
-
-                    if save:
-                        if not os.path.exists(datafile):
-                            # if file doesn't exist, create and write header
-                            with open(datafile, "at") as fh:
-                                fh.write(f"{self._data_header}\n")
-                                fh.close()
-                        with open(datafile, "at") as fh:
-                            # add data to file
-                            fh.write(f"{data}\n")
-                            fh.close()
-
-                    index = index - 10
-                    
-            return 0
+                    # continue an interrupted download, or generate a new datafile name
+                    datafile = bulkdownload.BulkDownload.pending(os.path.join(self._datadir,
+                                                                              f"{self.__name}_all_{CMD[i]}-*.dat"))
+                    if datafile is None:
+                        datafile = os.path.join(self._datadir,
+                                                "".join([self.__name, f"_all_{CMD[i]}-",
+                                                         time.strftime("%Y%m%d%H%M00"), ".dat"]))
+
+                download = bulkdownload.BulkDownload(
+                    comm=lambda cmd: self.serial_comm(cmd, priority=serialbus.PRIORITY_BULK),
+                    probe=lambda cmd: self.serial_comm(cmd, priority=serialbus.PRIORITY_BULK, probe=True),
+                    datafile=datafile,
+                    header=header,
+                    cmd=CMD[i],
+                    period=self._sampling_interval)
+                stats[CMD[i]] = download.run(available=download.available() or CAPACITY[i])
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} .get_all_rec (name={self.__name}) {CMD[i]}: "
+                      f"{stats[CMD[i]]['records']} records in {stats[CMD[i]]['seconds']:.1f} s "
+                      f"({stats[CMD[i]]['records_per_second']:.1f}/s)")
+
+                if save and self._staging:
+                    # stage data for transfer, in the background
+                    self._staging.submit(datafile, compress=self._zip)
+
+            return stats
 
         except Exception as err:
             if self._log:
                 self._logger.error(err)
             print(err)
 
+
+    def sync_lrec(self, save=True) -> dict:
+        """
+        Download the lrec records that are newer than the newest record stored for this instrument.
+
+        Falls back to get_all_rec if nothing has been stored yet.
+
+        :param bln save: Should data be saved to file? default=True
+        :return dict statistics of the download, see bulkdownload.BulkDownload.run
+        """
+        try:
+            dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            since = bulkdownload.newest_record(os.path.join(self._datadir, f"{self.__name}*.dat"))
+            print(f"{dtm} .sync_lrec (name={self.__name}, save={save}, since={since})")
+            if since is None:
+                return self.get_all_rec(save=save)['lrec']
+
+            datafile = None
+            if save:
+                datafile = os.path.join(self._datadir,
+                                        "".join([self.__name, "_sync_lrec-", time.strftime("%Y%m%d%H%M00"), ".dat"]))
+
+            download = bulkdownload.BulkDownload(
+                comm=lambda cmd: self.serial_comm(cmd, priority=serialbus.PRIORITY_BULK),
+                probe=lambda cmd: self.serial_comm(cmd, priority=serialbus.PRIORITY_BULK, probe=True),
+                datafile=datafile,
+                header=self._data_header.replace("pcdate pctime ", ""),
+                cmd="lrec",
+                period=self._sampling_interval)
+            stats = download.sync(since)
+            if save and self._staging and os.path.exists(datafile):
+                # stage data for transfer, in the background
+                self._staging.submit(datafile, compress=self._zip)
+            if self._log:
+                self._logger.info(f"Synchronized {stats['records']} lrec of '{self.__name}' newer than {since}")
+
+            return stats
+
+        except Exception as err:
+            if self._log:
+                self._logger.error(err)
+            print(err)
+
+
     def get_o3_setting(self) -> str:
         try:
             res = self.serial_comm("o3 setting")
@@ -376,14 +578,25 @@ class TEI49C:
 
 
     def set_o3_conc(self) -> str:
+        """
+        Set the next level of calibrator.levels. After the last level, the results of the comparison are reported.
+
+        :return str response of instrument, None after the last level
+        """
         try:
             dtm = time.strftime('%Y-%m-%d %H:%M:%S')
 
-            level = next(self._levels)
-            res = self.serial_comm(f"set o3 conc {level}")
-            print(f"{dtm} .set_o3_conc {level} ppb (name={self.__name})")
+            level = next(self._levels, None)
+            if level is None:
+                if self._comparison:
+                    self._comparison.finish()
+                return None
+            res = self.serial_comm(f"set o3 conc {level}", priority=serialbus.PRIORITY_POLL)
             if self._log:
+                self._logger.info(f".set_o3_conc {level} ppb (name={self.__name})")
                 self._logger.info(res)
+            if self._comparison:
+                self._comparison.set_level(level)
  
             return res
 
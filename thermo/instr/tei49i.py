@@ -5,17 +5,22 @@ Define a class TEI49I facilitating communication with a Thermo TEI49i instrument
 @author: joerg.klausen@meteoswiss.ch
 """
 
-import logging
 import os
-import shutil
-import socket
-import re
 import time
-import zipfile
 
 import colorama
 
-import thermo.common.datetimebin as datetimebin
+import thermo.common.breaker as breaker
+import thermo.common.bulkdownload as bulkdownload
+import thermo.common.calibration as calibration
+import thermo.common.datawriter as datawriter
+import thermo.common.logwriter as logwriter
+import thermo.common.lrec as lrec
+import thermo.common.metrics as metrics
+import thermo.common.parquetstore as parquetstore
+import thermo.common.ringbuffer as ringbuffer
+import thermo.common.staging as staging
+import thermo.common.tcpsession as tcpsession
 
 
 class TEI49I:
@@ -26,19 +31,24 @@ class TEI49I:
     _datadir = None
     __datafile = ""
     __data_header = None
+    _fields = None
     __get_config = None
     _get_data = None
     __id = None
     _log = None
     _logger = None
     __name = None
+    _async_session = None
+    _breaker = None
+    _buffer = None
+    _comparison = None
     _reporting_interval = None
+    _session = None
     __set_config = None
     _simulate = None
-    __sockaddr = None
-    __socksleep = None
-    __socktout = None
-    # _staging = None
+    _staging = None
+    _store = None
+    _writer = None
     _zip = False
 
     def __init__(self, name: str, config: dict, simulate=False) -> None:
@@ -53,15 +63,21 @@ class TEI49I:
             - config[name]['socket']['host']
             - config[name]['socket']['port']
             - config[name]['socket']['timeout']
-            - config[name]['socket']['sleep']
             - config[name]['get_config']
             - config[name]['set_config']
             - config[name]['get_data']
             - config[name]['data_header']
             - config['logs']
+            - config['console'], optional, level of log messages also shown on the console, see logwriter.setup
             - config[name]['sampling_interval']
-            - config['staging']['path'])
-            - config[name]['staging_zip']
+            - config[name]['reporting_interval']
+            - config[name]['flush_every'], optional, number of records buffered before writing to disk (default 1)
+            - config[name]['fsync'], optional, commit every write to disk (default False)
+            - config['staging'], optional, see staging.get_pipeline
+            - config[name]['staging_zip'], optional, compress staged files (default False)
+            - config['parquet'], optional, see parquetstore.get_store
+            - config[name]['buffer_hours'], optional, hours of samples kept in memory (default 24)
+            - config['calibrator'], config['analyzers'], see calibration.get_comparison
         :param simulate: default=True, simulate instrument behavior. Assumes a serial loopback connector.
         """
         colorama.init(autoreset=True)
@@ -72,15 +88,8 @@ class TEI49I:
             # setup logging
             if config['logs']:
                 self._log = True
-                logs = os.path.expanduser(config['logs'])
-                os.makedirs(logs, exist_ok=True)
-                logfile = f"{time.strftime('%Y%m%d')}.log"
-                self._logger = logging.getLogger(__name__)
-                logging.basicConfig(level=logging.DEBUG,
-                                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                                    datefmt='%y-%m-%d %H:%M:%S',
-                                    filename=str(os.path.join(logs, logfile)),
-                                    filemode='a')
+                logwriter.setup(config['logs'], console=config.get('console'))
+                self._logger = logwriter.get_logger(__name__, instrument=name)
 
             # read instrument control properties for later use
             self.__name = name
@@ -92,11 +101,16 @@ class TEI49I:
             self._get_data = config[name]['get_data']
             self.__data_header = config[name]['data_header']
 
-            # configure tcp/ip
-            self.__sockaddr = (config[name]['socket']['host'],
-                             config[name]['socket']['port'])
-            self.__socktout = config[name]['socket']['timeout']
-            self.__socksleep = config[name]['socket']['sleep']
+            # configure tcp/ip, the connection is kept open and shared per (host, port)
+            self._session = tcpsession.get_session(host=config[name]['socket']['host'],
+                                                   port=config[name]['socket']['port'],
+                                                   timeout=config[name]['socket']['timeout'])
+            self._async_session = tcpsession.get_async_session(host=config[name]['socket']['host'],
+                                                               port=config[name]['socket']['port'],
+                                                               timeout=config[name]['socket']['timeout'])
+
+            # commands fail fast while the instrument does not respond, rather than waiting for the timeout
+            self._breaker = breaker.get_breaker(name, config[name].get('breaker'))
 
             # sampling, aggregation, reporting/storage
             self._sampling_interval = config[name]['sampling_interval']
@@ -107,9 +121,33 @@ class TEI49I:
             self._datadir = os.path.join(datadir, name)
             os.makedirs(self._datadir, exist_ok=True)
 
-            # staging area for files to be transfered
-            # self._staging = os.path.expanduser(config['staging']['path'])
-            # self._zip = config[name]['staging_zip']
+            # staging area for files to be transfered. Completed files are staged in the background.
+            on_rotate = None
+            if config.get('staging'):
+                self._staging = staging.get_pipeline(config['staging'])
+                self._zip = config[name].get('staging_zip', False)
+                self._staging.watch(self._datadir, compress=self._zip)
+                on_rotate = lambda path: self._staging.submit(path, compress=self._zip)
+
+            self._writer = datawriter.get_writer(datadir=self._datadir, name=name, header=self.__data_header,
+                                                 reporting_interval=self._reporting_interval,
+                                                 flush_every=config[name].get('flush_every', 1),
+                                                 fsync=config[name].get('fsync', False),
+                                                 on_rotate=on_rotate)
+
+            # recent samples in memory, for displays and checks
+            self._fields = lrec.fields_from_header(self.__data_header)
+            self._buffer = ringbuffer.get_buffer(name, capacity=int(config[name].get('buffer_hours', 24) * 60
+                                                                     / self._sampling_interval))
+
+            # running statistics of the comparison, if the instrument takes part in it
+            if config.get('calibrator') and (name == config['calibrator']['name']
+                                             or name in (config.get('analyzers') or [])):
+                self._comparison = calibration.get_comparison(config)
+
+            # optional columnar store of parsed records
+            if config.get('parquet'):
+                self._store = parquetstore.get_store(config['parquet'])
 
             # # query instrument to see if communication is possible, set date and time
             # if not self._simulate:
@@ -130,62 +168,103 @@ class TEI49I:
             print(err)
 
 
-    def tcpip_comm(self, cmd: str, tidy=True) -> str:
+    def tcpip_comm(self, cmd: str, tidy=True, probe=False) -> str:
         """
-        Send a command and retrieve the response. Assumes an open connection.
+        Send a command and retrieve the response. Uses the persistent session, which (re)connects as needed.
 
         :param cmd: command sent to instrument
         :param tidy: remove cmd echo, \n and *\r\x00 from result string, terminate with \n
+        :param probe: Is a missing response expected, e.g. when probing chunk sizes? It then does not count as a
+                      failure of the instrument, see breaker.CircuitBreaker.failure
         :return: response of instrument, decoded
         """
         __id = bytes([self.__id])
         rcvd = b''
+        if not self._breaker.allow():
+            return None
         try:
-            # open socket connection as a client
+            start = time.perf_counter()
             if self._simulate:
                 rcvd = self.simulate_get_data(cmd).encode()
             else:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM, ) as s:
-                    # connect to the server
-                    s.settimeout(self.__socktout)
-                    s.connect(self.__sockaddr)
-
-                    if self._simulate:
-                        __id = b''
-
-                    # send data
-                    s.sendall(__id + (f"{cmd}\x0D").encode())
-                    time.sleep(self.__socksleep)
-
-                    # receive response
-                    while True:
-                        data = s.recv(1024)
-                        rcvd = rcvd + data
-                        if b'\x0D' in data:
-                            break
-
-            # decode response, tidy
-            rcvd = rcvd.decode()
-            if tidy:
-                # - remove checksum after and including the '*'
-                rcvd = rcvd.split("*")[0]
-                # - remove echo before and including '\n'
-                rcvd = rcvd.replace(f"{cmd}\n", "")
-                # if "\n" in rcvd:
-                    # rcvd = rcvd.split("\n")[1]
-
-            # TODO: test with local instrument
-            # if rcvd is None:
-            #     rcvd = ""
-
-            return rcvd
+                # send data, receive response up to the terminating '\r'
+                rcvd = self._session.query(__id + (f"{cmd}\x0D").encode())
+            self._breaker.success()
+            duration = time.perf_counter() - start
+            metrics.COMMAND_LATENCY.observe(duration, instrument=self.__name, command=metrics.command(cmd))
+            if self._log:
+                self._logger.debug(cmd, extra={'command': cmd, 'duration': duration})
+
+            return self._tidy(cmd, rcvd, tidy)
 
         except Exception as err:
+            self._breaker.failure(expected=probe)
+            metrics.COMMAND_ERRORS.inc(instrument=self.__name, command=metrics.command(cmd))
             if self._log:
-                self._logger.error(err)
+                self._logger.error(err, extra={'command': cmd})
+            print(err)
+
+
+    async def atcpip_comm(self, cmd: str, tidy=True) -> str:
+        """
+        Send a command and retrieve the response without blocking the event loop.
+
+        :param cmd: command sent to instrument
+        :param tidy: see tcpip_comm
+        :return: response of instrument, decoded
+        """
+        if not self._breaker.allow():
+            return None
+        try:
+            start = time.perf_counter()
+            if self._simulate:
+                rcvd = self.simulate_get_data(cmd).encode()
+            else:
+                rcvd = await self._async_session.query(bytes([self.__id]) + (f"{cmd}\x0D").encode())
+            self._breaker.success()
+            duration = time.perf_counter() - start
+            metrics.COMMAND_LATENCY.observe(duration, instrument=self.__name, command=metrics.command(cmd))
+            if self._log:
+                self._logger.debug(cmd, extra={'command': cmd, 'duration': duration})
+
+            return self._tidy(cmd, rcvd, tidy)
+
+        except Exception as err:
+            self._breaker.failure()
+            metrics.COMMAND_ERRORS.inc(instrument=self.__name, command=metrics.command(cmd))
+            if self._log:
+                self._logger.error(err, extra={'command': cmd})
             print(err)
 
 
+    @staticmethod
+    def _tidy(cmd: str, rcvd: bytes, tidy=True) -> str:
+        # decode response, tidy
+        rcvd = rcvd.decode()
+        if tidy:
+            # - remove checksum after and including the '*'
+            rcvd = rcvd.split("*")[0]
+            # - remove echo before and including '\n'
+            rcvd = rcvd.replace(f"{cmd}\n", "")
+            # if "\n" in rcvd:
+                # rcvd = rcvd.split("\n")[1]
+
+        # TODO: test with local instrument
+        # if rcvd is None:
+        #     rcvd = ""
+
+        return rcvd
+
+
+    def connection_health(self) -> dict:
+        """
+        Report state and counters of the tcp/ip connection to the instrument.
+
+        :return: see tcpsession.TCPSession.health
+        """
+        return self._session.health()
+
+
     def get_config(self) -> list:
         """
         Read current configuration of instrument and optionally write to log.
@@ -219,12 +298,10 @@ class TEI49I:
         try:
             dte = self.tcpip_comm("set date %s" % time.strftime('%m-%d-%y'))
             msg = "Date of instrument %s set to: %s" % (self._name, dte)
-            print("%s %s" % (time.strftime('%Y-%m-%d %H:%M:%S'), msg))
             self._logger.info(msg)
 
             tme = self.tcpip_comm("set time %s" % time.strftime('%H:%M:%S'))
             msg = "Time of instrument %s set to: %s" % (self.__name, tme)
-            print("%s %s" % (time.strftime('%Y-%m-%d %H:%M:%S'), msg))
             self._logger.info(msg)
 
         except Exception as err:
@@ -257,20 +334,21 @@ class TEI49I:
             print(err)
 
 
-    def get_data(self, cmd=None, save=True) -> str:
+    def get_data(self, cmd=None, save=True, dtm=None) -> str:
         """
         Send command retrieve response from instrument and optionally write to log.
 
         :param str cmd: command sent to instrument
         :param bln save: Should data be saved to file? default=True
+        :param str dtm: timestamp of sample ('%Y-%m-%d %H:%M:%S'), defaults to now
         :return str response as decoded string
         """
         try:
-            dtm = time.strftime('%Y-%m-%d %H:%M:%S')
-            if self._simulate:
-                print("%s .get_data (name=%s, save=%s, simulate=%s)" % (dtm, self._name, save, self._simulate))
-            else:
-                print("%s .get_data (name=%s, save=%s)" % (dtm, self.__name, save))
+            if dtm is None:
+                dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            if self._log:
+                self._logger.info(".get_data (name=%s, save=%s, dtm=%s%s)"
+                                  % (self.__name, save, dtm, ", simulate=True" if self._simulate else ""))
 
             if cmd is None:
                 cmd = self._get_data
@@ -280,31 +358,9 @@ class TEI49I:
             # if self._simulate:
             #     data = self.simulate_get_data(cmd)
 
-            if save:
-                # generate the datafile name
-                self.__datafile = os.path.join(self._datadir,
-                                             "".join([self.__name, "-",
-                                                      datetimebin.dtbin(self._reporting_interval), ".dat"]))
-
-                if not os.path.exists(self.__datafile):
-                    # if file doesn't exist, create and write header
-                    with open(self.__datafile, "at", encoding='utf8') as fh:
-                        fh.write(f"{self.__data_header}\n")
-                        fh.close()
-                with open(self.__datafile, "at", encoding='utf8') as fh:
-                    fh.write(f"{dtm} {data}\n")
-                    fh.close()
-
-                # stage data for transfer
-                # root = os.path.join(self._staging, os.path.basename(self._datadir))
-                # os.makedirs(root, exist_ok=True)
-                # if self._zip:
-                #     # create zip file
-                #     archive = os.path.join(root, "".join([os.path.basename(self.__datafile[:-4]), ".zip"]))
-                #     with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fh:
-                #         fh.write(self.__datafile, os.path.basename(self.__datafile))
-                # else:
-                #     shutil.copyfile(self.__datafile, os.path.join(root, os.path.basename(self.__datafile)))
+            # nothing received, e.g. while the circuit breaker is open
+            if save and data is not None:
+                self._save_data(dtm, data)
 
             return data
 
@@ -314,76 +370,139 @@ class TEI49I:
             print(err)
 
 
-    def get_all_lrec(self, save=True) -> str:
-        """download entire buffer from instrument and save to file
+    async def aget_data(self, cmd=None, save=True, dtm=None) -> str:
+        """
+        Like get_data, but without blocking the event loop.
 
+        :param str cmd: command sent to instrument
         :param bln save: Should data be saved to file? default=True
+        :param str dtm: timestamp of sample ('%Y-%m-%d %H:%M:%S'), defaults to now
         :return str response as decoded string
         """
         try:
-            dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            if dtm is None:
+                dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            if self._log:
+                self._logger.info(".get_data (name=%s, save=%s, dtm=%s)" % (self.__name, save, dtm))
+
+            if cmd is None:
+                cmd = self._get_data
+
+            data = await self.atcpip_comm(cmd)
 
-            # retrieve numbers of lrec stored in buffer
-            no_of_lrec = self.tcpip_comm("no of lrec")
-            no_of_lrec = int(re.findall(r"(\d+)", no_of_lrec)[0])
+            # nothing received, e.g. while the circuit breaker is open
+            if save and data is not None:
+                self._save_data(dtm, data)
 
+            return data
+
+        except Exception as err:
+            if self._log:
+                self._logger.error(err)
+            print(err)
+
+
+    def _save_data(self, dtm: str, data: str) -> None:
+        if data is None:
+            return
+        self.__datafile = self._writer.write(f"{dtm} {data}")
+        record = lrec.parse(f"{dtm} {data}", self._fields)
+        if record is not None:
+            self._buffer.append(record)
+            if self._comparison:
+                self._comparison.add(self.__name, (record.pcdtm or record.dtm).timestamp(), record.o3)
+            if self._store:
+                self._store.append(self.__name, record)
+        else:
+            metrics.PARSE_FAILURES.inc(instrument=self.__name)
+
+
+    def get_all_lrec(self, save=True) -> dict:
+        """download entire buffer from instrument and save to file
+
+        The buffer is read in the largest chunks the instrument accepts. If a previous download was interrupted, it is
+        resumed into the same file.
+
+        :param bln save: Should data be saved to file? default=True
+        :return dict statistics of the download, see bulkdownload.BulkDownload.run
+        """
+        try:
+            dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            print(f"{dtm} .get_all_lrec (name={self.__name}, save={save})")
+
+            datafile = None
             if save:
-                # generate the datafile name
-                self.__datafile = os.path.join(self._datadir,
+                # continue an interrupted download, or generate a new datafile name
+                datafile = bulkdownload.BulkDownload.pending(os.path.join(self._datadir,
+                                                                          f"{self.__name}_all_lrec-*.dat"))
+                if datafile is None:
+                    datafile = os.path.join(self._datadir,
                                             "".join([self.__name, "_all_lrec-",
-                                                    time.strftime("%Y%m%d%H%M%S"), ".dat"]))
-
-            # retrieve all lrec records stored in buffer
-            index = no_of_lrec
-            retrieve = 10
-
-            while index > 0:
-                if index < 10:
-                    retrieve = index
-                cmd = f"lrec {str(index)} {str(retrieve)}"
-                print(cmd)
-                data = self.tcpip_comm(cmd)
-
-                # remove all the extra info in the string returned
-                # 05:26 07-19-22 flags 0C100400 o3 30.781 hio3 0.000 cellai 50927 cellbi 51732 bncht 29.9 lmpt 53.1 o3lt 0.0 flowa 0.435 flowb 0.000 pres 493.7
-                data = data.replace("flags ", "")
-                data = data.replace("hio3 ", "")
-                data = data.replace("cellai ", "")
-                data = data.replace("cellbi ", "")
-                data = data.replace("bncht ", "")
-                data = data.replace("lmpt ", "")
-                data = data.replace("o3lt ", "")
-                data = data.replace("flowa ", "")
-                data = data.replace("flowb ", "")
-                data = data.replace("pres ", "")
-                data = data.replace("o3 ", "")
-
-                if save:
-                    if not os.path.exists(self.__datafile):
-                        # if file doesn't exist, create and write header
-                        with open(self.__datafile, "at", encoding='utf8') as fh:
-                            fh.write("time date flags o3 hio3 cellai cellbi bncht lmpt o3lt flowa flowb pres\n")
-                            fh.close()
-
-                    with open(self.__datafile, "at", encoding='utf8') as fh:
-                        fh.write(f"{data}\n")
-                        fh.close()
-
-                index = index - 10
+                                                     time.strftime("%Y%m%d%H%M%S"), ".dat"]))
+                self.__datafile = datafile
+
+            # retrieve all lrec records stored in buffer, as ASCII without labels
+            download = bulkdownload.BulkDownload(comm=self.tcpip_comm,
+                                                 probe=lambda cmd: self.tcpip_comm(cmd, probe=True),
+                                                 datafile=datafile,
+                                                 header="time date flags o3 hio3 cellai cellbi bncht lmpt o3lt flowa flowb pres",
+                                                 cmd="lrec",
+                                                 period=self._sampling_interval,
+                                                 transform=lrec.strip_labels,
+                                                 fmt="0")
+            stats = download.run()
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} .get_all_lrec (name={self.__name}) "
+                  f"{stats['records']} records in {stats['seconds']:.1f} s ({stats['records_per_second']:.1f}/s)")
+
+            if save and self._staging:
+                # stage data for transfer, in the background
+                self._staging.submit(self.__datafile, compress=self._zip)
+
+            return stats
+
+        except Exception as err:
+            if self._log:
+                self._logger.error(err)
+            print(err)
+
+
+    def sync_lrec(self, save=True) -> dict:
+        """
+        Download the lrec records that are newer than the newest record stored for this instrument.
+
+        Falls back to get_all_lrec if nothing has been stored yet.
+
+        :param bln save: Should data be saved to file? default=True
+        :return dict statistics of the download, see bulkdownload.BulkDownload.run
+        """
+        try:
+            dtm = time.strftime('%Y-%m-%d %H:%M:%S')
+            since = bulkdownload.newest_record(os.path.join(self._datadir, f"{self.__name}*.dat"))
+            print(f"{dtm} .sync_lrec (name={self.__name}, save={save}, since={since})")
+            if since is None:
+                return self.get_all_lrec(save=save)
 
+            datafile = None
             if save:
-                # stage data for transfer
-                root = os.path.join(self._staging, os.path.basename(self._datadir))
-                os.makedirs(root, exist_ok=True)
-                if self._zip:
-                    # create zip file
-                    archive = os.path.join(root, "".join([os.path.basename(self.__datafile[:-4]), ".zip"]))
-                    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as fh:
-                        fh.write(self.__datafile, os.path.basename(self.__datafile))
-                else:
-                    shutil.copyfile(self.__datafile, os.path.join(root, os.path.basename(self.__datafile)))
+                datafile = os.path.join(self._datadir,
+                                        "".join([self.__name, "_sync_lrec-", time.strftime("%Y%m%d%H%M%S"), ".dat"]))
+
+            download = bulkdownload.BulkDownload(comm=self.tcpip_comm,
+                                                 probe=lambda cmd: self.tcpip_comm(cmd, probe=True),
+                                                 datafile=datafile,
+                                                 header="time date flags o3 hio3 cellai cellbi bncht lmpt o3lt flowa flowb pres",
+                                                 cmd="lrec",
+                                                 period=self._sampling_interval,
+                                                 transform=lrec.strip_labels,
+                                                 fmt="0")
+            stats = download.sync(since)
+            if save and self._staging and os.path.exists(datafile):
+                # stage data for transfer, in the background
+                self._staging.submit(datafile, compress=self._zip)
+            if self._log:
+                self._logger.info(f"Synchronized {stats['records']} lrec of '{self.__name}' newer than {since}")
 
-            return data
+            return stats
 
         except Exception as err:
             if self._log:
@@ -391,7 +510,21 @@ class TEI49I:
             print(err)
 
 
+    def latest(self) -> dict:
+        """
+        Last sample of get_data, unless it is older than two sampling intervals.
+
+        :return dict of column name: value, see ringbuffer.RingBuffer.latest, or None
+        """
+        return self._buffer.latest(max_age=120 * self._sampling_interval)
+
+
     def get_o3(self) -> str:
+        """
+        Query ozone from the instrument. For the last sample of get_data, see latest.
+
+        :return str response of the instrument, e.g. 'o3 30.1 ppb'
+        """
         try:
             return self.tcpip_comm('o3')
 
@@ -403,10 +536,19 @@ class TEI49I:
 
     def print_o3(self) -> None:
         try:
+            sample = self.latest()
+            if sample:
+                dtm = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sample['dtm']))
+                n = max(1, 60 // self._sampling_interval)
+                if self._log:
+                    self._logger.info(f"[{self.__name}] o3 {sample['o3']} ppb at {dtm} (1h mean "
+                                      f"{self._buffer.mean('o3', n):.2f}, std {self._buffer.std('o3', n):.2f})",
+                                      extra={'_color': colorama.Fore.GREEN})
+                return
             o3 = self.tcpip_comm('O3').split()
-            print(colorama.Fore.GREEN + "%s [%s] %s %s %s" % (time.strftime("%Y-%m-%d %H:%M:%S"),
-                                                        self.__name,
-                                                        o3[0], str(float(o3[1])), o3[2]))
+            if self._log:
+                self._logger.info("[%s] %s %s %s" % (self.__name, o3[0], str(float(o3[1])), o3[2]),
+                                  extra={'_color': colorama.Fore.GREEN})
 
         except Exception as err:
             if self._log:
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Align the ozone readings of any number of analyzers with those of the calibrator.
+
+Samples of different instruments are taken by separate jobs and their timestamps differ by seconds. Instead of
+joining on equal timestamps, each analyzer is matched to the calibrator with a sorted as-of join: every calibrator
+sample gets the nearest sample of each analyzer within a tolerance. The result is one wide frame, e.g.
+
+    dtm                  o3_tei49c-ps  o3_tei49i_1  o3_tei49i_2
+    2023-10-19 12:00:05  50.12         49.87        50.31
+
+    df = comparison.compare(cfg, start="2023-10-19", end="2023-10-20")
+
+Requires polars.
+"""
+
+import datetime
+import sqlite3
+
+import polars as pl
+
+import thermo.common.parquetstore as parquetstore
+import thermo.common.qc as qc
+import thermo.sqlite.ingest as ingest
+
+
+def align(frames: dict, reference: str, tolerance=30, strategy='nearest'):
+    """
+    Align instruments with a reference instrument.
+
+    :param frames: dictionary of name: data frame with columns dtm (datetime) and o3
+    :param reference: name of the reference instrument (the calibrator). Its timestamps define the rows.
+    :param tolerance: seconds, maximum time difference of matched samples
+    :param strategy: 'nearest', 'backward' or 'forward', see polars.DataFrame.join_asof
+    :return: polars.DataFrame with columns dtm and o3_<name> per instrument, sorted by dtm
+    """
+    tolerance = datetime.timedelta(seconds=tolerance)
+    wide = _prepare(frames[reference], reference)
+    for name, df in frames.items():
+        if name == reference:
+            continue
+        wide = wide.join_asof(_prepare(df, name), on='dtm', strategy=strategy, tolerance=tolerance)
+    return wide
+
+
+def _prepare(df, name: str):
+    return (df.lazy()
+            .select(pl.col('dtm').cast(pl.Datetime('us')), pl.col('o3').cast(pl.Float64).alias(f"o3_{name}"))
+            .drop_nulls('dtm')
+            .sort('dtm')
+            .collect()
+            .set_sorted('dtm'))
+
+
+def load_parquet(path: str, names: list, start=None, end=None, rules=None) -> dict:
+    """
+    Read dtm and o3 of instruments from the parquet store.
+
+    :param path: root directory of the store, see parquetstore
+    :param names: names of instruments
+    :param start: see parquetstore.files
+    :param end: see parquetstore.files
+    :param rules: dictionary of name: qc rules, see qc.rules_for. Only the clean records of these instruments are read,
+                  like from the V_O3_<table>_clean views of the sqlite database.
+    :return: dictionary of name: polars.DataFrame
+    """
+    frames = {}
+    for name in names:
+        checks = (rules or {}).get(name)
+        if checks:
+            # flags are stored as hex text
+            frames[name] = parquetstore.read(path, name, start=start, end=end, columns=['dtm', 'o3'],
+                                             where=qc.expression(checks, text=True) == 0)
+        else:
+            frames[name] = parquetstore.read(path, name, start=start, end=end, columns=['dtm', 'o3'])
+    return frames
+
+
+def load_sqlite(db: str, names: list, start=None, end=None, clean=True, tables=None) -> dict:
+    """
+    Read dtm and o3 of instruments from the sqlite database. The range query is served by the dtm index.
+
+    :param db: path of database file
+    :param names: names of instruments
+    :param start: first timestamp to include, 'YYYY-MM-DD[ HH:MM:SS]'
+    :param end: end of period (exclusive), 'YYYY-MM-DD[ HH:MM:SS]'
+    :param clean: read the clean records (V_O3_<table>_clean) rather than all records
+    :param tables: dictionary of name: instrument table, see ingest.table_for. Default: tables named like instruments.
+    :return: dictionary of name: polars.DataFrame
+    """
+    frames = {}
+    with sqlite3.connect(db) as con:
+        for name in names:
+            table = (tables or {}).get(name, name)
+            source = f"V_O3_{table}_clean" if clean else table
+            rows = con.execute(f'SELECT dtm, o3 FROM "{source}" WHERE dtm >= ? AND dtm < ? ORDER BY dtm',
+                               (str(start or ""), str(end or "9999-12-31"))).fetchall()
+            frames[name] = (pl.DataFrame(rows, schema={'dtm': pl.Utf8, 'o3': pl.Float64}, orient='row')
+                            .with_columns(pl.col('dtm').str.to_datetime('%Y-%m-%d %H:%M:%S')))
+    return frames
+
+
+def compare(cfg: dict, start=None, end=None, tolerance=None, db=None):
+    """
+    Align all analyzers of a configuration with the calibrator.
+
+    :param cfg: configuration, see thermo.cfg
+        - cfg['calibrator']['name']
+        - cfg['analyzers']
+        - cfg['calibrator']['tolerance'], optional, seconds (default 30)
+        - cfg['parquet']['path'], used unless db is given
+        - cfg['qc'], optional, qc rules of the records read from the parquet store (default: qc.RULES)
+        - cfg[name]['table'], optional, instrument table in db, see ingest.table_for
+    :param start: beginning of period
+    :param end: end of period (exclusive)
+    :param tolerance: seconds, see align, default cfg['calibrator']['tolerance']
+    :param db: read from this sqlite database instead of the parquet store
+    :return: polars.DataFrame, see align
+    """
+    reference = cfg['calibrator']['name']
+    names = [reference] + [name for name in cfg['analyzers'] if name != reference]
+    if db:
+        frames = load_sqlite(db, names, start, end, tables={name: ingest.table_for(name, cfg) for name in names})
+    else:
+        frames = load_parquet(cfg['parquet']['path'], names, start, end,
+                              rules={name: qc.rules_for(name, config=cfg.get('qc')) for name in names})
+    if tolerance is None:
+        tolerance = cfg['calibrator'].get('tolerance', 30)
+    return align(frames, reference, tolerance=tolerance)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,15 +1,28 @@
 # -*- coding: utf-8 -*-
+import datetime
 import os
 
-from mkndaq.utils.configparser import config
+import polars as pl
+
+import thermo.common.catalog as catalog
+import thermo.common.decode as decode
+
+# one catalog per data directory, kept between calls
+_catalogs = {}
 
 
 def extract_recent_data(cfg, name=None, y=None, hours=6) -> object:
     """
     Select and import data files for a specified period into the past.
 
+    Files are selected from a catalog of the data directory rather than by listing it, and each file is read only
+    from where the previous call stopped, see catalog.FileCatalog.
+
+    :param dict cfg: configuration, see thermo.cfg. Uses cfg['data'].
+    :param str name: name of instrument, defaults to 'tei49i'
+    :param str y: observed quantity, defaults to 'o3'
     :param int hours: numbers of hours to go back in time, defaults to 6
-    :return:
+    :return: polars.DataFrame with columns dtm and y, sorted by time ascending
     """
     try:
         if name is None:
@@ -18,24 +31,30 @@ def extract_recent_data(cfg, name=None, y=None, hours=6) -> object:
         if y is None:
             y = 'o3'
 
-        # time stamp of earliest file to include
-        earliest = int((datetime.datetime.utcnow() - datetime.timedelta(hours=6)).strftime("%Y%m%d%H%M"))
+        datadir = os.path.expanduser(cfg['data'])
+        if datadir not in _catalogs:
+            _catalogs[datadir] = catalog.FileCatalog(datadir)
 
-        # select data files
-        files = os.listdir(os.path.expanduser(cls._datadir))
-#            dtm = max(files).rstrip('.dat').split('-')[1]
-#            ct = time.strptime(current_timestamp, "%Y%m%d%H%M")
+        # records are time stamped with the local time of the pc
+        earliest = datetime.datetime.now() - datetime.timedelta(hours=hours)
 
-        data = []
-        for file in files:
-            timestamp = int(file.rstrip('.dat').split('-')[1])
-            if timestamp > earliest:
-                # read file using pandas pd.read_csv
-                # extract dtm and values of observed quantity y
-                data.append([])
-                # sort data by time ascending
+        # files written with the same header are decoded together
+        batches = {}
+        for path, header, records in _catalogs[datadir].recent(name, hours=hours):
+            if records and y in header:
+                batches.setdefault(tuple(header), []).extend(records)
+        frames = [decode.decode(list(header), records).select('dtm', y) for header, records in batches.items()]
+        if not frames:
+            return pl.DataFrame(schema={'dtm': pl.Datetime('us'), y: pl.Float64})
 
-        return data
+        return (pl.concat(frames)
+                .filter(pl.col('dtm') >= earliest)
+                .unique(subset='dtm', keep='last')
+                .sort('dtm'))
 
     except Exception as err:
         print(err)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,47 +1,25 @@
 # %%
-import os
-import pandas as pd
-import sqlite3
-import zipfile
+import thermo.sqlite.ingest as ingest
 
-file = "C:\Users\localadmin\Documents\data\minix\thermo\tei49c\tei49c_all_lrec-20221125204600.dat"
+file = r"C:\Users\localadmin\Documents\data\minix\thermo\tei49c\tei49c_all_lrec-20221125204600.dat"
+db = r"C:\Users\localadmin\Documents\data\minix\thermo\thermo.sqlite"
 year = 2022
 
 # %%
-def read_tei49c_file(file: str, year: int):
+def read_tei49c_file(file: str, year: int, db: str, tbl="tei49c") -> int:
+    """
+    Import a datafile (or zip archive of datafiles) into the sqlite database.
+
+    :param file: path of .dat or .zip file
+    :param year: year of records, used if the file has no pc timestamps
+    :param db: path of database file, created with schema.sql if necessary
+    :param tbl: name of instrument table
+    :return: number of records imported
+    """
     try:
-        year = str(year) + "-"
-
         print(f"Processing {file} ...")
-        df = pd.DataFrame()
-
-        if ".zip" in file:
-            with zipfile.ZipFile(file=file, mode="r") as zf:
-                for file in zf.namelist():
-                    with zf.open(file, mode="r") as obj:
-                        df
-                        df = pd.read_csv(obj, sep="\s+", engine='python')
-        else:
-            df = pd.read_csv(file, sep="\s+", engine='python')
-            df.reset_index(inplace=True)
-            if "level_0" in df.columns:
-                df.rename(columns={'level_0': 'pcdate', 'level_1': 'pctime'}, inplace=True)
-            if "pcdate" in df.columns:
-                df['dtm'] = pd.to_datetime(df['pcdate'] + ' ' + df['pctime'])
-            else:
-                if "tei49c" in tbl:
-                    df['dtm'] = pd.to_datetime(year + df['date'] + ' ' + df['time'])
-                else:
-                    df['dtm'] = pd.to_datetime(df['date'] + ' ' + df['time'])
-            df['source'] = os.path.join(archive, file)
-            if 'hio3' in df.columns:
-                df.drop(columns='hio3', inplace=True)
-            if 'o3lt' in df.columns:
-                df.drop(columns='o3lt', inplace=True)
-            df.set_index('dtm', inplace=True)
-            if 'index' in df.columns:
-                df.drop(columns='index', inplace=True)
-            res = df2sqlite.df2sqlite(df, db, tbl)
+        with ingest.Ingestor(db) as ingestor:
+            return ingestor.ingest_file(file, tbl, year=year)
     except Exception as err:
         print(err)
 
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Import datafiles of TEI49C and TEI49i instruments into the sqlite database defined by schema.sql.
+
+Rows are inserted with executemany in large transactions, on a connection in WAL mode with tuned pragmas. Each
+instrument table has a unique index on dtm, so records imported more than once (e.g., from overlapping downloads of
+the logger buffer) are upserted rather than duplicated. Triggers maintain hourly and daily aggregates of the clean
+records as rows are ingested. Records are checked as they are imported, and the result stored in the column qc (0 for
+clean records), see thermo/common/qc.py.
+
+    with Ingestor("thermo.sqlite") as ingestor:
+        ingestor.ingest_file("tei49c-202211252100.dat", "tei49c")
+
+or from the command line:
+
+    python -m thermo.sqlite.ingest thermo.sqlite ~/data/tei49c --table tei49c --workers 8
+    python -m thermo.sqlite.ingest thermo.sqlite --rebuild
+    python -m thermo.sqlite.ingest thermo.sqlite --requalify --config thermo.cfg
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import itertools
+import logging
+import operator
+import os
+import sqlite3
+
+import polars as pl
+
+import thermo.common.configparser as configparser
+import thermo.common.datfile as datfile
+import thermo.common.decode as decode
+import thermo.common.qc as qc
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+# instrument table of schema.sql by instrument type, unless the instrument names its table in thermo.cfg (table: ...)
+TABLES = {'TEI49C': 'tei49c', 'TEI49C-PS': 'tei49c', 'TEI49I': 'tei49i'}
+
+# aggregate tables <table>_<period> and the format of their timestamps
+AGGREGATES = {'hourly': '%Y-%m-%d %H:00:00', 'daily': '%Y-%m-%d 00:00:00'}
+
+PRAGMAS = {
+    'journal_mode': 'WAL',          # readers do not block the import, and vice versa
+    'synchronous': 'NORMAL',        # durable at checkpoints, safe with WAL
+    'temp_store': 'MEMORY',
+    'cache_size': -262144,          # KiB, i.e., 256 MiB page cache for index maintenance
+    'mmap_size': 1073741824,
+}
+
+
+def connect(db: str, pragmas=None) -> sqlite3.Connection:
+    """
+    Open a database for bulk import.
+
+    :param db: path of database file
+    :param pragmas: dictionary of pragmas, default PRAGMAS
+    :return: connection, in autocommit mode; transactions are explicit
+    """
+    con = sqlite3.connect(db, isolation_level=None)
+    for key, value in (PRAGMAS if pragmas is None else pragmas).items():
+        con.execute(f"PRAGMA {key}={value}")
+    return con
+
+
+def table_for(name: str, cfg=None) -> str:
+    """
+    Select the instrument table of an instrument.
+
+    :param name: name of instrument, e.g. 'tei49c-ps'
+    :param cfg: configuration, see thermo.cfg
+        - cfg[name]['table'], optional
+        - cfg[name]['type'], used unless table is given
+    :return: name of table, see TABLES. Default: the name of the instrument.
+    """
+    settings = (cfg or {}).get(name) or {}
+    return settings.get('table') or TABLES.get(str(settings.get('type', '')).upper()) or name
+
+
+def table_rows(file: str, available: list, year=None, rules=None):
+    """
+    Convert the records of a datafile to rows of an instrument table, see Ingestor.ingest_file.
+
+    :param file: path of .dat or .zip file
+    :param available: names of the columns of the table
+    :param year: see Ingestor.ingest_file
+    :param rules: qc rules of the table, see qc.rules_for. Default: iflags and qc are not set.
+    :return: generator of (names of columns, generator of rows) per batch of records. Batches with no values for the
+             table are skipped, with a warning.
+    """
+    for name, header, batch in datfile.token_batches(file):
+        # values of the file that have a column in the table
+        index = [i for i, column in enumerate(header) if column in available and column != 'dtm']
+        if not index:
+            logging.getLogger(__name__).warning(f"{name}: no column of the header '{' '.join(header)}' is in the "
+                                                f"table, {len(batch)} records skipped")
+            continue
+        columns = ['dtm'] + [header[i] for i in index] + ['source']
+        source = os.path.join(file, name) if file.endswith(".zip") else file
+
+        values = operator.itemgetter(*index) if len(index) > 1 else lambda tokens: (tokens[index[0]], )
+        tail = (source, )
+
+        # flags as integer and result of qc, computed for the whole batch
+        if rules is not None and 'qc' in available and 'flags' in header:
+            checked = (decode.values(header, batch, qc.columns(rules))
+                       .select(pl.col('flags').alias('iflags'), qc.expression(rules).alias('qc')))
+            columns += ['iflags', 'qc']
+            checks = zip(checked['iflags'].to_list(), checked['qc'].to_list())
+        else:
+            checks = itertools.repeat(())
+
+        if 'pcdate' in header:
+            pcdate, pctime = header.index('pcdate'), header.index('pctime')
+            rows = ((f"{tokens[pcdate]} {tokens[pctime]}", ) + values(tokens) + tail + check
+                    for tokens, check in zip(batch, checks))
+        else:
+            tm, dt = header.index('time'), header.index('date')
+            reference = year if year is not None else (datfile.file_time(name) or datfile.file_time(file))
+            dtms = decode.instrument_times([tokens[tm] for tokens in batch], [tokens[dt] for tokens in batch],
+                                           reference).dt.strftime("%Y-%m-%d %H:%M:%S").to_list()
+            rows = ((dtm, ) + values(tokens) + tail + check
+                    for dtm, tokens, check in zip(dtms, batch, checks) if dtm is not None)
+        yield columns, rows
+
+
+def _parse(file: str, available: list, year, rules) -> tuple:
+    # runs in a worker process: hash the file and convert its records
+    sha256 = hashlib.sha256()
+    with open(file, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest(), [(columns, list(rows)) for columns, rows in table_rows(file, available, year, rules)]
+
+
+def find_files(paths: list) -> list:
+    """
+    Expand directories into the datafiles they contain.
+
+    :param paths: paths of files or directories
+    :return: sorted paths of .dat and .zip files
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.endswith((".dat", ".zip")))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+class Ingestor:
+    """
+    Bulk import of datafiles into one database.
+    """
+
+    _con = None
+
+    def __init__(self, db: str, schema=SCHEMA, batch_size=100000, rules=None) -> None:
+        """
+        Open database and create tables, indexes and views if necessary.
+
+        :param db: path of database file
+        :param schema: path of sql script defining the database
+        :param batch_size: number of rows per transaction
+        :param rules: qc rules by instrument name or type, i.e., cfg['qc']. Default: qc.RULES
+        """
+        self._con = connect(db)
+        self._batch_size = batch_size
+        self._columns = {}
+        self._rules = rules
+        migrated = self._migrate()
+        with open(schema, "r", encoding='utf8') as fh:
+            self._con.executescript(fh.read())
+        for table in migrated:
+            self.requalify(table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.execute("PRAGMA optimize")
+            self._con.close()
+            self._con = None
+
+    def _migrate(self) -> list:
+        # add the columns of qc to instrument tables created before they existed
+        migrated = []
+        for table, in self._con.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+            names = [row[1] for row in self._con.execute(f'PRAGMA table_info("{table}")')]
+            if 'flags' in names and 'qc' not in names:
+                self._con.execute(f'ALTER TABLE "{table}" ADD COLUMN "iflags" INTEGER')
+                self._con.execute(f'ALTER TABLE "{table}" ADD COLUMN "qc" INTEGER')
+                migrated.append(table)
+        return migrated
+
+    def rules(self, table: str) -> dict:
+        """
+        :return: qc rules of an instrument table, see qc.rules_for
+        """
+        return qc.rules_for(table, config=self._rules)
+
+    def columns(self, table: str) -> list:
+        """
+        :return: names of the columns of table
+        """
+        if table not in self._columns:
+            self._columns[table] = [row[1] for row in self._con.execute(f'PRAGMA table_info("{table}")')]
+            if not self._columns[table]:
+                raise ValueError(f"no such table: {table}")
+        return self._columns[table]
+
+    def upsert(self, table: str, columns: list, rows) -> int:
+        """
+        Insert rows, replacing the values of existing rows with the same dtm.
+
+        :param table: name of table
+        :param columns: names of columns, including dtm
+        :param rows: iterable of sequences of values, in the order of columns
+        :return: number of rows
+        """
+        names = ", ".join(f'"{column}"' for column in columns)
+        updates = ", ".join(f'"{column}"=excluded."{column}"' for column in columns if column != 'dtm')
+        sql = (f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * len(columns))}) '
+               f'ON CONFLICT("dtm") DO UPDATE SET {updates}')
+
+        count = 0
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self._batch_size))
+            if not batch:
+                return count
+            count += self._execute(sql, batch)
+
+    def _execute(self, sql: str, batch: list) -> int:
+        with self.transaction():
+            self._con.executemany(sql, batch)
+        return len(batch)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run statements in one transaction. Nested use joins the outer transaction.
+        """
+        if self._con.in_transaction:
+            yield self
+            return
+        self._con.execute("BEGIN")
+        try:
+            yield self
+            self._con.execute("COMMIT")
+        except BaseException:
+            self._con.execute("ROLLBACK")
+            raise
+
+    @contextlib.contextmanager
+    def bulk(self, table: str):
+        """
+        Drop the secondary indexes and triggers of a table for the duration of a large import, and rebuild indexes
+        and aggregates afterwards. Building an index once over all rows is much faster than maintaining it row by row.
+
+        :param table: name of table
+        """
+        dropped = self._con.execute("SELECT type, name, sql FROM sqlite_master WHERE tbl_name=? AND sql IS NOT NULL "
+                                    "AND (type='trigger' OR type='index' AND sql NOT LIKE 'CREATE UNIQUE%')",
+                                    (table, )).fetchall()
+        for kind, name, _ in dropped:
+            self._con.execute(f'DROP {kind.upper()} "{name}"')
+        try:
+            yield self
+        finally:
+            for _, _, sql in dropped:
+                self._con.execute(sql)
+            self.rebuild(table)
+
+    def tables(self) -> list:
+        """
+        :return: names of the instrument tables, i.e., tables with a V_O3_<table>_clean view
+        """
+        views = self._con.execute("SELECT name FROM sqlite_master WHERE type='view' AND name LIKE 'V_O3_%_clean'")
+        return [name[len("V_O3_"):-len("_clean")] for name, in views]
+
+    def rebuild(self, table=None) -> None:
+        """
+        Regenerate the hourly and daily aggregates of the clean records.
+
+        :param table: name of instrument table, default: all
+        """
+        for tbl in [table] if table else self.tables():
+            self._con.execute("BEGIN")
+            try:
+                for period, fmt in AGGREGATES.items():
+                    self._con.execute(f'DELETE FROM "{tbl}_{period}"')
+                    self._con.execute(f'INSERT INTO "{tbl}_{period}" (dtm, n, o3sum, o3sumsq) '
+                                      f"SELECT strftime('{fmt}', dtm), count(*), sum(o3), sum(o3 * o3) "
+                                      f'FROM "V_O3_{tbl}_clean" GROUP BY 1')
+                self._con.execute("COMMIT")
+            except Exception:
+                self._con.execute("ROLLBACK")
+                raise
+
+    def requalify(self, table=None) -> None:
+        """
+        Check all records again, e.g., after changing the qc rules, and regenerate the aggregates. The check is one
+        UPDATE with the bitwise expression of qc.sql.
+
+        :param table: name of instrument table, default: all
+        """
+        for tbl in [table] if table else self.tables():
+            with self.bulk(tbl), self.transaction():
+                # records imported before the integer flags were stored
+                rows = self._con.execute(f'SELECT rowid, flags FROM "{tbl}" '
+                                         f'WHERE iflags IS NULL AND flags IS NOT NULL').fetchall()
+                self._con.executemany(f'UPDATE "{tbl}" SET iflags = ? WHERE rowid = ?',
+                                      [(qc.flags_to_int(flags), rowid) for rowid, flags in rows])
+                self._con.execute(f'UPDATE "{tbl}" SET qc = {qc.sql(self.rules(tbl))}')
+
+    def ingest_files(self, files: list, table: str, year=None) -> int:
+        """
+        Import many datafiles into one table, see ingest_file.
+
+        :param files: paths of .dat or .zip files
+        :param table: name of instrument table
+        :param year: see ingest_file
+        :return: number of rows imported
+        """
+        count = 0
+        with self.bulk(table):
+            for file in files:
+                count += self.ingest_file(file, table, year=year)
+        return count
+
+    def changed(self, files: list) -> list:
+        """
+        Select the files that are not in the manifest, or have changed since they were imported. Files with a new
+        size or mtime are compared by content later, see import_files.
+
+        :param files: paths of files
+        :return: list of (path, size, mtime) of files to import
+        """
+        manifest = {path: (size, mtime) for path, size, mtime in
+                    self._con.execute("SELECT path, size, mtime FROM manifest")}
+        selected = []
+        for file in files:
+            stat = os.stat(file)
+            path = os.path.abspath(file)
+            if manifest.get(path) != (stat.st_size, stat.st_mtime):
+                selected.append((path, stat.st_size, stat.st_mtime))
+        return selected
+
+    def import_files(self, files: list, table: str, year=None, workers=None, bulk=None) -> dict:
+        """
+        Import datafiles not imported before, or changed since, parsing them in parallel processes.
+
+        Files are parsed by a pool of worker processes, and written by this process, in the order of files. Each file
+        is written in one transaction, together with its entry in the manifest (path, size, mtime, sha256), so that
+        an interrupted import resumes with the first file not completed.
+
+        :param files: paths of .dat or .zip files, in the order they should be applied (later files win)
+        :param table: name of instrument table
+        :param year: see ingest_file
+        :param workers: number of worker processes, default: number of CPUs
+        :param bulk: drop indexes and triggers during the import, see bulk. Default: if more than 100 files change.
+        :return: number of files imported, skipped and unchanged by content, and number of rows
+        """
+        todo = self.changed(files)
+        hashes = dict(self._con.execute("SELECT path, sha256 FROM manifest"))
+        stats = {'files': 0, 'skipped': len(files) - len(todo), 'unchanged': 0, 'rows': 0}
+        if not todo:
+            return stats
+        if bulk is None:
+            bulk = len(todo) > 100
+
+        available = self.columns(table)
+        rules = self.rules(table)
+        workers = workers or os.cpu_count() or 1
+        queued = iter(todo)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor, \
+                (self.bulk(table) if bulk else contextlib.nullcontext()):
+            # keep a few files per worker in flight, and apply results in the order of files
+            pending = collections.deque()
+            for item in itertools.islice(queued, 4 * workers):
+                pending.append((item, executor.submit(_parse, item[0], available, year, rules)))
+            while pending:
+                (path, size, mtime), future = pending.popleft()
+                item = next(queued, None)
+                if item is not None:
+                    pending.append((item, executor.submit(_parse, item[0], available, year, rules)))
+                sha256, members = future.result()
+
+                with self.transaction():
+                    if hashes.get(path) == sha256:
+                        # touched, but same content
+                        stats['unchanged'] += 1
+                        rows = self._con.execute("SELECT records FROM manifest WHERE path=?", (path, )).fetchone()[0]
+                    else:
+                        rows = sum(self.upsert(table, columns, values) for columns, values in members)
+                        stats['files'] += 1
+                        stats['rows'] += rows
+                    self._con.execute("INSERT OR REPLACE INTO manifest (path, size, mtime, sha256, tbl, records, "
+                                      "imported) VALUES (?, ?, ?, ?, ?, ?, datetime('now'))",
+                                      (path, size, mtime, sha256, table, rows))
+        return stats
+
+    def ingest_file(self, file: str, table: str, year=None) -> int:
+        """
+        Import a datafile written by get_data, get_all_lrec or get_all_rec, or a zip archive of such files.
+
+        Values are stored as found in the file; sqlite converts them according to the column types. dtm is the pc
+        timestamp if the file has one, and the instrument timestamp otherwise. The flags are also stored as integer
+        (iflags), and the result of qc in qc.
+
+        :param file: path of .dat or .zip file
+        :param table: name of instrument table
+        :param year: year of records without year (TEI49C) and without pc timestamp, see decode.instrument_times.
+                     Default: the year closest to the timestamp in the file name.
+        :return: number of rows imported
+        """
+        count = 0
+        for columns, rows in table_rows(file, self.columns(table), year=year, rules=self.rules(table)):
+            count += self.upsert(table, columns, rows)
+        return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import datafiles into the sqlite database.")
+    parser.add_argument('db', help="database file, created if necessary")
+    parser.add_argument('files', nargs='*', help=".dat or .zip files, or directories, to import")
+    parser.add_argument('--table', help="instrument table to import into")
+    parser.add_argument('--year', type=int, help="year of records without year and pc timestamp")
+    parser.add_argument('--workers', type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--rebuild', action='store_true', help="regenerate hourly and daily aggregates")
+    parser.add_argument('--requalify', action='store_true', help="check all records again with the qc rules")
+    parser.add_argument('--config', help="configuration file with qc rules (default: qc.RULES)")
+    args = parser.parse_args()
+
+    if args.files and not args.table:
+        parser.error("--table is required to import files")
+
+    rules = configparser.read_config(args.config).get('qc') if args.config else None
+    with Ingestor(args.db, rules=rules) as ingestor:
+        if args.files:
+            stats = ingestor.import_files(find_files(args.files), args.table, year=args.year, workers=args.workers)
+            print(f"{stats['rows']} records from {stats['files']} files imported into {args.table}, "
+                  f"{stats['skipped'] + stats['unchanged']} files unchanged")
+        if args.requalify:
+            ingestor.requalify(args.table)
+            print(f"records of {args.table or ', '.join(ingestor.tables())} checked")
+        elif args.rebuild:
+            ingestor.rebuild(args.table)
+            print(f"aggregates of {args.table or ', '.join(ingestor.tables())} rebuilt")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-CREATE TABLE "tei49c" (
+CREATE TABLE IF NOT EXISTS "tei49c" (
 	"dtm"	TIMESTAMP NOT NULL,
 	"pcdate"	TEXT,
 	"pctime"	TEXT,
@@ -6,6 +6,7 @@ CREATE TABLE "tei49c" (
 	"date"	TEXT,
 	"o3"	REAL,
 	"flags"	TEXT,
+	"iflags"	INTEGER,
 	"cellai"	INTEGER,
 	"cellbi"	INTEGER,
 	"bncht"	REAL,
@@ -13,10 +14,18 @@ CREATE TABLE "tei49c" (
 	"flowa"	REAL,
 	"flowb"	REAL,
 	"pres"	REAL,
-	"source"	TEXT
-)
+	"source"	TEXT,
+	"qc"	INTEGER
+);
 
-CREATE TABLE "tei49i" (
+-- one record per timestamp; duplicates are upserted
+CREATE UNIQUE INDEX IF NOT EXISTS "ux_tei49c_dtm" ON "tei49c" ("dtm");
+
+-- serves the V_O3_tei49c_clean view, qc = 0, in order of dtm; covers queries of dtm and o3 of clean records
+DROP INDEX IF EXISTS "ix_tei49c_dtm_o3";
+CREATE INDEX IF NOT EXISTS "ix_tei49c_qc" ON "tei49c" ("qc", "dtm", "o3");
+
+CREATE TABLE IF NOT EXISTS "tei49i" (
 	"dtm"	TIMESTAMP NOT NULL,
 	"pcdate"	TEXT,
 	"pctime"	TEXT,
@@ -24,6 +33,7 @@ CREATE TABLE "tei49i" (
 	"date"	TEXT,
 	"o3"	REAL,
 	"flags"	TEXT,
+	"iflags"	INTEGER,
 	"cellai"	INTEGER,
 	"cellbi"	INTEGER,
 	"bncht"	REAL,
@@ -32,10 +42,18 @@ CREATE TABLE "tei49i" (
 	"flowa"	REAL,
 	"flowb"	REAL,
 	"pres"	REAL,
-	"source"	TEXT
-)
+	"source"	TEXT,
+	"qc"	INTEGER
+);
+
+-- one record per timestamp; duplicates are upserted
+CREATE UNIQUE INDEX IF NOT EXISTS "ux_tei49i_dtm" ON "tei49i" ("dtm");
+
+-- serves the V_O3_tei49i_clean view, qc = 0, in order of dtm; covers queries of dtm and o3 of clean records
+DROP INDEX IF EXISTS "ix_tei49i_dtm_o3";
+CREATE INDEX IF NOT EXISTS "ix_tei49i_qc" ON "tei49i" ("qc", "dtm", "o3");
 
-CREATE TABLE "tei49i_2" (
+CREATE TABLE IF NOT EXISTS "tei49i_2" (
 	"dtm"	TIMESTAMP NOT NULL,
 	"pcdate"	TEXT,
 	"pctime"	TEXT,
@@ -43,6 +61,7 @@ CREATE TABLE "tei49i_2" (
 	"date"	TEXT,
 	"o3"	REAL,
 	"flags"	TEXT,
+	"iflags"	INTEGER,
 	"cellai"	INTEGER,
 	"cellbi"	INTEGER,
 	"bncht"	REAL,
@@ -51,43 +70,243 @@ CREATE TABLE "tei49i_2" (
 	"flowa"	REAL,
 	"flowb"	REAL,
 	"pres"	REAL,
-	"source"	TEXT
-)
+	"source"	TEXT,
+	"qc"	INTEGER
+);
+
+-- one record per timestamp; duplicates are upserted
+CREATE UNIQUE INDEX IF NOT EXISTS "ux_tei49i_2_dtm" ON "tei49i_2" ("dtm");
+
+-- serves the V_O3_tei49i_2_clean view, qc = 0, in order of dtm; covers queries of dtm and o3 of clean records
+DROP INDEX IF EXISTS "ix_tei49i_2_dtm_o3";
+CREATE INDEX IF NOT EXISTS "ix_tei49i_2_qc" ON "tei49i_2" ("qc", "dtm", "o3");
+
+-- datafiles imported by thermo/sqlite/ingest.py; files are imported again only if they change
+CREATE TABLE IF NOT EXISTS "manifest" (
+	"path"	TEXT NOT NULL PRIMARY KEY,
+	"size"	INTEGER,
+	"mtime"	REAL,
+	"sha256"	TEXT,
+	"tbl"	TEXT,
+	"records"	INTEGER,
+	"imported"	TIMESTAMP
+) WITHOUT ROWID;
+
+-- Clean records have qc = 0. qc has one bit per failed check of the flags (as integer, iflags) and values, computed
+-- with the rules in thermo/common/qc.py as records are imported. After changing the rules, run:
+-- python -m thermo.sqlite.ingest <db> --requalify
+DROP VIEW IF EXISTS "V_O3_tei49c_clean";
+CREATE VIEW "V_O3_tei49c_clean" AS
+select * from tei49c where qc = 0 order by dtm;
+
+DROP VIEW IF EXISTS "V_O3_tei49i_clean";
+CREATE VIEW "V_O3_tei49i_clean" AS
+select * from tei49i where qc = 0 order by dtm;
+
+DROP VIEW IF EXISTS "V_O3_tei49i_2_clean";
+CREATE VIEW "V_O3_tei49i_2_clean" AS
+select * from tei49i_2 where qc = 0 order by dtm;
+
+-- Hourly and daily aggregates of the clean records, maintained by the triggers below as records are inserted,
+-- updated or deleted. To regenerate the aggregates, run: python -m thermo.sqlite.ingest <db> --rebuild
+
+CREATE TABLE IF NOT EXISTS "tei49c_hourly" (
+	"dtm"	TIMESTAMP NOT NULL PRIMARY KEY,
+	"n"	INTEGER NOT NULL,
+	"o3sum"	REAL NOT NULL,
+	"o3sumsq"	REAL NOT NULL,
+	"o3"	REAL GENERATED ALWAYS AS (o3sum / n) VIRTUAL,
+	"varo3"	REAL GENERATED ALWAYS AS (CASE WHEN n > 1 THEN (n * o3sumsq - o3sum * o3sum) / n / (n - 1) END) VIRTUAL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS "tei49c_daily" (
+	"dtm"	TIMESTAMP NOT NULL PRIMARY KEY,
+	"n"	INTEGER NOT NULL,
+	"o3sum"	REAL NOT NULL,
+	"o3sumsq"	REAL NOT NULL,
+	"o3"	REAL GENERATED ALWAYS AS (o3sum / n) VIRTUAL,
+	"varo3"	REAL GENERATED ALWAYS AS (CASE WHEN n > 1 THEN (n * o3sumsq - o3sum * o3sum) / n / (n - 1) END) VIRTUAL
+) WITHOUT ROWID;
+
+DROP TRIGGER IF EXISTS "tr_tei49c_aggregate_insert";
+CREATE TRIGGER "tr_tei49c_aggregate_insert" AFTER INSERT ON "tei49c"
+BEGIN
+  INSERT INTO "tei49c_hourly" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d %H:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+  INSERT INTO "tei49c_daily" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d 00:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+END;
+
+DROP TRIGGER IF EXISTS "tr_tei49c_aggregate_update";
+CREATE TRIGGER "tr_tei49c_aggregate_update" AFTER UPDATE OF dtm, qc, o3 ON "tei49c"
+BEGIN
+  UPDATE "tei49c_hourly" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49c_hourly" WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND n = 0;
+  UPDATE "tei49c_daily" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49c_daily" WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND n = 0;
+  INSERT INTO "tei49c_hourly" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d %H:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+  INSERT INTO "tei49c_daily" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d 00:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+END;
 
-CREATE VIEW "V_O3_tei49c_clean" AS 
-select * from tei49c 
-where (flags = "1c000000" or flags = "1c100500") and bncht > 23 and lmpt >= 55.5 and o3 > 5 
-order by dtm
+DROP TRIGGER IF EXISTS "tr_tei49c_aggregate_delete";
+CREATE TRIGGER "tr_tei49c_aggregate_delete" AFTER DELETE ON "tei49c"
+BEGIN
+  UPDATE "tei49c_hourly" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49c_hourly" WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND n = 0;
+  UPDATE "tei49c_daily" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49c_daily" WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND n = 0;
+END;
 
-CREATE VIEW "V_O3_tei49i_clean" as 
-select * from tei49i 
-where (flags = "0C100400" or flags = "0C104400" or flags = "0C100500" or flags = "0C104500") and o3 > 5
-order by dtm
+CREATE TABLE IF NOT EXISTS "tei49i_hourly" (
+	"dtm"	TIMESTAMP NOT NULL PRIMARY KEY,
+	"n"	INTEGER NOT NULL,
+	"o3sum"	REAL NOT NULL,
+	"o3sumsq"	REAL NOT NULL,
+	"o3"	REAL GENERATED ALWAYS AS (o3sum / n) VIRTUAL,
+	"varo3"	REAL GENERATED ALWAYS AS (CASE WHEN n > 1 THEN (n * o3sumsq - o3sum * o3sum) / n / (n - 1) END) VIRTUAL
+) WITHOUT ROWID;
 
-CREATE VIEW "V_O3_tei49i_2_clean" as 
-select * from tei49i_2 
-where (flags = "0C100000" or flags = "0C100100" or flags = "0C100400" or flags = "0C105000") and o3 > 10 
-order by dtm
+CREATE TABLE IF NOT EXISTS "tei49i_daily" (
+	"dtm"	TIMESTAMP NOT NULL PRIMARY KEY,
+	"n"	INTEGER NOT NULL,
+	"o3sum"	REAL NOT NULL,
+	"o3sumsq"	REAL NOT NULL,
+	"o3"	REAL GENERATED ALWAYS AS (o3sum / n) VIRTUAL,
+	"varo3"	REAL GENERATED ALWAYS AS (CASE WHEN n > 1 THEN (n * o3sumsq - o3sum * o3sum) / n / (n - 1) END) VIRTUAL
+) WITHOUT ROWID;
 
+DROP TRIGGER IF EXISTS "tr_tei49i_aggregate_insert";
+CREATE TRIGGER "tr_tei49i_aggregate_insert" AFTER INSERT ON "tei49i"
+BEGIN
+  INSERT INTO "tei49i_hourly" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d %H:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+  INSERT INTO "tei49i_daily" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d 00:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+END;
+
+DROP TRIGGER IF EXISTS "tr_tei49i_aggregate_update";
+CREATE TRIGGER "tr_tei49i_aggregate_update" AFTER UPDATE OF dtm, qc, o3 ON "tei49i"
+BEGIN
+  UPDATE "tei49i_hourly" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49i_hourly" WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND n = 0;
+  UPDATE "tei49i_daily" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49i_daily" WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND n = 0;
+  INSERT INTO "tei49i_hourly" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d %H:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+  INSERT INTO "tei49i_daily" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d 00:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+END;
+
+DROP TRIGGER IF EXISTS "tr_tei49i_aggregate_delete";
+CREATE TRIGGER "tr_tei49i_aggregate_delete" AFTER DELETE ON "tei49i"
+BEGIN
+  UPDATE "tei49i_hourly" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49i_hourly" WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND n = 0;
+  UPDATE "tei49i_daily" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49i_daily" WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND n = 0;
+END;
+
+CREATE TABLE IF NOT EXISTS "tei49i_2_hourly" (
+	"dtm"	TIMESTAMP NOT NULL PRIMARY KEY,
+	"n"	INTEGER NOT NULL,
+	"o3sum"	REAL NOT NULL,
+	"o3sumsq"	REAL NOT NULL,
+	"o3"	REAL GENERATED ALWAYS AS (o3sum / n) VIRTUAL,
+	"varo3"	REAL GENERATED ALWAYS AS (CASE WHEN n > 1 THEN (n * o3sumsq - o3sum * o3sum) / n / (n - 1) END) VIRTUAL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS "tei49i_2_daily" (
+	"dtm"	TIMESTAMP NOT NULL PRIMARY KEY,
+	"n"	INTEGER NOT NULL,
+	"o3sum"	REAL NOT NULL,
+	"o3sumsq"	REAL NOT NULL,
+	"o3"	REAL GENERATED ALWAYS AS (o3sum / n) VIRTUAL,
+	"varo3"	REAL GENERATED ALWAYS AS (CASE WHEN n > 1 THEN (n * o3sumsq - o3sum * o3sum) / n / (n - 1) END) VIRTUAL
+) WITHOUT ROWID;
+
+DROP TRIGGER IF EXISTS "tr_tei49i_2_aggregate_insert";
+CREATE TRIGGER "tr_tei49i_2_aggregate_insert" AFTER INSERT ON "tei49i_2"
+BEGIN
+  INSERT INTO "tei49i_2_hourly" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d %H:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+  INSERT INTO "tei49i_2_daily" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d 00:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+END;
+
+DROP TRIGGER IF EXISTS "tr_tei49i_2_aggregate_update";
+CREATE TRIGGER "tr_tei49i_2_aggregate_update" AFTER UPDATE OF dtm, qc, o3 ON "tei49i_2"
+BEGIN
+  UPDATE "tei49i_2_hourly" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49i_2_hourly" WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND n = 0;
+  UPDATE "tei49i_2_daily" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49i_2_daily" WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND n = 0;
+  INSERT INTO "tei49i_2_hourly" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d %H:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+  INSERT INTO "tei49i_2_daily" (dtm, n, o3sum, o3sumsq)
+  SELECT strftime('%Y-%m-%d 00:00:00', NEW.dtm), 1, NEW.o3, NEW.o3 * NEW.o3 WHERE NEW.qc = 0
+  ON CONFLICT(dtm) DO UPDATE SET n = n + 1, o3sum = o3sum + excluded.o3sum, o3sumsq = o3sumsq + excluded.o3sumsq;
+END;
+
+DROP TRIGGER IF EXISTS "tr_tei49i_2_aggregate_delete";
+CREATE TRIGGER "tr_tei49i_2_aggregate_delete" AFTER DELETE ON "tei49i_2"
+BEGIN
+  UPDATE "tei49i_2_hourly" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49i_2_hourly" WHERE dtm = strftime('%Y-%m-%d %H:00:00', OLD.dtm) AND n = 0;
+  UPDATE "tei49i_2_daily" SET n = n - 1, o3sum = o3sum - OLD.o3, o3sumsq = o3sumsq - OLD.o3 * OLD.o3
+  WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND OLD.qc = 0;
+  DELETE FROM "tei49i_2_daily" WHERE dtm = strftime('%Y-%m-%d 00:00:00', OLD.dtm) AND n = 0;
+END;
+
+DROP VIEW IF EXISTS "V_O3_tei49c_hourly";
 CREATE VIEW "V_O3_tei49c_hourly" AS
-select strftime('%Y-%m-%d %H:00:00', dtm) dtm, count(*) n, avg(o3) as o3,
- (count(*)*sum(o3*o3)-(sum(o3) * sum(o3)))/count(*)/(count(*)-1) varo3 
-from V_O3_tei49c_clean group by strftime('%Y-%m-%d %H:00:00', dtm) 
-order by strftime('%Y-%m-%d %H:00:00', dtm)
-
-CREATE VIEW "V_O3_tei49i_hourly" AS 
-select strftime('%Y-%m-%d %H:00:00', dtm) dtm, count(*) n, avg(o3) as o3,
- (count(*)*sum(o3*o3)-(sum(o3) * sum(o3)))/count(*)/(count(*)-1) varo3 
-from V_O3_tei49i_clean group by strftime('%Y-%m-%d %H:00:00', dtm) 
-order by strftime('%Y-%m-%d %H:00:00', dtm)
-
-CREATE VIEW "V_O3_tei49i_2_hourly" AS 
-select strftime('%Y-%m-%d %H:00:00', dtm) dtm, count(*) n, avg(o3) as o3,
- (count(*)*sum(o3*o3)-(sum(o3) * sum(o3)))/count(*)/(count(*)-1) varo3 
-from V_O3_tei49i_2_clean group by strftime('%Y-%m-%d %H:00:00', dtm) 
-order by strftime('%Y-%m-%d %H:00:00', dtm)
-
-CREATE VIEW "V_O3_comparison" AS 
+select dtm, n, o3, varo3 from "tei49c_hourly" where n > 0 order by dtm;
+
+DROP VIEW IF EXISTS "V_O3_tei49c_daily";
+CREATE VIEW "V_O3_tei49c_daily" AS
+select dtm, n, o3, varo3 from "tei49c_daily" where n > 0 order by dtm;
+
+DROP VIEW IF EXISTS "V_O3_tei49i_hourly";
+CREATE VIEW "V_O3_tei49i_hourly" AS
+select dtm, n, o3, varo3 from "tei49i_hourly" where n > 0 order by dtm;
+
+DROP VIEW IF EXISTS "V_O3_tei49i_daily";
+CREATE VIEW "V_O3_tei49i_daily" AS
+select dtm, n, o3, varo3 from "tei49i_daily" where n > 0 order by dtm;
+
+DROP VIEW IF EXISTS "V_O3_tei49i_2_hourly";
+CREATE VIEW "V_O3_tei49i_2_hourly" AS
+select dtm, n, o3, varo3 from "tei49i_2_hourly" where n > 0 order by dtm;
+
+DROP VIEW IF EXISTS "V_O3_tei49i_2_daily";
+CREATE VIEW "V_O3_tei49i_2_daily" AS
+select dtm, n, o3, varo3 from "tei49i_2_daily" where n > 0 order by dtm;
+
+-- matches on equal timestamps only; see thermo/postproc/comparison.py for any number of analyzers with a tolerance
+CREATE VIEW IF NOT EXISTS "V_O3_comparison" AS 
 select 
   tei49c.dtm, 
   tei49c.o3 o3_tei49c, 
@@ -121,14 +340,15 @@ left join V_O3_tei49c_clean tei49c
 using (dtm)
 left join V_O3_tei49i_clean tei49i 
 using (dtm)
-where tei49c.dtm is null and tei49i.dtm is null
+where tei49c.dtm is null and tei49i.dtm is null;
 
 -- can be improved along the lines of V_O3_comparison
-CREATE VIEW "V_O3_hourly_comparison" AS 
+CREATE VIEW IF NOT EXISTS "V_O3_hourly_comparison" AS 
 select dtm, o3 o3_tei49c, Null o3_tei49i, Null o3_tei49i_2 from V_O3_tei49c_hourly
 union
 select dtm, Null o3_tei49c, o3 o3_tei49i, Null o3_tei49i_2 from V_O3_tei49i_hourly
 union 
 select dtm, Null o3_tei49c, Null o3_tei49i, o3 o3_tei49i_2 from V_O3_tei49i_2_hourly
-order by dtm
+order by dtm;
+
 